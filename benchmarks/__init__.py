@@ -0,0 +1,5 @@
+"""Benchmarks for the billing, admin and data-loading hot paths.
+
+Run them with ``python manage.py run_benchmarks``; see
+:mod:`benchmarks.runner` for the measurements and the baseline comparison.
+"""
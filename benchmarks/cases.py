@@ -0,0 +1,83 @@
+"""Benchmark cases, run in order against a freshly seeded database.
+
+The first case seeds the dataset with ``generate_fake_data``; later cases
+bill it, render admin changelists, run the hot model queries and reports and
+export it. Dates are anchored to :data:`ANCHOR` so that runs on different
+days produce the same data.
+"""
+
+import os
+from datetime import date
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import Client
+from django.urls import reverse
+
+from core import billing, exports
+from core.models import Contract, Customer, CustomerBalance, Invoice, Service
+
+ANCHOR = date(2025, 6, 30)
+ADMIN_CHANGELISTS = ("customer", "contract", "service", "invoice")
+
+
+def build_cases(customers=1000, seed=1):
+    """Return the ``(name, func)`` pairs of the suite for a dataset size."""
+    client = Client()
+
+    def seed_dataset():
+        call_command("generate_fake_data", customers=customers, seed=seed, today=ANCHOR, stdout=StringIO())
+        user = get_user_model().objects.create(username="bench", is_staff=True, is_superuser=True)
+        client.force_login(user)
+        return Customer.objects.count() + Contract.objects.count() + Service.objects.count()
+
+    def generate_invoices():
+        return billing.generate_invoices(ANCHOR).invoices_created
+
+    def generate_invoices_up_to_date():
+        billing.generate_invoices(ANCHOR)
+        return Contract.objects.count()
+
+    def changelist(model_name):
+        def render():
+            response = client.get(reverse(f"admin:core_{model_name}_changelist"))
+            assert response.status_code == 200, response.status_code
+            return len(response.context["cl"].result_list)
+
+        return render
+
+    def invoices_by_customer():
+        rows = 0
+        for customer_id in Customer.objects.order_by("pk").values_list("pk", flat=True)[:200]:
+            rows += len(Invoice.objects.filter(customer_id=customer_id, reference_date__gte="2025-01"))
+        return rows
+
+    def customer_balances():
+        return sum(1 for _ in CustomerBalance.objects.filter(open_amount__gt=0).iterator())
+
+    def open_invoices():
+        return sum(1 for _ in Invoice.objects.filter(status=Invoice.WAITING).values_list("pk").iterator())
+
+    def revenue_report():
+        response = client.get(
+            reverse("core:revenue-report"), {"from": "2023-07", "to": "2025-06", "group_by": "month"}
+        )
+        assert response.status_code == 200, response.status_code
+        return len(response.json()["results"])
+
+    def export_invoices():
+        with open(os.devnull, "w") as sink:
+            return exports.export_invoices(sink, "csv")
+
+    return [
+        ("generate_fake_data", seed_dataset),
+        ("generate_invoices", generate_invoices),
+        ("generate_invoices_up_to_date", generate_invoices_up_to_date),
+        *((f"admin_changelist_{name}", changelist(name)) for name in ADMIN_CHANGELISTS),
+        ("query_invoices_by_customer", invoices_by_customer),
+        ("query_customer_balances", customer_balances),
+        ("query_open_invoices", open_invoices),
+        ("report_revenue_24_months", revenue_report),
+        ("export_invoices_csv", export_invoices),
+    ]
@@ -0,0 +1,155 @@
+"""HTTP load test for the read API, to compare ASGI and WSGI deployments.
+
+Start the same project twice against the same database, for example::
+
+    uvicorn erp_project.asgi:application --port 8001
+    gunicorn erp_project.wsgi --threads 8 --bind 127.0.0.1:8000
+
+(neither server is a project dependency; install them separately, or use
+``manage.py runserver`` as a WSGI stand-in) and run::
+
+    python -m benchmarks.load_test --username admin --password secret \\
+        --target asgi=http://127.0.0.1:8001 --target wsgi=http://127.0.0.1:8000
+
+Every target is logged in through the admin login form and then hit by
+``--concurrency`` threads, each holding a keep-alive connection, for
+``--duration`` seconds. The requests cycle through invoice and contract
+lists, customer-scoped invoice pages, details and the revenue report.
+Only the standard library is used.
+"""
+
+import argparse
+import http.client
+import http.cookiejar
+import json
+import statistics
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+
+def login(base_url, username, password):
+    """Log in through the admin and return the session cookie header."""
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    login_url = f"{base_url}/admin/login/"
+    opener.open(login_url).read()
+    token = next(cookie.value for cookie in jar if cookie.name == "csrftoken")
+    data = urllib.parse.urlencode({
+        "username": username,
+        "password": password,
+        "csrfmiddlewaretoken": token,
+        "next": "/admin/",
+    }).encode()
+    request = urllib.request.Request(login_url, data=data, headers={"Referer": login_url})
+    opener.open(request).read()
+    cookies = {cookie.name: cookie.value for cookie in jar}
+    if "sessionid" not in cookies:
+        raise SystemExit(f"Could not log in to {base_url} as {username}.")
+    return "; ".join(f"{name}={value}" for name, value in cookies.items())
+
+
+def build_paths(base_url, cookie):
+    """Return the request paths to cycle through, using ids found on the server."""
+    request = urllib.request.Request(f"{base_url}/api/customers/?limit=20", headers={"Cookie": cookie})
+    with urllib.request.urlopen(request) as response:
+        customers = [row["id"] for row in json.load(response)["results"]]
+    request = urllib.request.Request(f"{base_url}/api/invoices/?limit=20", headers={"Cookie": cookie})
+    with urllib.request.urlopen(request) as response:
+        invoices = json.load(response)["results"]
+
+    paths = ["/api/invoices/?limit=100", "/api/contracts/?limit=100", "/reports/revenue/?group_by=month"]
+    paths += [f"/api/invoices/?customer={customer_id}&limit=50" for customer_id in customers]
+    paths += [f"/api/invoices/{invoice['id']}/" for invoice in invoices]
+    paths += [f"/api/contracts/{invoice['contract_id']}/" for invoice in invoices if invoice["contract_id"]]
+    return paths
+
+
+def run_target(base_url, cookie, paths, concurrency, duration):
+    """Hit ``base_url`` for ``duration`` seconds; return latencies and error count."""
+    host = urllib.parse.urlsplit(base_url)
+    deadline = time.monotonic() + duration
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def worker(offset):
+        connection = http.client.HTTPConnection(host.hostname, host.port, timeout=30)
+        own, failed = [], 0
+        index = offset
+        while time.monotonic() < deadline:
+            path = paths[index % len(paths)]
+            index += 1
+            started = time.perf_counter()
+            try:
+                connection.request("GET", path, headers={"Cookie": cookie})
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    failed += 1
+                    continue
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close()
+                connection = http.client.HTTPConnection(host.hostname, host.port, timeout=30)
+                continue
+            own.append(time.perf_counter() - started)
+        connection.close()
+        with lock:
+            latencies.extend(own)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def summarize(name, latencies, errors, duration):
+    """Return the report row of one target."""
+    row = {"target": name, "requests": len(latencies), "errors": errors, "rps": len(latencies) / duration}
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100)
+        row.update(p50=cuts[49] * 1000, p95=cuts[94] * 1000, p99=cuts[98] * 1000)
+    return row
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--target",
+        action="append",
+        required=True,
+        help="NAME=BASE_URL of a running server; repeat to compare deployments.",
+    )
+    parser.add_argument("--username", required=True, help="Staff user to log in as.")
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent connections per target.")
+    parser.add_argument("--duration", type=float, default=15.0, help="Seconds to load each target.")
+    options = parser.parse_args(argv)
+
+    rows = []
+    for target in options.target:
+        name, _, base_url = target.partition("=")
+        base_url = base_url.rstrip("/")
+        cookie = login(base_url, options.username, options.password)
+        paths = build_paths(base_url, cookie)
+        latencies, errors = run_target(base_url, cookie, paths, options.concurrency, options.duration)
+        rows.append(summarize(name, latencies, errors, options.duration))
+
+    print(f"{'target':<12}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for row in rows:
+        print(
+            f"{row['target']:<12}{row['requests']:>10}{row['errors']:>8}{row['rps']:>10.1f}"
+            f"{row.get('p50', 0):>10.1f}{row.get('p95', 0):>10.1f}{row.get('p99', 0):>10.1f}"
+        )
+    baseline = rows[-1]
+    for row in rows[:-1]:
+        if baseline["rps"]:
+            print(f"{row['target']} handles {row['rps'] / baseline['rps']:.2f}x the throughput of {baseline['target']}.")
+
+
+if __name__ == "__main__":
+    main()
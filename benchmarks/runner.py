@@ -0,0 +1,125 @@
+"""Measure benchmark cases and compare the results with a stored baseline.
+
+Every case is measured once for wall time, number of SQL queries, peak
+Python memory (``tracemalloc``) and rows processed per second. Because
+``tracemalloc`` is active during the whole measurement, wall times include
+its overhead; they are comparable between runs, not with production.
+"""
+
+import json
+import platform
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+
+import django
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+DEFAULT_THRESHOLD = 0.20
+# Wall-time differences below this many seconds are treated as noise.
+MIN_TIME_DELTA = 0.005
+
+
+@dataclass
+class Measurement:
+    """What one benchmark case cost."""
+
+    wall_time: float
+    queries: int
+    peak_memory_kb: float
+    rows: int
+    rows_per_second: float
+
+
+def measure(func):
+    """Run ``func`` and return a :class:`Measurement`.
+
+    ``func`` returns the number of rows it processed.
+    """
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            rows = func() or 0
+            wall_time = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return Measurement(
+        wall_time=round(wall_time, 6),
+        queries=len(queries.captured_queries),
+        peak_memory_kb=round(peak / 1024, 1),
+        rows=rows,
+        rows_per_second=round(rows / wall_time, 1) if wall_time else 0.0,
+    )
+
+
+def run_cases(cases, only=None, report=None):
+    """Measure ``cases`` (an iterable of ``(name, func)``) in order.
+
+    ``only`` restricts the run to the given names; cases still run in order
+    because later ones depend on the data created by earlier ones.
+    ``report(name, measurement)`` is called after each case.
+    """
+    results = {}
+    for name, func in cases:
+        measurement = measure(func)
+        if only and name not in only:
+            continue
+        results[name] = asdict(measurement)
+        if report is not None:
+            report(name, measurement)
+    return results
+
+
+def build_report(results, **meta):
+    """Wrap results with the environment they were measured in."""
+    return {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            **meta,
+        },
+        "results": results,
+    }
+
+
+def load_report(path):
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def save_report(report, path):
+    with open(path, "w") as handle:
+        json.dump(report, handle, indent=2, sort_keys=True)
+        handle.write("\n")
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Return a description of every regression of ``results`` over ``baseline``.
+
+    A case regresses when its wall time or peak memory grows by more than
+    ``threshold`` (a fraction) or when it runs more queries than before.
+    """
+    regressions = []
+    for name, current in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        wall_limit = max(previous["wall_time"] * (1 + threshold), previous["wall_time"] + MIN_TIME_DELTA)
+        if current["wall_time"] > wall_limit:
+            regressions.append(
+                f"{name}: wall time {current['wall_time']:.4f}s > {previous['wall_time']:.4f}s"
+            )
+        if current["queries"] > previous["queries"]:
+            regressions.append(f"{name}: {current['queries']} queries > {previous['queries']}")
+        if current["peak_memory_kb"] > previous["peak_memory_kb"] * (1 + threshold):
+            regressions.append(
+                f"{name}: peak memory {current['peak_memory_kb']:.0f} KiB "
+                f"> {previous['peak_memory_kb']:.0f} KiB"
+            )
+    return regressions
@@ -0,0 +1,160 @@
+"""Read throughput and lock errors on SQLite while ``generate_invoices`` writes.
+
+For each SQLite profile (SQLite's defaults and the tuned profile from
+``erp_project.settings``) the script seeds a scratch database, starts
+``--readers`` processes running API-style queries and ``--writers``
+processes saving customers like admin users do, and runs
+``generate_invoices`` in another process. It then reports the reads per
+second and the "database is locked" errors seen while billing ran::
+
+    python -m benchmarks.sqlite_concurrency --customers 2000 --readers 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+PROFILES = {"default": "0", "tuned": "1"}
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def _environment(path, profile):
+    return {**os.environ, "ERP_SQLITE_PATH": str(path), "ERP_SQLITE_PROFILE": PROFILES[profile]}
+
+
+def _setup_django(environment):
+    os.environ.update(environment)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "erp_project.settings")
+    import django
+
+    django.setup()
+
+
+def _reader(environment, stop, results):
+    _setup_django(environment)
+    from django.db import OperationalError
+
+    from core.models import Customer, Invoice
+
+    rng = random.Random(os.getpid())
+    top = Customer.objects.order_by("-pk").values_list("pk", flat=True).first()
+    reads = errors = 0
+    while not stop.is_set():
+        customer_id = rng.randint(1, top)
+        try:
+            list(
+                Invoice.objects.filter(customer_id=customer_id)
+                .order_by("pk")
+                .values("id", "reference_date", "total_amount", "status")[:50]
+            )
+            Customer.objects.filter(pk=customer_id).values("name", "balance__open_amount").first()
+            reads += 1
+        except OperationalError:
+            errors += 1
+    results.put(("read", reads, errors))
+
+
+def _writer(environment, stop, results):
+    _setup_django(environment)
+    from django.db import OperationalError, transaction
+
+    from core.models import Customer
+
+    rng = random.Random(os.getpid())
+    top = Customer.objects.order_by("-pk").values_list("pk", flat=True).first()
+    writes = errors = 0
+    while not stop.is_set():
+        try:
+            with transaction.atomic():
+                customer = Customer.objects.get(pk=rng.randint(1, top))
+                customer.name = customer.name.rstrip("*") + "*"
+                customer.save(update_fields=["name"])
+            writes += 1
+        except OperationalError:
+            errors += 1
+        time.sleep(0.01)
+    results.put(("write", writes, errors))
+
+
+def _manage(environment, *args):
+    return subprocess.run(
+        [sys.executable, "manage.py", *args],
+        cwd=BASE_DIR,
+        env=environment,
+        capture_output=True,
+        text=True,
+    )
+
+
+def run_profile(profile, directory, customers, readers, writers):
+    """Seed a database with ``profile`` and measure it while billing runs."""
+    environment = _environment(Path(directory) / f"{profile}.sqlite3", profile)
+    _manage(environment, "migrate", "-v", "0").check_returncode()
+    # Anchor the contracts in the past so that the billing run has months to write.
+    anchor = date.today() - timedelta(days=365)
+    _manage(
+        environment, "generate_fake_data", "--customers", str(customers), "--seed", "1", "--today", str(anchor)
+    ).check_returncode()
+
+    context = multiprocessing.get_context("spawn")
+    stop, results = context.Event(), context.Queue()
+    workers = [context.Process(target=_reader, args=(environment, stop, results)) for _ in range(readers)]
+    workers += [context.Process(target=_writer, args=(environment, stop, results)) for _ in range(writers)]
+    for worker in workers:
+        worker.start()
+    time.sleep(2)
+
+    started = time.monotonic()
+    billing = _manage(environment, "generate_invoices")
+    elapsed = time.monotonic() - started
+    stop.set()
+    totals = {"read": [0, 0], "write": [0, 0]}
+    for _ in workers:
+        kind, done, errors = results.get()
+        totals[kind][0] += done
+        totals[kind][1] += errors
+    for worker in workers:
+        worker.join()
+
+    return {
+        "profile": profile,
+        "billing_seconds": elapsed,
+        "billing_ok": billing.returncode == 0,
+        "reads_per_second": totals["read"][0] / (elapsed + 2),
+        "read_errors": totals["read"][1],
+        "writes": totals["write"][0],
+        "write_errors": totals["write"][1],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--customers", type=int, default=2000, help="Customers in the scratch databases.")
+    parser.add_argument("--readers", type=int, default=4, help="Reader processes.")
+    parser.add_argument("--writers", type=int, default=1, help="Processes saving customers during the run.")
+    options = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        rows = [
+            run_profile(profile, directory, options.customers, options.readers, options.writers)
+            for profile in PROFILES
+        ]
+
+    print(f"{'profile':<10}{'billing s':>11}{'reads/s':>10}{'read err':>10}{'writes':>8}{'write err':>11}")
+    for row in rows:
+        status = "" if row["billing_ok"] else "  (billing failed)"
+        print(
+            f"{row['profile']:<10}{row['billing_seconds']:>11.2f}{row['reads_per_second']:>10.1f}"
+            f"{row['read_errors']:>10}{row['writes']:>8}{row['write_errors']:>11}{status}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,59 @@
-from django.contrib import admin
-from .models import Customer, Contract, Service, Invoice, InvoiceItem
+from decimal import Decimal
+
+from django.contrib import admin, messages
+from django.db import connection
+from django.db.models import Count, Q, Sum
+from django.forms.models import BaseInlineFormSet
+from django.utils import timezone
+from django.utils.html import format_html, format_html_join
+
+from . import jobs, payments, search
+from .models import Customer, CustomerBalance, Contract, Service, Invoice, InvoiceItem, Job
+from .pagination import LargeTablePaginator
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Admin for tables too large to count on every changelist view."""
+
+    paginator = LargeTablePaginator
+    show_full_result_count = False
+    # (lookup, model) pairs searched through the full-text index; a row
+    # matches when any lookup is among the ids of matching ``model`` rows.
+    full_text_search = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        if not (self.full_text_search and search.is_supported(connection)):
+            return super().get_search_results(request, queryset, search_term)
+        condition = Q()
+        for lookup, model in self.full_text_search:
+            ids = search.matching_ids(model, search_term)
+            if ids is None:
+                return queryset, False
+            condition |= Q(**{f'{lookup}__in': ids})
+        return queryset.filter(condition), False
+
 
 @admin.register(Customer)
-class CustomerAdmin(admin.ModelAdmin):
-    list_display   = ('id', 'name', 'email')
+class CustomerAdmin(LargeTableAdmin):
+    list_display   = ('id', 'name', 'email', 'balance__open_amount', 'balance__paid_amount')
+    list_select_related = ('balance',)
     search_fields  = ('name', 'email')
+    full_text_search = (('pk', Customer),)
     ordering       = ('name',)
 
 
+@admin.register(CustomerBalance)
+class CustomerBalanceAdmin(LargeTableAdmin):
+    list_display = ('customer', 'open_amount', 'paid_amount', 'last_reference_date')
+    list_select_related = ('customer',)
+    readonly_fields = ('customer', 'open_amount', 'paid_amount', 'last_reference_date')
+
+    def has_add_permission(self, request):
+        return False
+
+
 @admin.register(Contract)
-class ContractAdmin(admin.ModelAdmin):
+class ContractAdmin(LargeTableAdmin):
     list_display = (
         'id',
         'customer',
@@ -18,31 +62,88 @@ class ContractAdmin(admin.ModelAdmin):
         'start_date',
         'end_date',
     )
+    list_select_related = ('customer',)
+    search_fields = ('contract_number', 'customer__name', 'customer__email')
+    full_text_search = (('pk', Contract), ('customer_id', Customer))
+    actions = ['queue_billing']
+
+    # Contracts per billing job, keeping the job's pk__in filter well under
+    # SQLite's limit on query parameters when every row is selected.
+    billing_job_size = 500
+
+    @admin.action(description='Queue billing for selected contracts')
+    def queue_billing(self, request, queryset):
+        contract_ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+        queued = [
+            jobs.enqueue(Job.BILLING, contract_ids=contract_ids[start:start + self.billing_job_size])
+            for start in range(0, len(contract_ids), self.billing_job_size)
+        ]
+        summary = str(queued[0]) if len(queued) == 1 else f'{len(queued)} billing jobs'
+        self.message_user(request, f'Queued {summary}; run_worker will bill the selected contracts.', messages.SUCCESS)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(service_total=Count('services'))
 
     def service_count(self, obj):
         """Return the number of services linked to the contract."""
+        if hasattr(obj, 'service_total'):
+            return obj.service_total
         return obj.services.count()
 
     service_count.short_description = "Services"
+    service_count.admin_order_field = 'service_total'
 
 
 @admin.register(Service)
-class ServiceAdmin(admin.ModelAdmin):
+class ServiceAdmin(LargeTableAdmin):
     list_display = (
         'id',
         'contract',
         'name',
         'value',
     )
+    list_select_related = ('contract',)
+    search_fields = ('name', 'contract__contract_number')
+    full_text_search = (('pk', Service), ('contract_id', Contract))
+
+
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    """Inline formset that only loads and renders one page of objects."""
+
+    per_page = 50
+    page_number = 1
+
+    def get_queryset(self):
+        if not hasattr(self, '_queryset'):
+            queryset = super().get_queryset()
+            start = (self.page_number - 1) * self.per_page
+            self._queryset = queryset[start:start + self.per_page]
+        return self._queryset
 
 
 class InvoiceItemAdminInline(admin.TabularInline):
     model = InvoiceItem
     extra = 0
+    formset = PaginatedInlineFormSet
+    per_page = 50
+    page_param = 'items_page'
+
+    def get_page_number(self, request):
+        """Return the 1-based item page requested in the query string."""
+        try:
+            return max(int(request.GET.get(self.page_param, 1)), 1)
+        except ValueError:
+            return 1
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.per_page = self.per_page
+        formset.page_number = self.get_page_number(request)
+        return formset
 
 
 @admin.register(Invoice)
-class InvoiceAdmin(admin.ModelAdmin):
+class InvoiceAdmin(LargeTableAdmin):
     list_display = (
         'id',
         'customer',
@@ -50,5 +151,116 @@ class InvoiceAdmin(admin.ModelAdmin):
         'total_amount',
         'status',
     )
+    list_select_related = ('customer',)
+    search_fields = ('customer__name', 'customer__email', 'contract__contract_number')
+    full_text_search = (('customer_id', Customer), ('contract_id', Contract))
+    readonly_fields = ('total_amount', 'item_summary')
     inlines = [InvoiceItemAdminInline]
+    actions = ['mark_as_paid', 'queue_export_csv', 'queue_export_jsonl']
+
+    @admin.action(description='Mark selected invoices as paid')
+    def mark_as_paid(self, request, queryset):
+        marked = payments.mark_paid(list(queryset.values_list('pk', flat=True)))
+        self.message_user(request, f'{marked} invoices marked as paid.', messages.SUCCESS)
+
+    def queue_export(self, request, queryset, fmt):
+        job = jobs.enqueue(Job.EXPORT, format=fmt, invoice_ids=list(queryset.values_list('pk', flat=True)))
+        self.message_user(request, f'Queued {job}; the file is listed on the job once written.', messages.SUCCESS)
+
+    @admin.action(description='Export selected invoices as CSV (background job)')
+    def queue_export_csv(self, request, queryset):
+        self.queue_export(request, queryset, 'csv')
+
+    @admin.action(description='Export selected invoices as JSON Lines (background job)')
+    def queue_export_jsonl(self, request, queryset):
+        self.queue_export(request, queryset, 'jsonl')
+
+    def save_model(self, request, obj, form, change):
+        # The total follows the items: a new invoice starts at zero and the
+        # inline items saved in save_related() add themselves to it.
+        if not change:
+            obj.total_amount = Decimal(0)
+        super().save_model(request, obj, form, change)
+
+    def get_object(self, request, object_id, from_field=None):
+        obj = super().get_object(request, object_id, from_field)
+        if obj is not None:
+            obj.item_page = InvoiceItemAdminInline(self.model, self.admin_site).get_page_number(request)
+        return obj
+
+    def item_summary(self, obj):
+        """Return the item count and amount total with item page navigation."""
+        if obj is None or obj.pk is None:
+            return "-"
+        summary = obj.items.aggregate(count=Count('pk'), total=Sum('service_amount'))
+        per_page = InvoiceItemAdminInline.per_page
+        pages = max((summary['count'] + per_page - 1) // per_page, 1)
+        current = min(getattr(obj, 'item_page', 1), pages)
+        targets = [
+            ('First', 1),
+            ('Previous', current - 1),
+            ('Next', current + 1),
+            ('Last', pages),
+        ]
+        links = format_html_join(
+            ' ',
+            '<a href="?{}={}">{}</a>',
+            (
+                (InvoiceItemAdminInline.page_param, page, label)
+                for label, page in targets
+                if 1 <= page <= pages and page != current
+            ),
+        )
+        return format_html(
+            '{} items, {} total. Page {} of {}. {}',
+            summary['count'],
+            (summary['total'] or Decimal(0)).quantize(Decimal('0.01')),
+            current,
+            pages,
+            links,
+        )
+
+    item_summary.short_description = "Items"
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'progress_summary', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status', 'kind')
+    fields = (
+        'kind',
+        'arguments',
+        'max_attempts',
+        'run_after',
+        'status',
+        'progress',
+        'result',
+        'error',
+        'attempts',
+        'worker',
+        'heartbeat_at',
+        'lease_expires_at',
+        'created_at',
+        'started_at',
+        'finished_at',
+    )
+    readonly_fields = fields[4:]
+    actions = ['requeue']
+
+    def get_readonly_fields(self, request, obj=None):
+        if obj is not None:
+            return self.fields
+        return self.readonly_fields
+
+    def progress_summary(self, obj):
+        """Return the reported counters, e.g. ``contracts 1200, invoices 800``."""
+        return ', '.join(f'{name} {value}' for name, value in obj.progress.items()) or '-'
+
+    progress_summary.short_description = "Progress"
 
+    @admin.action(description='Requeue selected failed jobs')
+    def requeue(self, request, queryset):
+        requeued = queryset.filter(status=Job.FAILED).update(
+            status=Job.QUEUED, attempts=0, run_after=timezone.now(), finished_at=None
+        )
+        self.message_user(request, f'{requeued} jobs requeued.', messages.SUCCESS)
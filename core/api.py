@@ -0,0 +1,184 @@
+"""Read-only JSON API over customers, contracts, invoices and invoice items.
+
+Every resource is read as ``.values()`` rows, joined to the columns of its
+parents in the same query; nested services and items are loaded for a whole
+page with one extra query. Lists use keyset pagination on the primary key:
+``?after=<last id>&limit=<n>`` turns into ``WHERE id > after ORDER BY id
+LIMIT n + 1``, so a deep page costs the same as the first one.
+
+Everything here goes through Django's async ORM so that the ASGI views in
+``core.views`` never block the event loop. The async ORM runs every query
+through ``sync_to_async`` on one thread, so the queries of a request are
+awaited one after the other.
+"""
+
+from dataclasses import dataclass, field
+
+from asgiref.sync import sync_to_async
+from django.db.models import F
+
+from . import billing, caching
+from .models import Contract, Customer, Invoice, InvoiceItem, Service
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def _id(value):
+    if not value.isdigit():
+        raise ValueError(f"Invalid id {value!r}.")
+    return int(value)
+
+
+def _month(value):
+    billing.parse_month(value)
+    return value
+
+
+def _status(value):
+    if value not in dict(Invoice.STATUS_CHOICES):
+        raise ValueError(f"Invalid status {value!r}.")
+    return value
+
+
+async def _attach_services(rows):
+    services = {}
+    async for service in (
+        Service.objects.filter(contract_id__in=[row["id"] for row in rows])
+        .order_by("pk")
+        .values("id", "contract_id", "name", "value")
+        .aiterator()
+    ):
+        services.setdefault(service.pop("contract_id"), []).append(service)
+    for row in rows:
+        row["services"] = services.get(row["id"], [])
+
+
+async def _attach_items(rows):
+    items = {}
+    async for item in (
+        InvoiceItem.objects.filter(invoice_id__in=[row["id"] for row in rows])
+        .order_by("pk")
+        .values("id", "invoice_id", "service_name", "service_amount")
+        .aiterator()
+    ):
+        items.setdefault(item.pop("invoice_id"), []).append(item)
+    for row in rows:
+        row["items"] = items.get(row["id"], [])
+
+
+@dataclass(frozen=True)
+class Resource:
+    """How to read, filter and nest one kind of object."""
+
+    model: type
+    fields: tuple
+    joined: dict = field(default_factory=dict)
+    filters: dict = field(default_factory=dict)
+    attach: object = None
+
+    def rows(self):
+        return self.model.objects.values(*self.fields, **{name: F(path) for name, path in self.joined.items()})
+
+
+RESOURCES = {
+    "customers": Resource(
+        Customer,
+        ("id", "name", "email"),
+        joined={"open_amount": "balance__open_amount", "paid_amount": "balance__paid_amount"},
+        filters={"email": ("email", str.lower)},
+    ),
+    "contracts": Resource(
+        Contract,
+        ("id", "customer_id", "contract_number", "start_date", "end_date"),
+        joined={"customer_name": "customer__name"},
+        filters={"customer": ("customer_id", _id)},
+        attach=_attach_services,
+    ),
+    "invoices": Resource(
+        Invoice,
+        ("id", "customer_id", "contract_id", "reference_date", "total_amount", "status"),
+        joined={"customer_name": "customer__name", "contract_number": "contract__contract_number"},
+        filters={
+            "customer": ("customer_id", _id),
+            "contract": ("contract_id", _id),
+            "status": ("status", _status),
+            "from": ("reference_date__gte", _month),
+            "to": ("reference_date__lte", _month),
+        },
+    ),
+    "invoice-items": Resource(
+        InvoiceItem,
+        ("id", "invoice_id", "service_name", "service_amount"),
+        joined={"reference_date": "invoice__reference_date", "customer_id": "invoice__customer_id"},
+        filters={"invoice": ("invoice_id", _id)},
+    ),
+}
+DETAIL_ATTACH = {"invoices": _attach_items}
+
+
+def _page_arguments(resource, params):
+    after = _id(params["after"]) if params.get("after") else 0
+    limit = _id(params["limit"]) if params.get("limit") else DEFAULT_LIMIT
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_LIMIT}.")
+    lookups = {}
+    for param, (lookup, parse) in resource.filters.items():
+        if params.get(param):
+            lookups[lookup] = parse(params[param])
+    return after, limit, lookups
+
+
+async def _fetch(queryset):
+    return [row async for row in queryset.aiterator()]
+
+
+async def customer_header(customer_id):
+    """Return the ``id``, ``name`` and ``email`` of a customer, or ``None``.
+
+    Clients page through a customer's rows, so the customer is read through
+    the object cache.
+    """
+    customer = await sync_to_async(caching.get_customer)(customer_id)
+    if customer is None:
+        return None
+    return {"id": customer.pk, "name": customer.name, "email": customer.email}
+
+
+async def list_page(name, params):
+    """Return one page of resource ``name`` as a dict.
+
+    ``params`` is a mapping of query parameters; ``ValueError`` is raised
+    for invalid ones. The page holds ``results`` and ``next_after``, which is
+    ``None`` on the last page. Pages restricted to one customer also hold
+    the ``customer`` header and the ``count`` of matching rows.
+    """
+    resource = RESOURCES[name]
+    after, limit, lookups = _page_arguments(resource, params)
+    page = resource.rows().filter(pk__gt=after, **lookups).order_by("pk")[: limit + 1]
+
+    customer_id = lookups.get("customer_id")
+    if customer_id is None:
+        rows, extra = await _fetch(page), {}
+    else:
+        rows = await _fetch(page)
+        extra = {
+            "customer": await customer_header(customer_id),
+            "count": await resource.model.objects.filter(**lookups).acount(),
+        }
+
+    next_after = rows[limit - 1]["id"] if len(rows) > limit else None
+    rows = rows[:limit]
+    if rows and resource.attach:
+        await resource.attach(rows)
+    return {"results": rows, "next_after": next_after, **extra}
+
+
+async def detail(name, pk):
+    """Return the row of resource ``name`` with primary key ``pk``, or ``None``."""
+    resource = RESOURCES[name]
+    row = await resource.rows().filter(pk=pk).afirst()
+    if row is not None:
+        for attach in filter(None, (resource.attach, DETAIL_ATTACH.get(name))):
+            await attach([row])
+    return row
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from . import instrumentation
+
+        if instrumentation.is_enabled():
+            from django.core.management.base import BaseCommand
+
+            instrumentation.instrument_commands(BaseCommand)
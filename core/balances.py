@@ -0,0 +1,158 @@
+"""Incremental maintenance of :class:`~core.models.CustomerBalance` rows.
+
+Every path that changes invoice totals or statuses reports the difference as
+a :class:`BalanceChange` per customer and hands it to
+:func:`apply_balance_changes`, which applies a whole batch in a constant
+number of queries. ``verify_balances`` recomputes everything from scratch
+to detect and repair drift.
+"""
+
+from dataclasses import dataclass
+from decimal import Decimal
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Max, Q, Sum
+from django.utils import timezone
+
+from . import caching
+from .models import CustomerBalance, Invoice
+
+ZERO = Decimal("0.00")
+CENT = Decimal("0.01")
+
+
+@dataclass
+class BalanceChange:
+    """Amounts to add to a customer's balance."""
+
+    open_amount: Decimal = ZERO
+    paid_amount: Decimal = ZERO
+    last_reference_date: str = ""
+
+    def add(self, status, amount, reference_date=""):
+        """Account for ``amount`` on an invoice in ``status``; negate to remove."""
+        if status == Invoice.PAID:
+            self.paid_amount += amount
+        else:
+            self.open_amount += amount
+        self.last_reference_date = max(self.last_reference_date, reference_date)
+
+
+def collect_changes(rows):
+    """Group ``(customer_id, status, amount, reference_date)`` rows by customer."""
+    changes = {}
+    for customer_id, status, amount, reference_date in rows:
+        changes.setdefault(customer_id, BalanceChange()).add(status, amount, reference_date)
+    return changes
+
+
+def apply_balance_changes(changes):
+    """Apply a ``{customer_id: BalanceChange}`` mapping in three queries."""
+    if not changes:
+        return
+    with transaction.atomic():
+        CustomerBalance.objects.bulk_create(
+            [CustomerBalance(customer_id=customer_id) for customer_id in changes],
+            ignore_conflicts=True,
+        )
+        balances = CustomerBalance.objects.select_for_update().in_bulk(list(changes))
+        for customer_id, change in changes.items():
+            balance = balances[customer_id]
+            balance.open_amount += change.open_amount
+            balance.paid_amount += change.paid_amount
+            balance.last_reference_date = max(balance.last_reference_date, change.last_reference_date)
+        CustomerBalance.objects.bulk_update(
+            balances.values(), ["open_amount", "paid_amount", "last_reference_date"]
+        )
+
+
+def refresh_last_reference_date(customer_id):
+    """Recompute a customer's latest reference month after invoices went away."""
+    latest = Invoice.objects.filter(customer_id=customer_id).aggregate(latest=Max("reference_date"))
+    CustomerBalance.objects.filter(customer_id=customer_id).update(
+        last_reference_date=latest["latest"] or ""
+    )
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def verify_invoice_totals(repair=True, batch_size=1000):
+    """Compare invoice totals with the sum of their items.
+
+    Returns the number of invoices whose stored total had drifted; with
+    ``repair`` those totals are rewritten with ``bulk_update``.
+    """
+    rows = (
+        Invoice.objects.annotate(items_total=Sum("items__service_amount"))
+        .order_by("pk")
+        .values_list("pk", "total_amount", "items_total")
+        .iterator(chunk_size=batch_size)
+    )
+    drifted = []
+    now = timezone.now()
+    for pk, total_amount, items_total in rows:
+        expected = (items_total or ZERO).quantize(CENT)
+        if total_amount != expected:
+            drifted.append(Invoice(pk=pk, total_amount=expected, updated_at=now))
+    if repair:
+        Invoice.objects.bulk_update(drifted, ["total_amount", "updated_at"], batch_size=batch_size)
+        caching.invalidate("invoices", *(invoice.pk for invoice in drifted))
+    return len(drifted)
+
+
+def verify_customer_balances(repair=True, batch_size=1000):
+    """Compare every balance row with totals recomputed from the invoices.
+
+    Returns the number of customers whose balance had drifted; with
+    ``repair`` the balances are rewritten in bulk.
+    """
+    expected_rows = (
+        Invoice.objects.values("customer_id")
+        .annotate(
+            open_amount=Sum("total_amount", filter=~Q(status=Invoice.PAID)),
+            paid_amount=Sum("total_amount", filter=Q(status=Invoice.PAID)),
+            last_reference_date=Max("reference_date"),
+        )
+        .order_by("customer_id")
+        .values_list("customer_id", "open_amount", "paid_amount", "last_reference_date")
+    )
+    drifted = []
+    for batch in _batched(expected_rows.iterator(chunk_size=batch_size), batch_size):
+        stored = CustomerBalance.objects.in_bulk([row[0] for row in batch])
+        for customer_id, open_amount, paid_amount, last_reference_date in batch:
+            expected = CustomerBalance(
+                customer_id=customer_id,
+                open_amount=(open_amount or ZERO).quantize(CENT),
+                paid_amount=(paid_amount or ZERO).quantize(CENT),
+                last_reference_date=last_reference_date or "",
+            )
+            balance = stored.get(customer_id)
+            if balance is None or (
+                balance.open_amount,
+                balance.paid_amount,
+                balance.last_reference_date,
+            ) != (expected.open_amount, expected.paid_amount, expected.last_reference_date):
+                drifted.append(expected)
+
+    orphans = (
+        CustomerBalance.objects.exclude(customer__in=Invoice.objects.values("customer_id"))
+        .exclude(open_amount=0, paid_amount=0, last_reference_date="")
+        .values_list("customer_id", flat=True)
+    )
+    drifted.extend(CustomerBalance(customer_id=customer_id) for customer_id in orphans)
+
+    if repair:
+        with transaction.atomic():
+            CustomerBalance.objects.bulk_create(
+                drifted,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=["customer"],
+                update_fields=["open_amount", "paid_amount", "last_reference_date"],
+            )
+    return len(drifted)
@@ -0,0 +1,315 @@
+"""Set-based invoice generation.
+
+The engine streams the contracts in keyset-paginated chunks, loads the
+services and the already issued ``(contract, reference_date)`` pairs of each
+chunk in bulk, works out each missing contract-month in memory and writes
+the results with ``bulk_create`` in chunked transactions. The number of
+queries depends on the number of chunks, not on the number of contracts,
+and memory use on the chunk size, not on the size of the tables.
+
+Contracts can be split into shards by customer so that several processes
+bill disjoint sets of contracts at the same time.
+
+Each contract records the last month it was billed through in
+``Contract.billed_through``. Runs resume from that watermark, so their cost
+follows the number of new contract-months rather than the age of the
+contracts. Editing a contract's dates or services clears the watermark (see
+``core.signals``) and the next run re-scans the contract from its start.
+"""
+
+import multiprocessing
+import time
+from calendar import monthrange
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import TruncMonth
+
+from . import caching, catalog, proration
+from .balances import apply_balance_changes, collect_changes
+from .billing_worker import run_shard
+from .models import Contract, Invoice, InvoiceItem
+from .rollups import apply_rollup_changes, collect_rollup_changes
+
+CENT = Decimal("0.01")
+DEFAULT_CHUNK_SIZE = 1000
+
+
+@dataclass
+class BillingSummary:
+    """Counters collected while generating invoices."""
+
+    invoices_created: int = 0
+    items_created: int = 0
+    total_amount: Decimal = Decimal("0.00")
+    elapsed: float = 0.0
+    shard: tuple = None
+
+    def merge(self, other):
+        """Add the counters of ``other`` to this summary."""
+        self.invoices_created += other.invoices_created
+        self.items_created += other.items_created
+        self.total_amount += other.total_amount
+        self.elapsed = max(self.elapsed, other.elapsed)
+
+
+def next_month(dt):
+    """Return the first day of the month following ``dt``."""
+    if dt.month == 12:
+        return dt.replace(year=dt.year + 1, month=1, day=1)
+    return dt.replace(month=dt.month + 1, day=1)
+
+
+_references = {}
+
+
+def reference_month(month):
+    """Return the ``YYYY-MM`` reference of ``month``, one string shared by all invoices."""
+    reference = _references.get(month)
+    if reference is None:
+        reference = _references[month] = month.strftime("%Y-%m")
+    return reference
+
+
+def prorate(value, charge_start, charge_end, month_start, month_end):
+    """Return the amount due for ``value`` over the charged part of a month.
+
+    This is the single-item ``Decimal`` reference of
+    :func:`core.proration.prorate_cents`, which the engine uses in bulk.
+    """
+    if charge_start == month_start and charge_end == month_end:
+        return value
+    days_in_month = (month_end - month_start).days + 1
+    days = (charge_end - charge_start).days + 1
+    return (value * Decimal(days) / Decimal(days_in_month)).quantize(CENT)
+
+
+def parse_month(value):
+    """Parse a ``"YYYY-MM"`` reference into the first day of that month."""
+    try:
+        return datetime.strptime(value, "%Y-%m").date()
+    except ValueError:
+        raise ValueError(f"Invalid month {value!r}, expected YYYY-MM.") from None
+
+
+def billing_window(contract, today, since=None):
+    """Return ``(first_month, last_month, advance)`` to scan for ``contract``.
+
+    The scan starts after the contract's watermark, or at ``since`` when that
+    is later. ``advance`` is false when ``since`` skipped months that were
+    never checked, in which case the watermark must stay where it is.
+    """
+    first_month = contract.start_date.replace(day=1)
+    if contract.billed_through is not None:
+        first_month = max(first_month, next_month(contract.billed_through))
+    last_month = min(contract.end_date, today).replace(day=1)
+    advance = True
+    if since is not None and since > first_month:
+        first_month, advance = since, False
+    return first_month, last_month, advance
+
+
+def pending_contracts(today):
+    """Return contracts that may still have unbilled months up to ``today``."""
+    current_month = today.replace(day=1)
+    return Contract.objects.filter(start_date__lte=today).filter(
+        Q(billed_through__isnull=True)
+        | Q(billed_through__lt=current_month) & Q(billed_through__lt=TruncMonth("end_date"))
+    )
+
+
+def build_contract_invoices(contract, services, existing, today, first_month=None):
+    """Return the :class:`~core.catalog.InvoiceRecord` of every unbilled month of ``contract``.
+
+    ``services`` are :class:`~core.catalog.ServiceRecord` objects. ``existing``
+    is the set of ``(contract_id, reference_date)`` pairs that already have
+    an invoice. Months before ``first_month`` are not scanned. The amounts of
+    all months are prorated in one :func:`core.proration.prorate_cents`
+    call. Nothing is written to the database.
+    """
+    end_date = min(contract.end_date, today)
+    month = first_month or contract.start_date.replace(day=1)
+    last_month = end_date.replace(day=1)
+    rates = [(service.name, service.cents) for service in services]
+    months = []
+    batch = proration.ProrationBatch()
+    while month <= last_month:
+        reference = reference_month(month)
+        if (contract.pk, reference) not in existing:
+            month_end = month.replace(day=monthrange(month.year, month.month)[1])
+            charge_start = max(contract.start_date, month)
+            charge_end = min(end_date, month_end)
+            for _, cents in rates:
+                batch.add(cents, charge_start, charge_end, month)
+            months.append(reference)
+        month = next_month(month)
+
+    amounts = iter(batch.amounts())
+    pending = []
+    names = tuple(name for name, _ in rates)
+    for reference in months:
+        cents = tuple(next(amounts) for _ in rates)
+        pending.append(catalog.InvoiceRecord(contract.customer_id, contract.pk, reference, names, cents))
+    return pending
+
+
+def write_invoices(pending, summary, billed_contracts=()):
+    """Insert ``pending`` invoice records and their items in a single transaction.
+
+    ``billed_contracts`` are unsaved contracts carrying new watermarks. The
+    watermarks, the customer balances and the revenue rollups are updated
+    in the same transaction.
+    """
+    with transaction.atomic():
+        invoices = Invoice.objects.bulk_create([record.to_invoice() for record in pending])
+        items, revenue = [], []
+        for invoice, record in zip(invoices, pending):
+            items.extend(record.to_items(invoice))
+            revenue.extend(
+                (invoice.reference_date, invoice.customer_id, item.service_name, item.service_amount)
+                for item in record.items
+            )
+        InvoiceItem.objects.bulk_create(items)
+        Contract.objects.bulk_update(billed_contracts, ["billed_through"])
+        caching.forget(caching.CONTRACT, *(contract.pk for contract in billed_contracts))
+        apply_balance_changes(
+            collect_changes(
+                (invoice.customer_id, invoice.status, invoice.total_amount, invoice.reference_date)
+                for invoice in invoices
+            )
+        )
+        apply_rollup_changes(collect_rollup_changes(revenue))
+
+    summary.invoices_created += len(invoices)
+    summary.items_created += len(items)
+    summary.total_amount += proration.from_cents(sum(record.total_cents for record in pending))
+
+
+def parse_shard(value):
+    """Parse a ``"i/N"`` shard specification into ``(i, N)``."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {value!r}, expected INDEX/COUNT.") from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard {value!r}, expected 0 <= INDEX < COUNT.")
+    return index, count
+
+
+def shard_contracts(queryset, shard, customer_field="customer_id"):
+    """Restrict ``queryset`` to the contracts of one customer shard.
+
+    Contracts are assigned by ``customer_id % count`` so that all contracts
+    of a customer are billed by the same shard and shards never overlap.
+    """
+    if shard is None:
+        return queryset
+    index, count = shard
+    return queryset.alias(_shard=F(customer_field) % count).filter(_shard=index)
+
+
+def _plan_chunk(chunk, today, since):
+    """Plan one :class:`~core.catalog.ContractChunk`; see :func:`plan_invoices`."""
+    windows = [billing_window(contract, today, since) for contract in chunk]
+    earliest = min(first for first, _, _ in windows)
+    issued = Invoice.objects.filter(
+        contract_id__in=list(chunk.pks), reference_date__gte=earliest.strftime("%Y-%m")
+    )
+    existing = set(issued.values_list("contract_id", "reference_date"))
+
+    for contract, (first_month, last_month, advance) in zip(chunk, windows):
+        if first_month > last_month:
+            continue
+        invoices = build_contract_invoices(contract, contract.services, existing, today, first_month)
+        yield contract, invoices, last_month if advance else None
+
+
+def plan_invoices(today, shard=None, since=None, contract_ids=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield ``(contract, pending, billed_through)`` for the contracts to bill.
+
+    ``contract`` is a :class:`~core.catalog.ContractRecord`, ``pending``
+    holds the :class:`~core.catalog.InvoiceRecord` objects planned for it and
+    ``billed_through`` its new watermark, or ``None`` when it must stay.
+    ``contract_ids`` optionally restricts planning to those contracts.
+
+    Contracts are streamed with :func:`core.catalog.contract_chunks`,
+    ``chunk_size`` at a time, and the issued invoice keys of each chunk are
+    loaded with one more query and released with the chunk. Nothing is
+    written, but callers may update the watermarks of the contracts already
+    yielded while iterating.
+    """
+    pending = shard_contracts(pending_contracts(today), shard)
+    if contract_ids is not None:
+        pending = pending.filter(pk__in=contract_ids)
+    for chunk in catalog.contract_chunks(pending, chunk_size):
+        yield from _plan_chunk(chunk, today, since)
+
+
+def preview_invoices(today, shard=None, since=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the ``(invoice, items)`` records a billing run would create."""
+    for _, pending, _ in plan_invoices(today, shard, since, chunk_size=chunk_size):
+        for invoice in pending:
+            yield invoice, invoice.items
+
+
+def generate_invoices(
+    today, chunk_size=DEFAULT_CHUNK_SIZE, shard=None, since=None, contract_ids=None, progress=None
+):
+    """Create every missing monthly invoice up to ``today``.
+
+    ``shard`` is an optional ``(index, count)`` pair limiting the run to one
+    customer shard, ``since`` an optional first month to scan and
+    ``contract_ids`` an optional list of contracts to bill. ``chunk_size``
+    bounds both the contracts read and the invoices written per round trip,
+    and with it the memory used. ``progress``, if given, is called as
+    ``progress(summary, contracts)`` after every chunk written with the
+    number of contracts planned so far. Returns a :class:`BillingSummary`
+    describing what was written.
+    """
+    started = time.monotonic()
+    summary = BillingSummary(shard=shard)
+    pending, billed = [], []
+    contracts = 0
+    planned = plan_invoices(today, shard, since, contract_ids, chunk_size)
+    for contract, contract_pending, billed_through in planned:
+        contracts += 1
+        pending.extend(contract_pending)
+        if billed_through is not None:
+            billed.append(contract.watermark(billed_through))
+        if len(pending) >= chunk_size or len(billed) >= chunk_size:
+            write_invoices(pending, summary, billed)
+            pending, billed = [], []
+            if progress is not None:
+                progress(summary, contracts)
+    if pending or billed:
+        write_invoices(pending, summary, billed)
+    if progress is not None:
+        progress(summary, contracts)
+    summary.elapsed = time.monotonic() - started
+    return summary
+
+
+def generate_invoices_parallel(today, workers, chunk_size=DEFAULT_CHUNK_SIZE, since=None):
+    """Bill ``workers`` customer shards concurrently, one process per shard.
+
+    Returns ``(summaries, errors)`` where ``errors`` maps the shards that
+    failed to their exception. Every invoice is written together with its
+    items, so a failing shard never leaves a half-written invoice behind.
+    """
+    summaries, errors = [], {}
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        futures = {
+            (index, workers): pool.submit(run_shard, today, (index, workers), chunk_size, since)
+            for index in range(workers)
+        }
+        for shard, future in futures.items():
+            try:
+                summaries.append(future.result())
+            except Exception as exc:
+                errors[shard] = exc
+    return summaries, errors
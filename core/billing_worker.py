@@ -0,0 +1,21 @@
+"""Process entry point for sharded billing.
+
+This module must not import models at import time: a freshly spawned
+interpreter unpickles :func:`run_shard` before Django has been set up.
+"""
+
+import django
+
+
+def run_shard(today, shard, chunk_size, since=None):
+    """Bill one customer shard in a worker process using its own connection."""
+    django.setup()
+
+    from django.db import connections
+
+    from core import billing
+
+    try:
+        return billing.generate_invoices(today, chunk_size=chunk_size, shard=shard, since=since)
+    finally:
+        connections.close_all()
@@ -0,0 +1,263 @@
+"""Cached API and report payloads with HTTP validators.
+
+Rendered payloads are stored in Django's cache together with the version
+they were built from: ``updated_at`` for invoices and contracts, and the
+latest rollup change for revenue reports. A request first reads the current
+version (one indexed query), answers conditional requests with 304 from it
+and only rebuilds the payload when the cached one is older. Signal handlers
+delete entries as soon as the objects change; the version check covers
+writes made by other processes, whose signals never reach this cache.
+
+Customers and contracts (with their services) are also cached as objects
+for code that reads the same rows over and over, such as the customer
+header of every page of a customer's API lists. Reads go through a small
+in-process LRU, then Django's cache, then the database. Signal handlers,
+the importer and billing forget changed objects in both tiers; writes made
+by other processes are picked up once entries expire after
+``OBJECT_CACHE["TTL_SECONDS"]``. The counters of this process are part of
+the instrumentation report.
+"""
+
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .models import Contract, Customer, Invoice, RevenueRollup
+
+VERSIONED = {"invoices": Invoice, "contracts": Contract}
+
+
+def payload_key(resource, pk):
+    return f"core:payload:{resource}:{pk}"
+
+
+def invalidate(resource, *pks):
+    """Drop the cached payloads of ``resource`` objects."""
+    cache.delete_many([payload_key(resource, pk) for pk in pks if pk is not None])
+
+
+def touch(resource, **lookups):
+    """Bump ``updated_at`` of the matching rows and drop their payloads.
+
+    Used where what a payload shows changes without a ``save()`` of the
+    object itself.
+    """
+    model = VERSIONED[resource]
+    pks = list(model.objects.filter(**lookups).values_list("pk", flat=True))
+    if pks:
+        model.objects.filter(pk__in=pks).update(updated_at=timezone.now())
+        invalidate(resource, *pks)
+
+
+async def aobject_version(resource, pk):
+    """Return the ``updated_at`` of one object, or ``None`` if it is missing."""
+    return await VERSIONED[resource].objects.filter(pk=pk).values_list("updated_at", flat=True).afirst()
+
+
+async def arollup_version():
+    """Return ``(last_change, row_count)`` of the revenue rollups."""
+    row = await RevenueRollup.objects.aaggregate(last_change=Max("updated_at"), rows=Count("pk"))
+    return row["last_change"], row["rows"]
+
+
+def etag(*parts):
+    """A strong ETag derived from ``parts``."""
+    digest = hashlib.md5("|".join(map(str, parts)).encode(), usedforsecurity=False).hexdigest()
+    return f'"{digest}"'
+
+
+async def acached_payload(key, version, build):
+    """Return the payload stored under ``key`` for ``version``, building it if needed.
+
+    ``build`` is a coroutine function returning the rendered payload, or
+    ``None`` when there is nothing to cache.
+    """
+    entry = await cache.aget(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    payload = await build()
+    if payload is not None:
+        await cache.aset(key, (version, payload))
+    return payload
+
+
+CUSTOMER = "customer"
+CONTRACT = "contract"
+
+OBJECTS = {
+    CUSTOMER: lambda: Customer.objects.all(),
+    CONTRACT: lambda: Contract.objects.prefetch_related("services"),
+}
+
+
+class LocalCache:
+    """A thread-safe LRU mapping whose entries expire ``ttl`` seconds after being set.
+
+    Counts hits, misses, evictions (entries dropped to make room) and
+    expirations, to help size ``max_entries``. ``generation`` changes on
+    every deletion, so that a value loaded meanwhile can be discarded.
+    """
+
+    def __init__(self, max_entries, ttl, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(("hits", "misses", "evictions", "expirations", "shared_hits", "loads"), 0)
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                del self.entries[key]
+                self.counters["expirations"] += 1
+                entry = None
+            if entry is None:
+                self.counters["misses"] += 1
+                return default
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[1]
+
+    def set_many(self, values, generation=None):
+        """Store ``values``, unless something was deleted since ``generation``."""
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return False
+            expires = self.clock() + self.ttl
+            for key, value in values.items():
+                self.entries[key] = (expires, value)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters["evictions"] += 1
+            return True
+
+    def delete_many(self, keys):
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def count(self, counter, amount):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, "entries": len(self.entries), "max_entries": self.max_entries}
+
+
+_local = None
+_local_lock = threading.Lock()
+
+
+def local_cache():
+    """Return the process-wide :class:`LocalCache`, creating it from the settings."""
+    global _local
+    with _local_lock:
+        if _local is None:
+            options = settings.OBJECT_CACHE
+            _local = LocalCache(options["MAX_ENTRIES"], options["TTL_SECONDS"])
+        return _local
+
+
+def clear_objects():
+    """Drop the local object cache and its counters; the next read starts a new one."""
+    global _local
+    with _local_lock:
+        _local = None
+
+
+def object_cache_stats():
+    """Return the counters of the local object cache.
+
+    ``hits`` and ``misses`` count local lookups; of the misses,
+    ``shared_hits`` were served by Django's cache and ``loads`` by the
+    database.
+    """
+    return local_cache().stats()
+
+
+def object_key(kind, pk):
+    return f"core:object:{kind}:{pk}"
+
+
+def forget(kind, *pks):
+    """Drop cached ``kind`` objects, now and again once the transaction commits.
+
+    The second pass drops copies another thread read before the commit.
+    """
+    keys = [object_key(kind, pk) for pk in pks if pk is not None]
+    if not keys:
+        return
+
+    def drop():
+        local_cache().delete_many(keys)
+        cache.delete_many(keys)
+
+    drop()
+    transaction.on_commit(drop)
+
+
+def get_many(kind, pks):
+    """Return ``{pk: object}`` for the ``kind`` objects of ``pks`` that exist.
+
+    Objects are cached pickled and every call returns fresh copies, so
+    callers may modify them.
+    """
+    local = local_cache()
+    found, missing = {}, []
+    for pk in dict.fromkeys(pks):
+        data = local.get(object_key(kind, pk))
+        if data is None:
+            missing.append(pk)
+        else:
+            found[pk] = data
+    if missing:
+        shared = cache.get_many([object_key(kind, pk) for pk in missing])
+        if shared:
+            local.count("shared_hits", len(shared))
+            local.set_many(shared)
+            found.update((pk, shared[object_key(kind, pk)]) for pk in missing if object_key(kind, pk) in shared)
+            missing = [pk for pk in missing if pk not in found]
+    if missing:
+        generation = local.generation
+        loaded = {
+            pk: pickle.dumps(obj, pickle.HIGHEST_PROTOCOL) for pk, obj in OBJECTS[kind]().in_bulk(missing).items()
+        }
+        local.count("loads", len(loaded))
+        values = {object_key(kind, pk): data for pk, data in loaded.items()}
+        if local.set_many(values, generation):
+            cache.set_many(values, timeout=settings.OBJECT_CACHE["TTL_SECONDS"])
+        found.update(loaded)
+    return {pk: pickle.loads(data) for pk, data in found.items()}
+
+
+def get_customer(pk):
+    """Return the customer ``pk``, or ``None`` if it does not exist."""
+    return get_many(CUSTOMER, [pk]).get(pk)
+
+
+def get_many_customers(pks):
+    return get_many(CUSTOMER, pks)
+
+
+def get_contract_with_services(pk):
+    """Return the contract ``pk`` with its services prefetched, or ``None``."""
+    return get_many(CONTRACT, [pk]).get(pk)
+
+
+def get_many_contracts_with_services(pks):
+    return get_many(CONTRACT, pks)
+
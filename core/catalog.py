@@ -0,0 +1,208 @@
+"""Compact read-only records for the billing hot path.
+
+Billing holds a chunk of contracts, their services and the invoices planned
+for them in memory at once. Model instances carry a ``__dict__``, a
+``ModelState`` and one Python object per field each. Here a chunk of
+contracts and services is loaded with ``values_list()`` into array-backed
+columns (ids, dates as ordinals, values in integer cents, service names
+shared between rows), and planned invoices are ``__slots__`` records
+holding integer cents.
+
+Records expose the attribute names of the models they stand for, so code
+reading ``contract.start_date`` or ``item.service_amount`` works with
+either. Model instances are only built to be written with ``bulk_create``.
+"""
+
+from array import array
+from dataclasses import dataclass
+from datetime import date
+
+from .models import Contract, Invoice, InvoiceItem, Service
+from .proration import from_cents, to_cents
+
+CONTRACT_FIELDS = ("pk", "customer_id", "start_date", "end_date", "billed_through")
+
+
+@dataclass(slots=True)
+class ServiceRecord:
+    """A service of a contract: its name and monthly value in cents."""
+
+    name: str
+    cents: int
+
+
+@dataclass(slots=True)
+class ContractRecord:
+    """One contract of a :class:`ContractChunk`, with its dates as ordinals.
+
+    ``billed_through_ordinal`` is 0 when the contract was never billed.
+    """
+
+    pk: int
+    customer_id: int
+    start_ordinal: int
+    end_ordinal: int
+    billed_through_ordinal: int
+    services: tuple = ()
+
+    @property
+    def start_date(self):
+        return date.fromordinal(self.start_ordinal)
+
+    @property
+    def end_date(self):
+        return date.fromordinal(self.end_ordinal)
+
+    @property
+    def billed_through(self):
+        return date.fromordinal(self.billed_through_ordinal) if self.billed_through_ordinal else None
+
+    def watermark(self, billed_through):
+        """Return the unsaved ``Contract`` that moves the watermark to ``billed_through``."""
+        return Contract(pk=self.pk, billed_through=billed_through)
+
+
+class ContractChunk:
+    """Contracts and their services stored as columns, in primary key order.
+
+    Iterating yields a short-lived :class:`ContractRecord` per contract.
+    The services of contract ``i`` are the entries
+    ``service_offsets[i]:service_offsets[i + 1]`` of the service columns.
+    """
+
+    __slots__ = (
+        "pks",
+        "customer_ids",
+        "starts",
+        "ends",
+        "billed_through",
+        "service_offsets",
+        "service_names",
+        "service_cents",
+    )
+
+    def __init__(self, rows):
+        self.pks = array("q")
+        self.customer_ids = array("q")
+        self.starts = array("l")
+        self.ends = array("l")
+        self.billed_through = array("l")
+        for pk, customer_id, start_date, end_date, billed_through in rows:
+            self.pks.append(pk)
+            self.customer_ids.append(customer_id)
+            self.starts.append(start_date.toordinal())
+            self.ends.append(end_date.toordinal())
+            self.billed_through.append(billed_through.toordinal() if billed_through else 0)
+        self.service_offsets = array("l", [0]) * (len(self.pks) + 1)
+        self.service_names = []
+        self.service_cents = array("q")
+
+    def __len__(self):
+        return len(self.pks)
+
+    def __iter__(self):
+        offsets = self.service_offsets
+        for index, pk in enumerate(self.pks):
+            start, end = offsets[index], offsets[index + 1]
+            yield ContractRecord(
+                pk,
+                self.customer_ids[index],
+                self.starts[index],
+                self.ends[index],
+                self.billed_through[index],
+                tuple(map(ServiceRecord, self.service_names[start:end], self.service_cents[start:end])),
+            )
+
+    def load_services(self):
+        """Load the services of the chunk in one query.
+
+        Contracts are kept in primary key order, so ordering the services by
+        contract lays them out in contract order.
+        """
+        positions = {pk: index for index, pk in enumerate(self.pks)}
+        counts = [0] * len(self.pks)
+        names = {}
+        rows = Service.objects.filter(contract_id__in=list(self.pks)).order_by("contract_id", "pk")
+        for contract_id, name, value in rows.values_list("contract_id", "name", "value"):
+            counts[positions[contract_id]] += 1
+            self.service_names.append(names.setdefault(name, name))
+            self.service_cents.append(to_cents(value))
+        total = 0
+        for index, count in enumerate(counts, start=1):
+            total += count
+            self.service_offsets[index] = total
+        return self
+
+
+@dataclass(slots=True)
+class ItemRecord:
+    """A planned invoice item."""
+
+    service_name: str
+    cents: int
+
+    @property
+    def service_amount(self):
+        return from_cents(self.cents)
+
+
+@dataclass(slots=True)
+class InvoiceRecord:
+    """A planned invoice, not yet written.
+
+    ``service_names`` is shared by all the invoices of a contract and
+    ``item_cents`` holds the amount of each service.
+    """
+
+    customer_id: int
+    contract_id: int
+    reference_date: str
+    service_names: tuple
+    item_cents: tuple
+
+    @property
+    def total_cents(self):
+        return sum(self.item_cents)
+
+    @property
+    def total_amount(self):
+        return from_cents(self.total_cents)
+
+    @property
+    def items(self):
+        return [ItemRecord(name, cents) for name, cents in zip(self.service_names, self.item_cents)]
+
+    def to_invoice(self):
+        return Invoice(
+            customer_id=self.customer_id,
+            contract_id=self.contract_id,
+            reference_date=self.reference_date,
+            total_amount=self.total_amount,
+            status=Invoice.WAITING,
+        )
+
+    def to_items(self, invoice):
+        return [
+            InvoiceItem(invoice=invoice, service_name=name, service_amount=from_cents(cents))
+            for name, cents in zip(self.service_names, self.item_cents)
+        ]
+
+
+def contract_chunks(queryset, chunk_size):
+    """Yield the contracts of ``queryset`` as :class:`ContractChunk` objects.
+
+    Contracts are read in primary key order, ``chunk_size`` at a time, with
+    keyset pagination, so rows updated while iterating are neither skipped
+    nor repeated. Each chunk costs two queries: contracts and services.
+    """
+    rows = queryset.order_by("pk").values_list(*CONTRACT_FIELDS)
+    last_pk = None
+    while True:
+        page = rows if last_pk is None else rows.filter(pk__gt=last_pk)
+        chunk = ContractChunk(page[:chunk_size])
+        if not chunk:
+            return
+        yield chunk.load_services()
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk.pks[-1]
@@ -0,0 +1,110 @@
+"""Streaming invoice exports.
+
+Rows are read with ``QuerySet.iterator()`` (server-side cursors where the
+database supports them) and written straight to the output stream, so
+memory use does not grow with the number of exported rows.
+"""
+
+import csv
+import json
+
+from .models import Invoice
+
+DEFAULT_CHUNK_SIZE = 2000
+
+INVOICE_FIELDS = ("invoice_id", "customer_id", "contract_id", "reference_date", "status", "total_amount")
+ITEM_FIELDS = ("item_id", "service_name", "service_amount")
+CSV_HEADER = INVOICE_FIELDS + ITEM_FIELDS
+
+FORMATS = ("csv", "jsonl")
+
+
+def filter_invoices(date_from=None, date_to=None, customer_id=None, status=None, invoice_ids=None):
+    """Return the invoices selected by the export filters."""
+    queryset = Invoice.objects.all()
+    if invoice_ids is not None:
+        queryset = queryset.filter(pk__in=invoice_ids)
+    if date_from:
+        queryset = queryset.filter(reference_date__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(reference_date__lte=date_to)
+    if customer_id is not None:
+        queryset = queryset.filter(customer_id=customer_id)
+    if status:
+        queryset = queryset.filter(status=status)
+    return queryset
+
+
+def iter_rows(invoices, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield one flat tuple per invoice item, ordered by invoice.
+
+    Invoices without items yield a single row with empty item columns.
+    """
+    return (
+        invoices.order_by("pk", "items__pk")
+        .values_list(
+            "pk",
+            "customer_id",
+            "contract_id",
+            "reference_date",
+            "status",
+            "total_amount",
+            "items__pk",
+            "items__service_name",
+            "items__service_amount",
+        )
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def write_csv(rows, stream):
+    """Write flat rows as CSV and return the number of data rows written."""
+    writer = csv.writer(stream)
+    writer.writerow(CSV_HEADER)
+    count = 0
+    for row in rows:
+        writer.writerow(["" if value is None else value for value in row])
+        count += 1
+    return count
+
+
+def _json_default(value):
+    return str(value)
+
+
+def write_jsonl(rows, stream):
+    """Write one JSON object per invoice, with its items nested.
+
+    Rows must be ordered by invoice; only one invoice is held in memory at a
+    time. Returns the number of lines written.
+    """
+    count = 0
+    current = None
+    for row in rows:
+        invoice_id = row[0]
+        if current is None or current["invoice_id"] != invoice_id:
+            if current is not None:
+                stream.write(json.dumps(current, default=_json_default) + "\n")
+                count += 1
+            current = dict(zip(INVOICE_FIELDS, row[: len(INVOICE_FIELDS)]))
+            current["items"] = []
+        item_id, service_name, service_amount = row[len(INVOICE_FIELDS):]
+        if item_id is not None:
+            current["items"].append(
+                {"item_id": item_id, "service_name": service_name, "service_amount": service_amount}
+            )
+    if current is not None:
+        stream.write(json.dumps(current, default=_json_default) + "\n")
+        count += 1
+    return count
+
+
+WRITERS = {"csv": write_csv, "jsonl": write_jsonl}
+
+
+def export_invoices(stream, fmt="csv", chunk_size=DEFAULT_CHUNK_SIZE, **filters):
+    """Stream the filtered invoices and items to ``stream`` in ``fmt``.
+
+    Returns the number of records written: CSV rows or JSON lines.
+    """
+    return WRITERS[fmt](iter_rows(filter_invoices(**filters), chunk_size), stream)
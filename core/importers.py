@@ -0,0 +1,273 @@
+"""Bulk import of customers, contracts and services.
+
+Each input row describes a customer and, optionally, one of its contracts
+and one service of that contract::
+
+    customer_email, customer_name, contract_number, start_date, end_date,
+    service_name, service_value
+
+Rows are validated and written in batches. Customers are upserted on their
+unique email, which is matched lowercase (customers store it lowercase, see
+``Customer.save``), and contracts on ``(customer, contract_number)`` with
+``bulk_create(update_conflicts=True)``; services are matched on
+``(contract, name)`` and updated or created in bulk. Bulk writes send no
+signals, so contracts, and the invoices and contracts of renamed customers,
+get a new ``updated_at``; their cached payloads and the cached customers
+and contracts are dropped here. Every batch runs in its own transaction.
+"""
+
+import csv
+import json
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+
+from . import caching
+from .models import Contract, Customer, Service
+
+FIELDS = (
+    "customer_email",
+    "customer_name",
+    "contract_number",
+    "start_date",
+    "end_date",
+    "service_name",
+    "service_value",
+)
+FORMATS = ("csv", "jsonl")
+DEFAULT_BATCH_SIZE = 1000
+
+
+@dataclass
+class CatalogRow:
+    """A validated input row."""
+
+    line: int
+    customer_email: str
+    customer_name: str
+    contract_number: str = ""
+    start_date: date = None
+    end_date: date = None
+    service_name: str = ""
+    service_value: Decimal = None
+
+
+@dataclass
+class ImportResult:
+    """Counters of a finished batch or import."""
+
+    rows: int = 0
+    rejected: int = 0
+    customers: int = 0
+    contracts: int = 0
+    services: int = 0
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.rejected += other.rejected
+        self.customers += other.customers
+        self.contracts += other.contracts
+        self.services += other.services
+
+
+def read_rows(stream, fmt):
+    """Yield ``(line, raw_row)`` pairs from a CSV or JSON Lines stream."""
+    if fmt == "csv":
+        for line, row in enumerate(csv.DictReader(stream), start=1):
+            yield line, row
+        return
+    for line, text in enumerate(stream, start=1):
+        if text.strip():
+            try:
+                row = json.loads(text)
+            except ValueError:
+                row = {"_error": "Invalid JSON."}
+            if not isinstance(row, dict):
+                row = {"_error": "A row must be a JSON object."}
+            yield line, row
+
+
+def batches(rows, size):
+    """Split ``rows`` into lists of at most ``size`` items."""
+    iterator = iter(rows)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _text(raw, field, max_length):
+    value = str(raw.get(field) or "").strip()
+    if len(value) > max_length:
+        raise ValidationError(f"{field} is longer than {max_length} characters.")
+    return value
+
+
+def _date(raw, field):
+    try:
+        return date.fromisoformat(_text(raw, field, 10))
+    except ValueError:
+        raise ValidationError(f"{field} must be a YYYY-MM-DD date.") from None
+
+
+def validate_row(line, raw):
+    """Return a :class:`CatalogRow` or raise ``ValidationError``."""
+    if "_error" in raw:
+        raise ValidationError(raw["_error"])
+    email = _text(raw, "customer_email", 254).lower()
+    validate_email(email)
+    row = CatalogRow(line=line, customer_email=email, customer_name=_text(raw, "customer_name", 200))
+
+    row.contract_number = _text(raw, "contract_number", 100)
+    row.service_name = _text(raw, "service_name", 200)
+    if row.service_name and not row.contract_number:
+        raise ValidationError("A service needs a contract_number.")
+    if row.contract_number:
+        row.start_date = _date(raw, "start_date")
+        row.end_date = _date(raw, "end_date")
+        if row.start_date > row.end_date:
+            raise ValidationError("start_date is after end_date.")
+    if row.service_name:
+        try:
+            value = Decimal(_text(raw, "service_value", 20))
+        except InvalidOperation:
+            raise ValidationError("service_value must be a number.") from None
+        if not value.is_finite() or value < 0 or value != value.quantize(Decimal("0.01")):
+            raise ValidationError("service_value must be a positive amount with at most 2 decimals.")
+        if value >= Decimal("1e8"):
+            raise ValidationError("service_value is too large.")
+        row.service_value = value
+    return row
+
+
+class CatalogImporter:
+    """Write validated rows in batches, remembering customer ids by email."""
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.customer_ids = {}
+
+    def import_batch(self, raw_rows, reject):
+        """Validate and write one batch of ``(line, raw_row)`` pairs.
+
+        ``reject(line, raw_row, message)`` is called for every invalid row.
+        Returns an :class:`ImportResult`.
+        """
+        result = ImportResult(rows=len(raw_rows))
+        valid = []
+        for line, raw in raw_rows:
+            try:
+                valid.append((validate_row(line, raw), raw))
+            except ValidationError as exc:
+                reject(line, raw, " ".join(exc.messages))
+
+        with transaction.atomic():
+            result.customers = self._upsert_customers([row for row, _ in valid])
+            rows = []
+            for row, raw in valid:
+                if row.customer_email in self.customer_ids:
+                    rows.append(row)
+                else:
+                    reject(row.line, raw, "Unknown customer: provide customer_name to create it.")
+            contract_ids, result.contracts = self._upsert_contracts(rows)
+            result.services = self._upsert_services(rows, contract_ids)
+        result.rejected = result.rows - len(rows)
+        return result
+
+    def _upsert_customers(self, rows):
+        named = {row.customer_email: row.customer_name for row in rows if row.customer_name}
+        unknown = {row.customer_email for row in rows} - named.keys() - self.customer_ids.keys()
+        if unknown:
+            self.customer_ids.update(
+                Customer.objects.filter(email__in=unknown).values_list("email", "pk")
+            )
+        if not named:
+            return 0
+        stored_names = dict(Customer.objects.filter(email__in=named).values_list("email", "name"))
+        customers = Customer.objects.bulk_create(
+            [Customer(email=email, name=name) for email, name in named.items()],
+            update_conflicts=True,
+            unique_fields=["email"],
+            update_fields=["name"],
+        )
+        if any(customer.pk is None for customer in customers):
+            self.customer_ids.update(
+                Customer.objects.filter(email__in=named).values_list("email", "pk")
+            )
+        else:
+            self.customer_ids.update((customer.email, customer.pk) for customer in customers)
+        renamed = [
+            self.customer_ids[email] for email, name in named.items() if stored_names.get(email, name) != name
+        ]
+        if renamed:
+            caching.forget(caching.CUSTOMER, *renamed)
+            # Invoice and contract payloads show the customer name.
+            caching.touch("invoices", customer_id__in=renamed)
+            caching.touch("contracts", customer_id__in=renamed)
+        return len(customers)
+
+    def _upsert_contracts(self, rows):
+        contracts = {}
+        for row in rows:
+            if row.contract_number:
+                key = (self.customer_ids[row.customer_email], row.contract_number)
+                contracts[key] = Contract(
+                    customer_id=key[0],
+                    contract_number=row.contract_number,
+                    start_date=row.start_date,
+                    end_date=row.end_date,
+                    billed_through=None,
+                )
+        if not contracts:
+            return {}, 0
+        # Bulk upserts bypass signals, so the billing watermark is reset here.
+        created = Contract.objects.bulk_create(
+            contracts.values(),
+            update_conflicts=True,
+            unique_fields=["customer", "contract_number"],
+            update_fields=["start_date", "end_date", "billed_through", "updated_at"],
+        )
+        if any(contract.pk is None for contract in created):
+            customer_ids = {customer_id for customer_id, _ in contracts}
+            numbers = {number for _, number in contracts}
+            ids = {
+                (customer_id, number): pk
+                for customer_id, number, pk in Contract.objects.filter(
+                    customer_id__in=customer_ids, contract_number__in=numbers
+                ).values_list("customer_id", "contract_number", "pk")
+            }
+        else:
+            ids = {(contract.customer_id, contract.contract_number): contract.pk for contract in created}
+        caching.invalidate("contracts", *ids.values())
+        caching.forget(caching.CONTRACT, *ids.values())
+        return ids, len(created)
+
+    def _upsert_services(self, rows, contract_ids):
+        values = {}
+        for row in rows:
+            if row.service_name:
+                contract_id = contract_ids[(self.customer_ids[row.customer_email], row.contract_number)]
+                values[(contract_id, row.service_name)] = row.service_value
+        if not values:
+            return 0
+        existing = {
+            (contract_id, name): pk
+            for contract_id, name, pk in Service.objects.filter(
+                contract_id__in={contract_id for contract_id, _ in values}
+            ).values_list("contract_id", "name", "pk")
+        }
+        to_update, to_create = [], []
+        for (contract_id, name), value in values.items():
+            service = Service(contract_id=contract_id, name=name, value=value)
+            if (contract_id, name) in existing:
+                service.pk = existing[(contract_id, name)]
+                to_update.append(service)
+            else:
+                to_create.append(service)
+        Service.objects.bulk_update(to_update, ["value"])
+        Service.objects.bulk_create(to_create)
+        caching.forget(caching.CONTRACT, *{contract_id for contract_id, _ in values})
+        return len(values)
@@ -0,0 +1,208 @@
+"""Opt-in query-count and latency instrumentation.
+
+When ``settings.INSTRUMENTATION["ENABLED"]`` is true, every request (through
+:class:`InstrumentationMiddleware`) and every management command is recorded
+with a database ``execute_wrapper``: number of queries, time spent in the
+database, wall time and the most repeated SQL shapes, which point at N+1
+query patterns. Each record is logged as JSON to the ``core.instrumentation``
+logger and folded into per-view totals served by the metrics view.
+
+Long-running commands set ``instrument_whole_run = False`` and record each
+unit of work instead (``run_worker`` records every job), so that records are
+published as the work happens and the recorder does not grow for the life
+of the process. A thread doing work for a record, like a job's heartbeat,
+joins it with :func:`recording_into`.
+
+When instrumentation is disabled the middleware removes itself and commands
+are not wrapped, so nothing is added to the request or query paths.
+"""
+
+import functools
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger("core.instrumentation")
+
+_IN_LIST = re.compile(r"\((?:\s*%s\s*,)+\s*%s\s*\)")
+_VALUES_LIST = re.compile(r"(VALUES\s*\([^)]*\))(?:\s*,\s*\([^)]*\))+", re.IGNORECASE)
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+# Distinct SQL strings kept per record; later ones are only counted.
+MAX_SHAPES = 1000
+
+_stats = {}
+_stats_lock = threading.Lock()
+_current = threading.local()
+
+
+def get_options():
+    return {"ENABLED": False, "TOP_DUPLICATES": 5, **getattr(settings, "INSTRUMENTATION", {})}
+
+
+def is_enabled():
+    return bool(get_options()["ENABLED"])
+
+
+def normalize_sql(sql):
+    """Reduce ``sql`` to its shape so repeated queries group together."""
+    sql = _IN_LIST.sub("(...)", sql)
+    sql = _VALUES_LIST.sub(r"\1, ...", sql)
+    return _LITERALS.sub("?", sql)
+
+
+class QueryRecorder:
+    """``execute_wrapper`` counting queries, database time and SQL shapes."""
+
+    def __init__(self, max_shapes=MAX_SHAPES):
+        self.queries = 0
+        self.db_time = 0.0
+        self.shapes = Counter()
+        self.max_shapes = max_shapes
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.db_time += elapsed
+                self.queries += 1
+                if sql in self.shapes or len(self.shapes) < self.max_shapes:
+                    self.shapes[sql] += 1
+
+    def install(self, stack):
+        """Wrap the connections of the current thread until ``stack`` closes."""
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(self))
+
+    def duplicates(self, limit):
+        """Return the ``limit`` most repeated query shapes run more than once."""
+        shapes = Counter()
+        for sql, count in self.shapes.items():
+            shapes[normalize_sql(sql)] += count
+        return [
+            {"sql": sql, "count": count}
+            for sql, count in shapes.most_common(limit)
+            if count > 1
+        ]
+
+
+@contextmanager
+def record(kind, label=None):
+    """Record the queries run inside the block.
+
+    Yields a dict; set ``"label"`` on it before the block ends when the label
+    is only known afterwards (e.g. the resolved view name of a request).
+    """
+    recorder = QueryRecorder()
+    entry = {"kind": kind, "label": label}
+    started = time.perf_counter()
+    previous = getattr(_current, "recorder", None)
+    _current.recorder = recorder
+    with ExitStack() as stack:
+        recorder.install(stack)
+        try:
+            yield entry
+        finally:
+            _current.recorder = previous
+            entry.update(
+                wall_time_ms=round((time.perf_counter() - started) * 1000, 3),
+                queries=recorder.queries,
+                db_time_ms=round(recorder.db_time * 1000, 3),
+                duplicates=recorder.duplicates(get_options()["TOP_DUPLICATES"]),
+            )
+            _publish(entry)
+
+
+def current_recorder():
+    """Return the recorder of the innermost :func:`record` block of this thread, if any."""
+    return getattr(_current, "recorder", None)
+
+
+@contextmanager
+def recording_into(recorder):
+    """Count the queries this thread runs inside the block into ``recorder``.
+
+    ``recorder`` comes from :func:`current_recorder` on another thread;
+    nothing is recorded when it is ``None``.
+    """
+    with ExitStack() as stack:
+        if recorder is not None:
+            recorder.install(stack)
+        yield
+
+
+def _publish(entry):
+    logger.info(json.dumps(entry))
+    key = f"{entry['kind']}:{entry['label']}"
+    with _stats_lock:
+        stats = _stats.setdefault(
+            key,
+            {"calls": 0, "wall_time_ms": 0.0, "db_time_ms": 0.0, "queries": 0, "max_queries": 0},
+        )
+        stats["calls"] += 1
+        stats["wall_time_ms"] += entry["wall_time_ms"]
+        stats["db_time_ms"] += entry["db_time_ms"]
+        stats["queries"] += entry["queries"]
+        stats["max_queries"] = max(stats["max_queries"], entry["queries"])
+
+
+def get_stats():
+    """Return per-view and per-command totals, slowest first."""
+    with _stats_lock:
+        rows = [{"name": key, **values} for key, values in _stats.items()]
+    for row in rows:
+        row["avg_wall_time_ms"] = round(row["wall_time_ms"] / row["calls"], 3)
+        row["avg_queries"] = round(row["queries"] / row["calls"], 2)
+    return sorted(rows, key=lambda row: row["wall_time_ms"], reverse=True)
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+class InstrumentationMiddleware:
+    """Record queries and latency of every request when enabled."""
+
+    def __init__(self, get_response):
+        if not is_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with record("request") as entry:
+            response = self.get_response(request)
+            match = getattr(request, "resolver_match", None)
+            entry["label"] = match.view_name if match else request.path
+            entry["method"] = request.method
+            entry["status"] = response.status_code
+        return response
+
+
+def instrument_commands(command_class):
+    """Wrap ``command_class.execute`` so that every command run is recorded."""
+    original = command_class.execute
+    if getattr(original, "instrumented", False):
+        return
+
+    @functools.wraps(original)
+    def execute(self, *args, **options):
+        if not getattr(self, "instrument_whole_run", True):
+            return original(self, *args, **options)
+        with record("command", self.__module__.rpartition(".")[2]):
+            return original(self, *args, **options)
+
+    execute.instrumented = True
+    command_class.execute = execute
@@ -0,0 +1,327 @@
+"""Background jobs stored in the database.
+
+Jobs are :class:`core.models.Job` rows run by the ``run_worker`` command;
+no broker is involved. A worker claims a queued job with a compare-and-set
+``update()`` on its status, so concurrent workers (threads or processes,
+SQLite included) never run the same job twice. The claim holds a lease
+that a heartbeat thread renews while the handler runs; the jobs of a worker
+that died are requeued once their lease expires. A failing job is retried
+with exponential backoff until it has used ``max_attempts``.
+
+Handlers take the job and a :class:`Progress` they report counters to,
+and return a JSON-serialisable result.
+"""
+
+import logging
+import os
+import socket
+import threading
+from contextlib import closing, nullcontext
+from datetime import date, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, connections, close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from . import billing, exports, instrumentation
+from .models import Job
+
+logger = logging.getLogger("core.jobs")
+
+REPORT_INTERVAL = 1.0
+CLAIM_CANDIDATES = 10
+EXPORT_PROGRESS_ROWS = 10_000
+
+HANDLERS = {}
+
+
+class LeaseLost(Exception):
+    """The job was requeued or claimed by another worker meanwhile."""
+
+
+def handler(kind):
+    """Register the decorated function as the handler of ``kind`` jobs."""
+
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+
+    return register
+
+
+def lease_duration():
+    return timedelta(seconds=settings.JOBS["LEASE_SECONDS"])
+
+
+def retry_delay(attempts):
+    """Return how long to wait before retrying a job that failed ``attempts`` times."""
+    return timedelta(seconds=settings.JOBS["RETRY_DELAY_SECONDS"] * 2 ** (attempts - 1))
+
+
+def worker_name(index=0):
+    return f"{socket.gethostname()}:{os.getpid()}:{index}"
+
+
+def enqueue(kind, **arguments):
+    """Queue a ``kind`` job with ``arguments`` and return it."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind {kind!r}.")
+    return Job.objects.create(kind=kind, arguments=arguments, max_attempts=settings.JOBS["MAX_ATTEMPTS"])
+
+
+def claim(worker, now=None):
+    """Claim the next due job for ``worker`` and return it, or ``None``."""
+    now = now or timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_after__lte=now).order_by("run_after", "pk")
+    for pk in due.values_list("pk", flat=True)[:CLAIM_CANDIDATES]:
+        claimed = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING,
+            worker=worker,
+            attempts=F("attempts") + 1,
+            progress={},
+            started_at=now,
+            heartbeat_at=now,
+            lease_expires_at=now + lease_duration(),
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def requeue_expired(now=None):
+    """Requeue, or fail once out of attempts, the running jobs whose lease expired.
+
+    Returns the number of jobs requeued or failed.
+    """
+    now = now or timezone.now()
+    expired = Job.objects.filter(status=Job.RUNNING, lease_expires_at__lt=now)
+    error = "The worker stopped renewing its lease."
+    failed = expired.filter(attempts__gte=F("max_attempts")).update(
+        status=Job.FAILED, error=error, finished_at=now, lease_expires_at=None
+    )
+    requeued = expired.update(status=Job.QUEUED, error=error, run_after=now, lease_expires_at=None)
+    return failed + requeued
+
+
+def _owned(job, worker):
+    return Job.objects.filter(pk=job.pk, status=Job.RUNNING, worker=worker)
+
+
+class Progress:
+    """Counters a handler reports while it runs.
+
+    Reporting only updates the counters in memory; the job's
+    :class:`Heartbeat` saves them. It raises :class:`LeaseLost` once the job
+    is no longer owned by the worker, so that the handler stops early.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.lost = False
+
+    def report(self, **counters):
+        if self.lost:
+            raise LeaseLost
+        self.counters.update(counters)
+
+
+class Heartbeat(threading.Thread):
+    """Saves the progress and renews the lease of a running job until stopped.
+
+    The writes go through the heartbeat thread's own connection: on SQLite
+    the handler's connection may hold a read snapshot, e.g. while streaming
+    an export, and could not write to the job row until it is released.
+    """
+
+    def __init__(self, job, worker, progress):
+        super().__init__(name=f"heartbeat-{job.pk}", daemon=True)
+        self.job = job
+        self.worker = worker
+        self.progress = progress
+        self.stopped = threading.Event()
+        self._saved = {}
+        self._renew_at = timezone.now() + lease_duration() / 3
+        # Count the heartbeat's queries into the job's record, if any.
+        self.recorder = instrumentation.current_recorder()
+
+    def beat(self, now=None):
+        """Write one heartbeat; return ``False`` if the job was lost."""
+        now = now or timezone.now()
+        renew = now >= self._renew_at
+        changes = {"heartbeat_at": now}
+        counters = dict(self.progress.counters)
+        if counters != self._saved:
+            changes["progress"] = counters
+        if renew:
+            changes["lease_expires_at"] = now + lease_duration()
+        if not _owned(self.job, self.worker).update(**changes):
+            self.progress.lost = True
+            return False
+        self._saved = counters
+        if renew:
+            self._renew_at = now + lease_duration() / 3
+        return True
+
+    def run(self):
+        try:
+            with instrumentation.recording_into(self.recorder):
+                self._beat_until_stopped()
+        finally:
+            connections.close_all()
+
+    def _beat_until_stopped(self):
+        while not self.stopped.wait(REPORT_INTERVAL):
+            try:
+                if not self.beat():
+                    return
+            except Exception:
+                # E.g. "database is locked": the lease is renewed a third
+                # of the way through, so the next beats can still save it.
+                logger.exception("Could not save the heartbeat of job %s; retrying.", self.job.pk)
+                if not connection.in_atomic_block:
+                    close_old_connections()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_job(job, worker):
+    """Run a claimed job and record its result, or its failure and retry.
+
+    Returns the final status of the attempt, or ``None`` if the job was lost.
+    """
+    progress = Progress()
+    heartbeat = Heartbeat(job, worker, progress)
+    heartbeat.start()
+    try:
+        result = HANDLERS[job.kind](job, progress)
+    except LeaseLost:
+        logger.warning("Lost the lease of job %s.", job.pk)
+        return None
+    except Exception as exc:
+        logger.exception("Job %s failed.", job.pk)
+        return _fail(job, worker, f"{type(exc).__name__}: {exc}", progress.counters)
+    finally:
+        heartbeat.stop()
+
+    _owned(job, worker).update(
+        status=Job.SUCCEEDED,
+        progress=progress.counters,
+        result=result or {},
+        error="",
+        finished_at=timezone.now(),
+        lease_expires_at=None,
+    )
+    return Job.SUCCEEDED
+
+
+def _fail(job, worker, error, counters):
+    now = timezone.now()
+    if job.attempts < job.max_attempts:
+        status, changes = Job.QUEUED, {"run_after": now + retry_delay(job.attempts)}
+    else:
+        status, changes = Job.FAILED, {"finished_at": now}
+    _owned(job, worker).update(status=status, error=error, progress=counters, lease_expires_at=None, **changes)
+    return status
+
+
+def _recorded(job):
+    if instrumentation.is_enabled():
+        return instrumentation.record("job", job.kind)
+    return nullcontext()
+
+
+def work(worker, stop, poll_interval=1.0, burst=False):
+    """Claim and run jobs until ``stop`` is set.
+
+    In ``burst`` mode the loop also ends as soon as no job is due. Returns
+    the number of jobs run.
+    """
+    ran = 0
+    while not stop.is_set():
+        # Outside tests, drop connections that errored or outlived CONN_MAX_AGE.
+        if not connection.in_atomic_block:
+            close_old_connections()
+        requeue_expired()
+        job = claim(worker)
+        if job is None:
+            if burst:
+                break
+            stop.wait(poll_interval)
+            continue
+        try:
+            with _recorded(job):
+                run_job(job, worker)
+        except Exception:
+            # The outcome could not be saved; the job is retried once its lease expires.
+            logger.exception("Could not record the outcome of job %s.", job.pk)
+        ran += 1
+    return ran
+
+
+@handler(Job.BILLING)
+def run_billing(job, progress):
+    """Bill the contracts selected by the job arguments like ``generate_invoices``.
+
+    Arguments: ``today`` (ISO date, defaults to the run date), ``since``
+    (``YYYY-MM``), ``shard`` (``INDEX/COUNT``) and ``contract_ids``.
+    """
+    arguments = job.arguments
+    today = date.fromisoformat(arguments["today"]) if arguments.get("today") else date.today()
+    since = billing.parse_month(arguments["since"]) if arguments.get("since") else None
+    shard = billing.parse_shard(arguments["shard"]) if arguments.get("shard") else None
+
+    def report(summary, contracts):
+        progress.report(
+            contracts=contracts, invoices=summary.invoices_created, items=summary.items_created
+        )
+
+    summary = billing.generate_invoices(
+        today, shard=shard, since=since, contract_ids=arguments.get("contract_ids"), progress=report
+    )
+    return {
+        "invoices": summary.invoices_created,
+        "items": summary.items_created,
+        "total_amount": str(summary.total_amount),
+        "elapsed": round(summary.elapsed, 2),
+    }
+
+
+@handler(Job.EXPORT)
+def run_export(job, progress):
+    """Export invoices to a file under ``JOBS["EXPORT_ROOT"]``.
+
+    Arguments: ``format`` (``csv`` or ``jsonl``) and the filters of
+    :func:`core.exports.filter_invoices`. The file appears under its final
+    name only once complete.
+    """
+    arguments = job.arguments
+    fmt = arguments.get("format", "csv")
+    if fmt not in exports.FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}.")
+    filters = {
+        key: arguments[key]
+        for key in ("date_from", "date_to", "customer_id", "status", "invoice_ids")
+        if arguments.get(key) is not None
+    }
+    root = Path(settings.JOBS["EXPORT_ROOT"])
+    root.mkdir(parents=True, exist_ok=True)
+    path = root / f"invoices-{job.pk}.{fmt}"
+    partial = path.with_name(path.name + ".part")
+
+    def counted(rows):
+        for count, row in enumerate(rows, start=1):
+            if count % EXPORT_PROGRESS_ROWS == 0:
+                progress.report(rows=count)
+            yield row
+
+    rows = exports.iter_rows(exports.filter_invoices(**filters))
+    # Closing the rows releases the cursor even when the export fails.
+    with closing(rows), open(partial, "w", encoding="utf-8", newline="") as stream:
+        records = exports.WRITERS[fmt](counted(rows), stream)
+    os.replace(partial, path)
+    progress.report(records=records)
+    return {"path": str(path), "records": records}
@@ -0,0 +1,123 @@
+import gzip
+import io
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import exports
+from core.billing import parse_month
+from core.models import Invoice
+
+
+class Command(BaseCommand):
+    """Stream invoices and their items to CSV or JSON Lines."""
+
+    help = "Export invoices and invoice items as CSV or JSON Lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format",
+            choices=exports.FORMATS,
+            default="csv",
+            help="Output format (default: csv).",
+        )
+        parser.add_argument(
+            "--output",
+            default="-",
+            help="File to write; '-' writes to stdout (default).",
+        )
+        parser.add_argument(
+            "--gzip",
+            action="store_true",
+            help="Compress the output with gzip (implied by a .gz output file).",
+        )
+        parser.add_argument("--from", dest="date_from", help="First reference month, YYYY-MM.")
+        parser.add_argument("--to", dest="date_to", help="Last reference month, YYYY-MM.")
+        parser.add_argument("--customer", type=int, help="Only export this customer id.")
+        parser.add_argument(
+            "--status",
+            choices=[value for value, _ in Invoice.STATUS_CHOICES],
+            help="Only export invoices with this status.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=exports.DEFAULT_CHUNK_SIZE,
+            help="Rows fetched from the database per round trip.",
+        )
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be at least 1.")
+        for key in ("date_from", "date_to"):
+            if options[key]:
+                try:
+                    parse_month(options[key])
+                except ValueError as exc:
+                    raise CommandError(str(exc))
+
+        output = options["output"]
+        compress = options["gzip"] or output.endswith(".gz")
+        started = time.monotonic()
+        try:
+            with self._open(output, compress) as stream:
+                count = exports.export_invoices(
+                    stream,
+                    options["format"],
+                    chunk_size=options["chunk_size"],
+                    date_from=options["date_from"],
+                    date_to=options["date_to"],
+                    customer_id=options["customer"],
+                    status=options["status"],
+                )
+        except BrokenPipeError:
+            # The reading end of a pipeline (e.g. ``| head``) went away.
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            return
+        if output != "-":
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                self.style.SUCCESS(f"Exported {count} records to {output} in {elapsed:.2f}s.")
+            )
+
+    def _open(self, output, compress):
+        """Return a text stream for ``output``, closing files but not stdout."""
+        if output == "-":
+            if not compress:
+                return _Unclosed(self.stdout)
+            binary = getattr(self.stdout, "buffer", None) or sys.stdout.buffer
+            # GzipFile never closes a stream passed as fileobj.
+            return io.TextIOWrapper(
+                gzip.GzipFile(fileobj=binary, mode="wb"), encoding="utf-8", newline=""
+            )
+        if compress:
+            return gzip.open(output, "wt", encoding="utf-8", newline="")
+        return open(output, "w", encoding="utf-8", newline="")
+
+
+class _Unclosed:
+    """Stream proxy whose ``close()`` flushes without closing the target."""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def write(self, data):
+        return self._stream.write(data)
+
+    def close(self):
+        self.flush()
+
+    def flush(self):
+        if hasattr(self._stream, "flush"):
+            self._stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -2,47 +2,135 @@ from datetime import date, timedelta
 import random
 from decimal import Decimal
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
+from core import billing
 from core.models import Customer, Contract, Service
 
+COMPANY_PREFIXES = [
+    "Alpha", "Beta", "Gamma", "Delta", "Epsilon",
+    "Omega", "Apex", "Prime", "Quantum", "Nova",
+]
+COMPANY_SUFFIXES = ["Corp", "Ltd", "LLC", "Inc"]
+SERVICE_NAMES = [
+    "Hosting", "Support", "Consulting", "Backup",
+    "Analytics", "Monitoring", "Security", "Training",
+]
+
+
+def parse_range(value):
+    """Parse ``"N"`` or ``"MIN-MAX"`` into a ``(min, max)`` pair."""
+    try:
+        low, _, high = value.partition("-")
+        low, high = int(low), int(high or low)
+    except ValueError:
+        raise CommandError(f"Invalid range {value!r}, expected N or MIN-MAX.") from None
+    if low < 0 or low > high:
+        raise CommandError(f"Invalid range {value!r}, expected 0 <= MIN <= MAX.")
+    return low, high
+
 
 class Command(BaseCommand):
     """Generate fake customers, contracts and services."""
 
     help = "Create fake data for development and tests"
 
+    def add_arguments(self, parser):
+        parser.add_argument("--customers", type=int, default=10, help="Number of customers to create.")
+        parser.add_argument(
+            "--contracts-per-customer",
+            default="1-5",
+            help="Contracts per customer, N or MIN-MAX (default: 1-5).",
+        )
+        parser.add_argument(
+            "--services-per-contract",
+            default="3-4",
+            help="Services per contract, N or MIN-MAX (default: 3-4).",
+        )
+        parser.add_argument(
+            "--months-of-history",
+            type=int,
+            default=0,
+            help="Start contracts up to this many months ago and bill them (default: no invoices).",
+        )
+        parser.add_argument("--seed", type=int, help="Seed for a reproducible dataset.")
+        parser.add_argument(
+            "--today",
+            type=date.fromisoformat,
+            help="Date the dataset is anchored to, YYYY-MM-DD (default: today).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Customers created per bulk insert transaction.",
+        )
+
     def handle(self, *args, **options):
-        company_prefixes = [
-            "Alpha", "Beta", "Gamma", "Delta", "Epsilon",
-            "Omega", "Apex", "Prime", "Quantum", "Nova",
-        ]
-        company_suffixes = ["Corp", "Ltd", "LLC", "Inc"]
-        service_names = [
-            "Hosting", "Support", "Consulting", "Backup",
-            "Analytics", "Monitoring", "Security", "Training",
-        ]
-
-        for i in range(10):
-            name = f"{random.choice(company_prefixes)} {random.choice(company_suffixes)}"
-            email = f"contact{i}@example.com"
-            customer = Customer.objects.create(name=name, email=email)
-
-            for j in range(random.randint(1, 5)):
-                start = date.today() - timedelta(days=random.randint(0, 365))
-                end = start + timedelta(days=random.randint(30, 365))
-                contract = Contract.objects.create(
-                    customer=customer,
-                    contract_number=f"CUST{i}-CON{j}",
-                    start_date=start,
-                    end_date=end,
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        rng = random.Random(options["seed"])
+        today = options["today"] or date.today()
+        contracts_range = parse_range(options["contracts_per_customer"])
+        services_range = parse_range(options["services_per_contract"])
+        months = options["months_of_history"]
+        start_window = months * 31 if months else 365
+        batch_size = options["batch_size"]
+
+        totals = [0, 0, 0]
+        for first in range(0, options["customers"], batch_size):
+            last = min(first + batch_size, options["customers"])
+            with transaction.atomic():
+                customers = Customer.objects.bulk_create(
+                    Customer(
+                        name=f"{rng.choice(COMPANY_PREFIXES)} {rng.choice(COMPANY_SUFFIXES)}",
+                        email=f"contact{i}@example.com",
+                    )
+                    for i in range(first, last)
                 )
 
-                for _ in range(random.randint(3, 4)):
-                    Service.objects.create(
-                        contract=contract,
-                        name=random.choice(service_names),
-                        value=Decimal(random.uniform(10, 1000)).quantize(Decimal("0.01")),
+                contracts = []
+                for i, customer in zip(range(first, last), customers):
+                    for j in range(rng.randint(*contracts_range)):
+                        start = today - timedelta(days=rng.randint(0, start_window))
+                        end = start + timedelta(days=rng.randint(30, 365))
+                        contracts.append(
+                            Contract(
+                                customer_id=customer.pk,
+                                contract_number=f"CUST{i}-CON{j}",
+                                start_date=start,
+                                end_date=end,
+                            )
+                        )
+                contracts = Contract.objects.bulk_create(contracts, batch_size=batch_size)
+
+                services = []
+                for contract in contracts:
+                    count = rng.randint(*services_range)
+                    names = rng.sample(SERVICE_NAMES, min(count, len(SERVICE_NAMES)))
+                    names += [f"Service {k}" for k in range(len(names), count)]
+                    services.extend(
+                        Service(
+                            contract_id=contract.pk,
+                            name=name,
+                            value=Decimal(rng.uniform(10, 1000)).quantize(Decimal("0.01")),
+                        )
+                        for name in names
                     )
+                Service.objects.bulk_create(services, batch_size=batch_size)
+
+            totals[0] += len(customers)
+            totals[1] += len(contracts)
+            totals[2] += len(services)
+            if options["verbosity"] > 1:
+                self.stdout.write(f"{totals[0]} customers created.")
+
+        if months:
+            summary = billing.generate_invoices(today)
+            self.stdout.write(f"Billed {summary.invoices_created} invoices of history.")
 
+        self.stdout.write(
+            f"Created {totals[0]} customers, {totals[1]} contracts and {totals[2]} services."
+        )
         self.stdout.write(self.style.SUCCESS("Fake data generated."))
@@ -1,10 +1,8 @@
-from calendar import monthrange
 from datetime import date
-from decimal import Decimal
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
-from core.models import Contract, Invoice, InvoiceItem
+from core import billing, preview
 
 
 class Command(BaseCommand):
@@ -12,55 +10,93 @@ class Command(BaseCommand):
 
     help = "Generate monthly invoices for all contracts"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Bill customer shards in this many worker processes.",
+        )
+        parser.add_argument(
+            "--shard",
+            help="Only bill shard INDEX/COUNT, e.g. 0/4 (contracts are split by customer).",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=billing.DEFAULT_CHUNK_SIZE,
+            help="Contracts read and invoices written per round trip; bounds memory use "
+            f"(default: {billing.DEFAULT_CHUNK_SIZE}).",
+        )
+        parser.add_argument(
+            "--since",
+            help="Do not scan months before YYYY-MM.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            "--preview",
+            action="store_true",
+            dest="dry_run",
+            help="Show the invoices that would be created without writing anything.",
+        )
+        parser.add_argument(
+            "--preview-format",
+            choices=preview.FORMATS,
+            default="summary",
+            help="Preview output: per-customer summary or one JSON line per invoice (default: summary).",
+        )
+
     def handle(self, *args, **options):
         today = date.today()
-        for contract in Contract.objects.all():
-            end_date = contract.end_date
-            if end_date > today:
-                end_date = today
-            month = contract.start_date.replace(day=1)
-            last_month = end_date.replace(day=1)
-            while month <= last_month:
-                reference = month.strftime("%Y-%m")
-                if Invoice.objects.filter(contract=contract, reference_date=reference).exists():
-                    month = self._next_month(month)
-                    continue
+        workers = options["workers"]
+        chunk_size = options["chunk_size"]
+        if workers < 1:
+            raise CommandError("--workers must be at least 1.")
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be at least 1.")
+        if workers > 1 and options["shard"]:
+            raise CommandError("--workers and --shard cannot be combined.")
+        if workers > 1 and options["dry_run"]:
+            raise CommandError("--workers and --dry-run cannot be combined.")
+
+        try:
+            since = billing.parse_month(options["since"]) if options["since"] else None
+            shard = billing.parse_shard(options["shard"]) if options["shard"] else None
+        except ValueError as exc:
+            raise CommandError(str(exc))
 
-                days_in_month = monthrange(month.year, month.month)[1]
-                month_start = month
-                month_end = month.replace(day=days_in_month)
+        if options["dry_run"]:
+            self._preview(today, shard, since, options["preview_format"], chunk_size)
+            return
 
-                charge_start = max(contract.start_date, month_start)
-                charge_end = min(end_date, month_end)
+        if workers > 1:
+            summaries, errors = billing.generate_invoices_parallel(today, workers, chunk_size, since=since)
+        else:
+            summaries, errors = [billing.generate_invoices(today, chunk_size, shard=shard, since=since)], {}
 
-                invoice = Invoice.objects.create(
-                    customer=contract.customer,
-                    contract=contract,
-                    reference_date=reference,
-                    total_amount=Decimal("0.00"),
-                    status=Invoice.WAITING,
-                )
+        total = billing.BillingSummary()
+        for summary in summaries:
+            total.merge(summary)
+            if summary.shard is not None:
+                self.stdout.write(self._describe(f"Shard {summary.shard[0]}/{summary.shard[1]}", summary))
+        self.stdout.write(self.style.SUCCESS(self._describe("Created", total)))
 
-                total = Decimal("0.00")
-                for service in contract.services.all():
-                    if charge_start == month_start and charge_end == month_end:
-                        amount = service.value
-                    else:
-                        days = (charge_end - charge_start).days + 1
-                        amount = (service.value * Decimal(days) / Decimal(days_in_month)).quantize(Decimal("0.01"))
-                    InvoiceItem.objects.create(
-                        invoice=invoice,
-                        service_name=service.name,
-                        service_amount=amount,
-                    )
-                    total += amount
+        if errors:
+            failed = ", ".join(f"{index}/{count}: {exc}" for (index, count), exc in sorted(errors.items()))
+            raise CommandError(f"Billing failed for shard(s) {failed}. Re-run to bill the remaining contracts.")
 
-                invoice.total_amount = total.quantize(Decimal("0.01"))
-                invoice.save()
+    def _preview(self, today, shard, since, fmt, chunk_size):
+        result = preview.write_preview(self.stdout, today, fmt, shard=shard, since=since, chunk_size=chunk_size)
+        # Keep JSON Lines output parseable: the closing summary goes to stderr.
+        out = self.stderr if fmt == "jsonl" else self.stdout
+        out.write(self._describe("Would create", result.summary), style_func=self.style.SUCCESS)
 
-                month = self._next_month(month)
+    def _describe(self, label, summary):
+        return (
+            f"{label} {summary.invoices_created} invoices "
+            f"({summary.items_created} items, total {summary.total_amount}) "
+            f"in {summary.elapsed:.2f}s."
+        )
 
     def _next_month(self, dt):
-        if dt.month == 12:
-            return dt.replace(year=dt.year + 1, month=1, day=1)
-        return dt.replace(month=dt.month + 1, day=1)
+        return billing.next_month(dt)
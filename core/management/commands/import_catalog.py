@@ -0,0 +1,122 @@
+import csv
+import json
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import importers
+
+
+class Command(BaseCommand):
+    """Import customers, contracts and services from CSV or JSON Lines."""
+
+    help = "Bulk import customers, contracts and services from a CSV or JSONL file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV or JSON Lines file to import.")
+        parser.add_argument(
+            "--format",
+            choices=importers.FORMATS,
+            help="Input format (default: guessed from the file extension).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=importers.DEFAULT_BATCH_SIZE,
+            help="Rows validated and written per transaction.",
+        )
+        parser.add_argument(
+            "--errors",
+            help="CSV file receiving rejected rows (default: PATH.errors.csv).",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="File recording the rows already imported (default: PATH.checkpoint).",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Skip the rows recorded in the checkpoint of an interrupted import.",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        path = options["path"]
+        fmt = options["format"] or ("jsonl" if path.endswith((".jsonl", ".json")) else "csv")
+        checkpoint = options["checkpoint"] or f"{path}.checkpoint"
+        errors_path = options["errors"] or f"{path}.errors.csv"
+
+        skip = 0
+        if options["resume"] and os.path.exists(checkpoint):
+            with open(checkpoint) as handle:
+                skip = json.load(handle)["rows"]
+        if not skip and os.path.exists(errors_path):
+            os.remove(errors_path)
+
+        importer = importers.CatalogImporter(options["batch_size"])
+        total = importers.ImportResult()
+        started = time.monotonic()
+        try:
+            with open(path, newline="", encoding="utf-8") as stream, \
+                    RejectedRows(errors_path, append=skip > 0) as rejected:
+                rows = islice(importers.read_rows(stream, fmt), skip, None)
+                for batch in importers.batches(rows, options["batch_size"]):
+                    total.merge(importer.import_batch(batch, rejected.add))
+                    self._save_checkpoint(checkpoint, skip + total.rows)
+                    if options["verbosity"] > 1:
+                        self.stdout.write(f"{skip + total.rows} rows processed.")
+        except OSError as exc:
+            raise CommandError(str(exc))
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        elapsed = time.monotonic() - started
+        rate = total.rows / elapsed if elapsed else float(total.rows)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {total.rows - total.rejected} of {total.rows} rows "
+                f"({total.customers} customers, {total.contracts} contracts, "
+                f"{total.services} services) in {elapsed:.2f}s, {rate:.0f} rows/s."
+            )
+        )
+        if total.rejected:
+            self.stdout.write(self.style.WARNING(f"{total.rejected} rejected rows written to {errors_path}."))
+
+    def _save_checkpoint(self, path, rows):
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as handle:
+            json.dump({"rows": rows}, handle)
+        os.replace(temporary, path)
+
+
+class RejectedRows:
+    """Sidecar CSV of rejected rows, created on the first rejection."""
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.append = append
+        self._handle = None
+        self._writer = None
+
+    def add(self, line, raw, message):
+        if self._writer is None:
+            new_file = not (self.append and os.path.exists(self.path))
+            self._handle = open(self.path, "w" if new_file else "a", newline="", encoding="utf-8")
+            self._writer = csv.DictWriter(
+                self._handle,
+                fieldnames=("line",) + importers.FIELDS + ("error",),
+                extrasaction="ignore",
+            )
+            if new_file:
+                self._writer.writeheader()
+        self._writer.writerow({**raw, "line": line, "error": message})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._handle is not None:
+            self._handle.close()
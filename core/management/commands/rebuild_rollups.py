@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import billing, rollups
+
+
+class Command(BaseCommand):
+    """Recompute the monthly revenue rollups from the invoice items."""
+
+    help = "Rebuild the revenue rollups of all or a range of reference months"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="date_from", help="First reference month, YYYY-MM.")
+        parser.add_argument("--to", dest="date_to", help="Last reference month, YYYY-MM.")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of rollup rows written per insert.",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        for option in ("date_from", "date_to"):
+            if options[option]:
+                try:
+                    billing.parse_month(options[option])
+                except ValueError as exc:
+                    raise CommandError(str(exc))
+
+        started = time.monotonic()
+        written = rollups.rebuild_rollups(options["date_from"], options["date_to"], options["batch_size"])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} revenue rollups in {elapsed:.2f}s."))
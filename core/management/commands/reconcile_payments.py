@@ -0,0 +1,72 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import payments
+
+
+class Command(BaseCommand):
+    """Mark invoices as paid from a bank payment file."""
+
+    help = "Reconcile a CSV or OFX payment file against the waiting invoices"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV or OFX payment file.")
+        parser.add_argument(
+            "--format",
+            choices=payments.FORMATS,
+            help="Input format (default: guessed from the file extension).",
+        )
+        parser.add_argument(
+            "--report",
+            help="CSV reconciliation report with one row per payment (default: PATH.report.csv).",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Match and report the payments without marking invoices as paid.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=payments.DEFAULT_BATCH_SIZE,
+            help="Payments matched per invoice lookup.",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        path = options["path"]
+        fmt = options["format"] or ("ofx" if path.lower().endswith((".ofx", ".qfx")) else "csv")
+        report_path = options["report"] or f"{path}.report.csv"
+
+        started = time.monotonic()
+        try:
+            with open(path, newline="", encoding="utf-8") as stream, \
+                    open(report_path, "w", newline="", encoding="utf-8") as report:
+                writer = csv.DictWriter(report, fieldnames=payments.REPORT_FIELDS)
+                writer.writeheader()
+                counts = payments.reconcile(
+                    payments.read_payments(stream, fmt),
+                    report=lambda outcome: writer.writerow(outcome.as_row()),
+                    apply=not options["dry_run"],
+                    batch_size=options["batch_size"],
+                )
+        except OSError as exc:
+            raise CommandError(str(exc))
+
+        elapsed = time.monotonic() - started
+        total = sum(counts.values())
+        verb = "Would mark" if options["dry_run"] else "Marked"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{verb} {counts[payments.MATCHED]} of {total} payments as paid in {elapsed:.2f}s."
+            )
+        )
+        problems = {outcome: count for outcome, count in counts.items() if outcome != payments.MATCHED}
+        if problems:
+            details = ", ".join(
+                f"{count} {outcome.replace('_', ' ')}" for outcome, count in sorted(problems.items())
+            )
+            self.stdout.write(self.style.WARNING(f"Not reconciled: {details}. See {report_path}."))
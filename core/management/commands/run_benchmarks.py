@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from benchmarks import cases, runner
+
+
+class Command(BaseCommand):
+    """Time the billing, admin and data-loading hot paths."""
+
+    help = "Run the benchmark suite in a throwaway database and compare it with a baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--customers",
+            type=int,
+            default=1000,
+            help="Number of customers in the seeded dataset.",
+        )
+        parser.add_argument("--seed", type=int, default=1, help="Seed of the generated dataset.")
+        parser.add_argument(
+            "--output",
+            default="benchmark-results.json",
+            help="JSON file receiving the results.",
+        )
+        parser.add_argument(
+            "--baseline",
+            help="Results file to compare with; regressions make the command fail.",
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=runner.DEFAULT_THRESHOLD,
+            help="Allowed relative growth of wall time and memory (default: 0.20).",
+        )
+        parser.add_argument(
+            "--only",
+            nargs="+",
+            metavar="CASE",
+            help="Only record these cases (earlier cases still run to build the data).",
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            results = runner.run_cases(
+                cases.build_cases(options["customers"], options["seed"]),
+                only=options["only"],
+                report=self._report,
+            )
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        report = runner.build_report(results, customers=options["customers"], seed=options["seed"])
+        runner.save_report(report, options["output"])
+        self.stdout.write(f"Results written to {options['output']}.")
+
+        if options["baseline"]:
+            baseline = runner.load_report(options["baseline"])
+            regressions = runner.compare(results, baseline["results"], options["threshold"])
+            if regressions:
+                raise CommandError("Performance regressions:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
+
+    def _report(self, name, measurement):
+        self.stdout.write(
+            f"{name:32} {measurement.wall_time:9.4f}s {measurement.queries:6} queries "
+            f"{measurement.peak_memory_kb:10.0f} KiB {measurement.rows_per_second:12.0f} rows/s"
+        )
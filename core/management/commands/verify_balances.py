@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import balances
+
+
+class Command(BaseCommand):
+    """Detect and repair drift in invoice totals and customer balances."""
+
+    help = "Recompute invoice totals and customer balances and repair any drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report drift, do not repair it.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of rows read and written per batch.",
+        )
+
+    def handle(self, *args, **options):
+        repair = not options["dry_run"]
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        invoices = balances.verify_invoice_totals(repair, batch_size)
+        customers = balances.verify_customer_balances(repair, batch_size)
+
+        action = "Repaired" if repair else "Found"
+        message = f"{action} {invoices} invoice totals and {customers} customer balances with drift."
+        style = self.style.SUCCESS if repair or not (invoices or customers) else self.style.WARNING
+        self.stdout.write(style(message))
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 02:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0005_add_contract_to_invoice"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="contract",
+            name="billed_through",
+            field=models.DateField(
+                blank=True,
+                editable=False,
+                help_text="First day of the last month checked by generate_invoices.",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2 on 2026-10-18 03:10
+
+import django.core.validators
+from django.db import migrations, models
+
+
+def check_duplicate_invoices(apps, schema_editor):
+    """Refuse to continue while a contract has two invoices for one month."""
+    Invoice = apps.get_model("core", "Invoice")
+    duplicates = list(
+        Invoice.objects.filter(contract__isnull=False)
+        .values_list("contract_id", "reference_date")
+        .annotate(total=models.Count("id"))
+        .filter(total__gt=1)
+        .order_by("contract_id", "reference_date")
+    )
+    if duplicates:
+        keys = ", ".join(
+            f"contract {contract_id} {reference_date}" for contract_id, reference_date, _ in duplicates[:20]
+        )
+        more = f" and {len(duplicates) - 20} more" if len(duplicates) > 20 else ""
+        raise RuntimeError(
+            f"{len(duplicates)} contract months are invoiced more than once ({keys}{more}). "
+            "Merge or delete the extra invoices before applying this migration."
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0006_contract_billed_through"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="invoice",
+            name="reference_date",
+            field=models.CharField(
+                max_length=7,
+                validators=[
+                    django.core.validators.RegexValidator(
+                        "^\\d{4}-(0[1-9]|1[0-2])$",
+                        "Enter a reference month in the YYYY-MM format.",
+                    )
+                ],
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="contract",
+            index=models.Index(fields=["end_date"], name="contract_end_date_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                fields=["customer", "reference_date"], name="invoice_customer_ref_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(fields=["status"], name="invoice_status_idx"),
+        ),
+        migrations.RunPython(check_duplicate_invoices, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="invoice",
+            constraint=models.UniqueConstraint(
+                fields=("contract", "reference_date"),
+                name="unique_invoice_contract_reference_date",
+            ),
+        ),
+    ]
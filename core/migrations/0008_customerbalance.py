@@ -0,0 +1,69 @@
+# Generated by Django 5.2 on 2026-10-18 03:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_balances(apps, schema_editor):
+    """Compute the initial balance of every customer with invoices."""
+    Invoice = apps.get_model("core", "Invoice")
+    CustomerBalance = apps.get_model("core", "CustomerBalance")
+    rows = (
+        Invoice.objects.values("customer_id")
+        .annotate(
+            open_amount=models.Sum("total_amount", filter=~models.Q(status="paid")),
+            paid_amount=models.Sum("total_amount", filter=models.Q(status="paid")),
+            last_reference_date=models.Max("reference_date"),
+        )
+        .order_by("customer_id")
+    )
+    CustomerBalance.objects.bulk_create(
+        (
+            CustomerBalance(
+                customer_id=row["customer_id"],
+                open_amount=row["open_amount"] or 0,
+                paid_amount=row["paid_amount"] or 0,
+                last_reference_date=row["last_reference_date"] or "",
+            )
+            for row in rows
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0007_invoice_constraints_and_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CustomerBalance",
+            fields=[
+                (
+                    "customer",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="balance",
+                        serialize=False,
+                        to="core.customer",
+                    ),
+                ),
+                (
+                    "open_amount",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                (
+                    "paid_amount",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                (
+                    "last_reference_date",
+                    models.CharField(blank=True, default="", max_length=7),
+                ),
+            ],
+        ),
+        migrations.RunPython(populate_balances, migrations.RunPython.noop),
+    ]
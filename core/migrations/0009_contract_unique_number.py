@@ -0,0 +1,37 @@
+# Generated by Django 5.2 on 2026-10-18 03:40
+
+from django.db import migrations, models
+
+
+def check_duplicate_contract_numbers(apps, schema_editor):
+    """Refuse to continue while a customer has two contracts with one number."""
+    Contract = apps.get_model("core", "Contract")
+    duplicates = (
+        Contract.objects.values("customer_id", "contract_number")
+        .annotate(total=models.Count("id"))
+        .filter(total__gt=1)
+        .count()
+    )
+    if duplicates:
+        raise RuntimeError(
+            f"{duplicates} contract numbers are used more than once by the same "
+            "customer. Renumber those contracts before applying this migration."
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0008_customerbalance"),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_contract_numbers, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="contract",
+            constraint=models.UniqueConstraint(
+                fields=("customer", "contract_number"),
+                name="unique_contract_number_per_customer",
+            ),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2 on 2026-10-18 03:12
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0009_contract_unique_number"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RevenueRollup",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "reference_date",
+                    models.CharField(
+                        max_length=7,
+                        validators=[
+                            django.core.validators.RegexValidator(
+                                "^\\d{4}-(0[1-9]|1[0-2])$", "Enter a reference month in the YYYY-MM format."
+                            )
+                        ],
+                    ),
+                ),
+                ("service_name", models.CharField(max_length=200)),
+                ("amount", models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ("item_count", models.PositiveIntegerField(default=0)),
+                (
+                    "customer",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="revenue_rollups",
+                        to="core.customer",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["customer", "reference_date"], name="rollup_customer_ref_idx"),
+                    models.Index(fields=["service_name", "reference_date"], name="rollup_service_ref_idx"),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("reference_date", "customer", "service_name"), name="unique_revenue_rollup_key"
+                    )
+                ],
+            },
+        ),
+    ]
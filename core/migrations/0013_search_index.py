@@ -0,0 +1,92 @@
+# Generated by Django 5.2 on 2026-10-18 05:20
+
+import sqlite3
+
+from django.db import migrations
+
+# Frozen copy of the index core.search expects at the time of this migration.
+SEARCHABLE = {
+    "core_customer": ("name", "email"),
+    "core_contract": ("contract_number",),
+    "core_service": ("name",),
+}
+TRIGGERS = ("insert", "delete", "update")
+
+
+def sqlite_has_fts5():
+    probe = sqlite3.connect(":memory:")
+    try:
+        probe.execute("CREATE VIRTUAL TABLE probe USING fts5(text)")
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        probe.close()
+    return True
+
+
+def install_sqlite(cursor, table, columns):
+    fts = f"{table}_fts"
+    names = ", ".join(columns)
+    new = ", ".join(f"new.{column}" for column in columns)
+    old = ", ".join(f"old.{column}" for column in columns)
+    delete = f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old});"
+    insert = f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new});"
+    cursor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({names}, content='{table}', "
+        f"content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN {insert} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN {delete} END")
+    cursor.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {names} ON {table} "
+        f"BEGIN {delete} {insert} END"
+    )
+    cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def uninstall_sqlite(cursor, table, columns):
+    for trigger in TRIGGERS:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {table}_fts_{trigger}")
+    cursor.execute(f"DROP TABLE IF EXISTS {table}_fts")
+
+
+def install_postgresql(cursor, table, columns):
+    document = " || ' ' || ".join(f"coalesce({column}, '')" for column in columns)
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {table}_search_idx ON {table} "
+        f"USING gin (to_tsvector('simple', {document}))"
+    )
+
+
+def uninstall_postgresql(cursor, table, columns):
+    cursor.execute(f"DROP INDEX IF EXISTS {table}_search_idx")
+
+
+def run(sqlite, postgresql):
+    def operation(apps, schema_editor):
+        connection = schema_editor.connection
+        if connection.vendor == "sqlite" and sqlite_has_fts5():
+            statements = sqlite
+        elif connection.vendor == "postgresql":
+            statements = postgresql
+        else:
+            return
+        with connection.cursor() as cursor:
+            for table, columns in SEARCHABLE.items():
+                statements(cursor, table, columns)
+
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0012_job"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run(install_sqlite, install_postgresql),
+            run(uninstall_sqlite, uninstall_postgresql),
+        ),
+    ]
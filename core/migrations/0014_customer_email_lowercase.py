@@ -0,0 +1,35 @@
+# Generated by Django 5.2 on 2026-10-18 05:40
+
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+
+def lowercase_emails(apps, schema_editor):
+    """Store customer emails lowercase, refusing to merge customers that differ only by case."""
+    Customer = apps.get_model("core", "Customer")
+    clashes = list(
+        Customer.objects.values_list(Lower("email"))
+        .annotate(total=models.Count("id"))
+        .filter(total__gt=1)
+        .order_by()[:20]
+    )
+    if clashes:
+        emails = ", ".join(email for email, _ in clashes)
+        raise RuntimeError(
+            f"Several customers share an email up to case ({emails}). "
+            "Merge those customers before applying this migration."
+        )
+    mixed = Customer.objects.exclude(email=Lower("email")).values_list("pk", "email")
+    for pk, email in mixed.iterator():
+        Customer.objects.filter(pk=pk).update(email=email.lower())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0013_search_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(lowercase_emails, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,11 @@
+from django.core.validators import RegexValidator
 from django.db import models
+from django.utils import timezone
+
+reference_date_validator = RegexValidator(
+    r"^\d{4}-(0[1-9]|1[0-2])$",
+    "Enter a reference month in the YYYY-MM format.",
+)
 
 class Customer(models.Model):
     name  = models.CharField(max_length=200)
@@ -7,6 +14,11 @@ class Customer(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # Stored lowercase, so that imports can match customers by email.
+        self.email = self.email.lower()
+        super().save(*args, **kwargs)
+
 
 class Contract(models.Model):
     """Commercial contract information."""
@@ -19,6 +31,24 @@ class Contract(models.Model):
     contract_number = models.CharField(max_length=100)
     start_date = models.DateField()
     end_date = models.DateField()
+    billed_through = models.DateField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="First day of the last month checked by generate_invoices.",
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["customer", "contract_number"],
+                name="unique_contract_number_per_customer",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["end_date"], name="contract_end_date_idx"),
+        ]
 
     def __str__(self):
         return self.contract_number
@@ -61,9 +91,22 @@ class Invoice(models.Model):
         null=True,
         blank=True,
     )
-    reference_date = models.CharField(max_length=7)
+    reference_date = models.CharField(max_length=7, validators=[reference_date_validator])
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["contract", "reference_date"],
+                name="unique_invoice_contract_reference_date",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["customer", "reference_date"], name="invoice_customer_ref_idx"),
+            models.Index(fields=["status"], name="invoice_status_idx"),
+        ]
 
     def __str__(self):
         return f"Invoice {self.customer} {self.reference_date}"
@@ -82,3 +125,96 @@ class InvoiceItem(models.Model):
 
     def __str__(self):
         return self.service_name
+
+
+class CustomerBalance(models.Model):
+    """Running invoice totals of a customer, maintained incrementally."""
+
+    customer = models.OneToOneField(
+        Customer,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="balance",
+    )
+    open_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    paid_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    last_reference_date = models.CharField(max_length=7, blank=True, default="")
+
+    def __str__(self):
+        return f"Balance {self.customer_id}"
+
+
+class RevenueRollup(models.Model):
+    """Invoiced revenue per reference month, customer and service name."""
+
+    reference_date = models.CharField(max_length=7, validators=[reference_date_validator])
+    customer = models.ForeignKey(
+        Customer,
+        on_delete=models.CASCADE,
+        related_name="revenue_rollups",
+    )
+    service_name = models.CharField(max_length=200)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["reference_date", "customer", "service_name"],
+                name="unique_revenue_rollup_key",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["customer", "reference_date"], name="rollup_customer_ref_idx"),
+            models.Index(fields=["service_name", "reference_date"], name="rollup_service_ref_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.reference_date} {self.customer_id} {self.service_name}"
+
+
+class Job(models.Model):
+    """Background job queued for the ``run_worker`` command."""
+
+    BILLING = "billing"
+    EXPORT = "export"
+    KIND_CHOICES = [
+        (BILLING, "Billing run"),
+        (EXPORT, "Invoice export"),
+    ]
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    arguments = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    progress = models.JSONField(default=dict, blank=True, editable=False)
+    result = models.JSONField(default=dict, blank=True, editable=False)
+    error = models.TextField(blank=True, editable=False)
+    attempts = models.PositiveIntegerField(default=0, editable=False)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    worker = models.CharField(max_length=200, blank=True, editable=False)
+    lease_expires_at = models.DateTimeField(null=True, blank=True, editable=False)
+    heartbeat_at = models.DateTimeField(null=True, blank=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True, editable=False)
+    finished_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "run_after"], name="job_status_run_after_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.pk}"
@@ -0,0 +1,48 @@
+"""Paginators for tables too large to ``COUNT(*)`` on every page view."""
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, QuerySet
+from django.utils.functional import cached_property
+
+
+class LargeTablePaginator(Paginator):
+    """Paginator that estimates the size of large unfiltered tables.
+
+    An exact ``COUNT(*)`` scans the whole table. When the object list is an
+    unfiltered queryset, the count is taken from the PostgreSQL planner
+    statistics or, on SQLite, from the highest primary key. Filtered
+    querysets and tables smaller than ``exact_count_threshold`` are still
+    counted exactly. Estimates may overshoot, leaving the last pages empty.
+    """
+
+    exact_count_threshold = 10_000
+
+    @cached_property
+    def count(self):
+        estimate = self._estimate_count()
+        if estimate is None or estimate < self.exact_count_threshold:
+            return super().count
+        return estimate
+
+    def _estimate_count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return None
+        query = queryset.query
+        if query.where or query.distinct or query.is_sliced or query.combinator:
+            return None
+
+        model = queryset.model
+        connection = connections[queryset.db]
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                    [model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor == "sqlite":
+            return model._default_manager.using(queryset.db).aggregate(last=Max("pk"))["last"] or 0
+        return None
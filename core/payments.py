@@ -0,0 +1,254 @@
+"""Payment reconciliation from bank files.
+
+A bank file lists incoming payments, either as CSV with the columns::
+
+    payment_id, invoice_id, customer_email, reference_date, amount
+
+or as OFX-like ``<STMTTRN>`` blocks whose ``<MEMO>`` names the invoice
+(``INV-<id>``) or the customer e-mail and reference month. Payments are
+read in batches; each batch loads every candidate invoice in one query,
+matches payments against in-memory indexes on the invoice id and on
+``(customer_email, reference_date, amount)``, and marks the matched
+invoices as paid with a single ``update()``. Every payment gets an outcome
+for the reconciliation report.
+"""
+
+import csv
+import re
+from collections import Counter
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import billing, caching
+from .balances import BalanceChange, apply_balance_changes
+from .models import Invoice
+
+FORMATS = ("csv", "ofx")
+DEFAULT_BATCH_SIZE = 5000
+REPORT_FIELDS = ("line", "payment_id", "amount", "invoice_id", "outcome", "detail")
+
+MATCHED = "matched"
+UNMATCHED = "unmatched"
+AMBIGUOUS = "ambiguous"
+ALREADY_PAID = "already_paid"
+AMOUNT_MISMATCH = "amount_mismatch"
+DUPLICATE = "duplicate"
+INVALID = "invalid"
+
+OFX_TRANSACTION = re.compile(r"<STMTTRN>(.*?)</STMTTRN>", re.S | re.I)
+OFX_FIELD = re.compile(r"<(\w+)>([^<\r\n]*)")
+MEMO_INVOICE = re.compile(r"\bINV-?(\d+)\b", re.I)
+MEMO_CUSTOMER = re.compile(r"([^\s@]+@[^\s@]+\.[^\s@]+)\s+(\d{4}-\d{2})\b")
+
+
+@dataclass
+class Payment:
+    """One payment of a bank file."""
+
+    line: int
+    payment_id: str = ""
+    amount: Decimal = None
+    invoice_id: int = None
+    customer_email: str = ""
+    reference_date: str = ""
+    error: str = ""
+
+
+@dataclass
+class Outcome:
+    """How a payment was reconciled."""
+
+    payment: Payment
+    outcome: str
+    invoice_id: int = None
+    detail: str = ""
+
+    def as_row(self):
+        return {
+            "line": self.payment.line,
+            "payment_id": self.payment.payment_id,
+            "amount": self.payment.amount,
+            "invoice_id": self.invoice_id or self.payment.invoice_id or "",
+            "outcome": self.outcome,
+            "detail": self.detail,
+        }
+
+
+def _payment(line, payment_id, amount, invoice_id="", customer_email="", reference_date=""):
+    payment = Payment(line=line, payment_id=(payment_id or "").strip())
+    try:
+        payment.amount = Decimal((amount or "").strip())
+        if not payment.amount.is_finite() or payment.amount <= 0:
+            raise InvalidOperation
+        invoice_id = (invoice_id or "").strip()
+        if invoice_id:
+            if not invoice_id.isdigit():
+                raise ValueError(f"Invalid invoice_id {invoice_id!r}.")
+            payment.invoice_id = int(invoice_id)
+        payment.customer_email = (customer_email or "").strip().lower()
+        payment.reference_date = (reference_date or "").strip()
+        if payment.reference_date:
+            billing.parse_month(payment.reference_date)
+        if payment.invoice_id is None and not (payment.customer_email and payment.reference_date):
+            raise ValueError("Needs an invoice_id or a customer_email and reference_date.")
+    except InvalidOperation:
+        payment.error = f"Invalid amount {amount!r}."
+    except ValueError as exc:
+        payment.error = str(exc)
+    return payment
+
+
+def read_csv(stream):
+    for line, row in enumerate(csv.DictReader(stream), start=2):
+        yield _payment(
+            line,
+            row.get("payment_id"),
+            row.get("amount"),
+            row.get("invoice_id"),
+            row.get("customer_email"),
+            row.get("reference_date"),
+        )
+
+
+def read_ofx(stream):
+    for number, match in enumerate(OFX_TRANSACTION.finditer(stream.read()), start=1):
+        fields = {name.upper(): value.strip() for name, value in OFX_FIELD.findall(match.group(1))}
+        memo = fields.get("MEMO", "") + " " + fields.get("NAME", "")
+        invoice = MEMO_INVOICE.search(memo)
+        customer = MEMO_CUSTOMER.search(memo)
+        yield _payment(
+            number,
+            fields.get("FITID"),
+            fields.get("TRNAMT"),
+            invoice.group(1) if invoice else "",
+            customer.group(1) if customer else "",
+            customer.group(2) if customer else "",
+        )
+
+
+def read_payments(stream, fmt):
+    """Yield the :class:`Payment` objects of a CSV or OFX-like stream.
+
+    Payments of OFX files are numbered by transaction instead of by line.
+    """
+    return read_csv(stream) if fmt == "csv" else read_ofx(stream)
+
+
+def load_candidates(payments):
+    """Load the invoices ``payments`` may refer to, in one query.
+
+    Returns ``(by_id, by_key)`` where ``by_key`` maps
+    ``(customer_email, reference_date, total_amount)`` to a list of invoices.
+    """
+    ids = {payment.invoice_id for payment in payments if payment.invoice_id}
+    emails = {payment.customer_email for payment in payments if payment.invoice_id is None}
+    months = {payment.reference_date for payment in payments if payment.invoice_id is None}
+    condition = Q(pk__in=ids) | Q(customer__email__in=emails, reference_date__in=months)
+    by_id, by_key = {}, {}
+    for invoice in Invoice.objects.filter(condition).values(
+        "id", "customer_id", "customer__email", "reference_date", "total_amount", "status"
+    ):
+        by_id[invoice["id"]] = invoice
+        key = (invoice["customer__email"], invoice["reference_date"], invoice["total_amount"])
+        by_key.setdefault(key, []).append(invoice)
+    return by_id, by_key
+
+
+def match_payment(payment, by_id, by_key, claimed):
+    """Return the :class:`Outcome` of one payment.
+
+    ``claimed`` holds the invoices already matched in this file, so that a
+    second payment of the same invoice is reported as a duplicate.
+    """
+    if payment.error:
+        return Outcome(payment, INVALID, detail=payment.error)
+    if payment.invoice_id is not None:
+        invoice = by_id.get(payment.invoice_id)
+        if invoice is None:
+            return Outcome(payment, UNMATCHED, detail="No invoice with this id.")
+    else:
+        key = (payment.customer_email, payment.reference_date, payment.amount)
+        candidates = [invoice for invoice in by_key.get(key, ()) if invoice["id"] not in claimed]
+        waiting = [invoice for invoice in candidates if invoice["status"] == Invoice.WAITING]
+        if len(waiting) > 1:
+            ids = ", ".join(str(invoice["id"]) for invoice in waiting)
+            return Outcome(payment, AMBIGUOUS, detail=f"Matches invoices {ids}.")
+        if not candidates:
+            if by_key.get(key):
+                return Outcome(payment, DUPLICATE, by_key[key][0]["id"], "Invoice already paid by this file.")
+            return Outcome(payment, UNMATCHED, detail="No invoice for this customer, month and amount.")
+        invoice = (waiting or candidates)[0]
+
+    if invoice["id"] in claimed:
+        return Outcome(payment, DUPLICATE, invoice["id"], "Invoice already paid by this file.")
+    if invoice["status"] == Invoice.PAID:
+        return Outcome(payment, ALREADY_PAID, invoice["id"])
+    if invoice["total_amount"] != payment.amount:
+        return Outcome(payment, AMOUNT_MISMATCH, invoice["id"], f"Invoice total is {invoice['total_amount']}.")
+    claimed.add(invoice["id"])
+    return Outcome(payment, MATCHED, invoice["id"])
+
+
+def mark_paid(invoice_ids):
+    """Mark the waiting invoices among ``invoice_ids`` as paid.
+
+    Runs a constant number of queries: the waiting invoices are locked and
+    read, updated with one ``update()`` and moved from the open to the paid
+    balance of their customers. Returns the number of invoices marked.
+    """
+    with transaction.atomic():
+        rows = list(
+            Invoice.objects.select_for_update()
+            .filter(pk__in=invoice_ids, status=Invoice.WAITING)
+            .values_list("pk", "customer_id", "total_amount")
+        )
+        if not rows:
+            return 0
+        Invoice.objects.filter(pk__in=[pk for pk, _, _ in rows]).update(
+            status=Invoice.PAID, updated_at=timezone.now()
+        )
+        changes = {}
+        for _, customer_id, total_amount in rows:
+            change = changes.setdefault(customer_id, BalanceChange())
+            change.add(Invoice.WAITING, -total_amount)
+            change.add(Invoice.PAID, total_amount)
+        apply_balance_changes(changes)
+    caching.invalidate("invoices", *(pk for pk, _, _ in rows))
+    return len(rows)
+
+
+def reconcile(payments, report=None, apply=True, batch_size=DEFAULT_BATCH_SIZE):
+    """Match ``payments`` to invoices batch by batch and mark the matches paid.
+
+    ``report(outcome)`` is called for every payment. Returns a
+    :class:`collections.Counter` of outcomes.
+    """
+    counts = Counter()
+    claimed = set()
+    batch = []
+
+    def flush():
+        by_id, by_key = load_candidates(batch)
+        matched = []
+        for payment in batch:
+            outcome = match_payment(payment, by_id, by_key, claimed)
+            counts[outcome.outcome] += 1
+            if outcome.outcome == MATCHED:
+                matched.append(outcome.invoice_id)
+            if report is not None:
+                report(outcome)
+        if apply and matched:
+            mark_paid(matched)
+
+    for payment in payments:
+        batch.append(payment)
+        if len(batch) >= batch_size:
+            flush()
+            batch = []
+    if batch:
+        flush()
+    return counts
@@ -0,0 +1,86 @@
+"""Billing previews.
+
+A preview runs the planning half of the billing engine
+(:func:`core.billing.preview_invoices`) and writes what a run would create
+instead of inserting it: a per-customer summary or one JSON line per
+invoice followed by the per-customer totals. Only read queries are made.
+"""
+
+import json
+import time
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from . import billing
+
+FORMATS = ("summary", "jsonl")
+
+
+@dataclass
+class CustomerTotal:
+    """What a billing run would invoice one customer."""
+
+    invoices: int = 0
+    items: int = 0
+    total_amount: Decimal = Decimal("0.00")
+
+
+@dataclass
+class Preview:
+    """Totals of a preview, overall and per customer."""
+
+    summary: billing.BillingSummary = field(default_factory=billing.BillingSummary)
+    customers: dict = field(default_factory=dict)
+
+    def add(self, invoice, items):
+        customer = self.customers.setdefault(invoice.customer_id, CustomerTotal())
+        customer.invoices += 1
+        customer.items += len(items)
+        customer.total_amount += invoice.total_amount
+        self.summary.invoices_created += 1
+        self.summary.items_created += len(items)
+        self.summary.total_amount += invoice.total_amount
+
+
+def _invoice_record(invoice, items):
+    return {
+        "type": "invoice",
+        "customer_id": invoice.customer_id,
+        "contract_id": invoice.contract_id,
+        "reference_date": invoice.reference_date,
+        "total_amount": str(invoice.total_amount),
+        "items": [
+            {"service_name": item.service_name, "service_amount": str(item.service_amount)} for item in items
+        ],
+    }
+
+
+def write_preview(stream, today, fmt="summary", shard=None, since=None, chunk_size=billing.DEFAULT_CHUNK_SIZE):
+    """Write what billing up to ``today`` would create to ``stream``.
+
+    Returns the :class:`Preview` totals.
+    """
+    started = time.monotonic()
+    preview = Preview()
+    for invoice, items in billing.preview_invoices(today, shard, since, chunk_size):
+        preview.add(invoice, items)
+        if fmt == "jsonl":
+            stream.write(json.dumps(_invoice_record(invoice, items)) + "\n")
+    preview.summary.elapsed = time.monotonic() - started
+
+    for customer_id, total in sorted(preview.customers.items()):
+        if fmt == "jsonl":
+            record = {
+                "type": "customer",
+                "customer_id": customer_id,
+                "invoices": total.invoices,
+                "items": total.items,
+                "total_amount": str(total.total_amount),
+            }
+            stream.write(json.dumps(record) + "\n")
+        else:
+            stream.write(
+                f"Customer {customer_id}: {total.invoices} invoices, {total.items} items, "
+                f"total {total.total_amount}\n"
+            )
+    return preview
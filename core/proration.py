@@ -0,0 +1,101 @@
+"""Bulk proration of monthly charges in integer cents.
+
+:func:`prorate_cents` takes parallel columns of service values (in cents),
+charge start and end dates and reference months (as date ordinals) and
+returns the amounts due as an ``array`` of cents. A charge covering its
+whole month costs the full value; otherwise the value is multiplied by the
+charged days and divided by the days in the month with exact integer
+arithmetic and rounded half-even, which gives the same cents as
+``(value * days / days_in_month).quantize(Decimal("0.01"))`` under the
+default decimal context.
+"""
+
+from array import array
+from calendar import monthrange
+from datetime import date
+from decimal import ROUND_HALF_EVEN, ROUND_HALF_UP, Decimal
+
+ROUNDINGS = (ROUND_HALF_EVEN, ROUND_HALF_UP)
+
+_days_in_month = {}
+
+
+def days_in_month(month_ordinal):
+    """Return the number of days of the month starting at ``month_ordinal``."""
+    days = _days_in_month.get(month_ordinal)
+    if days is None:
+        month = date.fromordinal(month_ordinal)
+        days = _days_in_month[month_ordinal] = monthrange(month.year, month.month)[1]
+    return days
+
+
+def to_cents(value):
+    """Convert a ``Decimal`` amount with at most two decimals to integer cents."""
+    cents = value.scaleb(2)
+    if cents != cents.to_integral_value():
+        raise ValueError(f"{value} has more than two decimal places.")
+    return int(cents)
+
+
+def from_cents(cents):
+    """Convert integer cents to a two-decimal ``Decimal``."""
+    return Decimal(cents).scaleb(-2)
+
+
+def divide_rounded(numerator, denominator, rounding=ROUND_HALF_EVEN):
+    """Return ``numerator / denominator`` rounded to an integer.
+
+    ``denominator`` must be positive.
+    """
+    quotient, remainder = divmod(abs(numerator), denominator)
+    twice = 2 * remainder
+    if twice > denominator or (
+        twice == denominator and (rounding == ROUND_HALF_UP or quotient % 2)
+    ):
+        quotient += 1
+    return quotient if numerator >= 0 else -quotient
+
+
+def prorate_cents(values, charge_starts, charge_ends, months, rounding=ROUND_HALF_EVEN):
+    """Return the prorated amounts of a batch of charges, in cents.
+
+    ``values`` are monthly values in cents; ``charge_starts``,
+    ``charge_ends`` and ``months`` are date ordinals of the first and last
+    charged day and of the first day of the charged month. The charged
+    days must lie within the month.
+    """
+    if rounding not in ROUNDINGS:
+        raise ValueError(f"Unsupported rounding {rounding!r}.")
+    amounts = array("q", bytes(8 * len(values)))
+    for index, (value, start, end, month) in enumerate(zip(values, charge_starts, charge_ends, months)):
+        month_days = days_in_month(month)
+        days = end - start + 1
+        if days == month_days:
+            amounts[index] = value
+        else:
+            amounts[index] = divide_rounded(value * days, month_days, rounding)
+    return amounts
+
+
+class ProrationBatch:
+    """Columns of charges collected for one :func:`prorate_cents` call."""
+
+    def __init__(self):
+        self.values = array("q")
+        self.charge_starts = array("l")
+        self.charge_ends = array("l")
+        self.months = array("l")
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, value_cents, charge_start, charge_end, month):
+        """Append a charge given as cents and ``date`` objects."""
+        self.values.append(value_cents)
+        self.charge_starts.append(charge_start.toordinal())
+        self.charge_ends.append(charge_end.toordinal())
+        self.months.append(month.toordinal())
+
+    def amounts(self, rounding=ROUND_HALF_EVEN):
+        """Return the prorated cents of every charge, in insertion order."""
+        return prorate_cents(self.values, self.charge_starts, self.charge_ends, self.months, rounding)
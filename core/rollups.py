@@ -0,0 +1,179 @@
+"""Monthly revenue rollups.
+
+:class:`~core.models.RevenueRollup` holds the invoiced amount and number of
+items per ``(reference_date, customer, service_name)``. The billing engine
+adds the items of every chunk it writes with :func:`apply_rollup_changes`
+in the same transaction, so reports never have to aggregate
+``InvoiceItem``. Signal handlers apply the changes of invoices and items
+edited or deleted one at a time; bulk writes that bypass them are repaired
+by ``rebuild_rollups``, which recomputes a range of months from the items.
+"""
+
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from .models import InvoiceItem, RevenueRollup
+
+ZERO = Decimal("0.00")
+GROUPINGS = {
+    "month": "reference_date",
+    "customer": "customer_id",
+    "service": "service_name",
+}
+
+
+def collect_rollup_changes(rows):
+    """Sum ``(reference_date, customer_id, service_name, amount)`` rows by key.
+
+    Returns a ``{key: [amount, item_count]}`` mapping.
+    """
+    changes = {}
+    for reference_date, customer_id, service_name, amount in rows:
+        change = changes.setdefault((reference_date, customer_id, service_name), [ZERO, 0])
+        change[0] += amount
+        change[1] += 1
+    return changes
+
+
+def add_rollup_change(changes, key, amount, item_count):
+    """Add ``amount`` and ``item_count`` under ``key``; negate both to remove items."""
+    change = changes.setdefault(key, [ZERO, 0])
+    change[0] += amount
+    change[1] += item_count
+
+
+def invoice_revenue(invoice_id):
+    """Return ``(service_name, amount, item_count)`` of the items of an invoice."""
+    return list(
+        InvoiceItem.objects.filter(invoice_id=invoice_id)
+        .values_list("service_name")
+        .annotate(amount=Sum("service_amount"), item_count=Count("pk"))
+        .order_by()
+    )
+
+
+def apply_rollup_changes(changes):
+    """Add a mapping built by :func:`collect_rollup_changes` in a few queries.
+
+    Rollups left without items are deleted. Removals from a rollup that does
+    not exist are ignored; ``rebuild_rollups`` repairs that kind of drift.
+    """
+    if not changes:
+        return
+    with transaction.atomic():
+        stored = {
+            (rollup.reference_date, rollup.customer_id, rollup.service_name): rollup
+            for rollup in RevenueRollup.objects.select_for_update().filter(
+                reference_date__in={key[0] for key in changes},
+                customer_id__in={key[1] for key in changes},
+            )
+        }
+        now = timezone.now()
+        to_update, to_create, to_delete = [], [], []
+        for key, (amount, item_count) in changes.items():
+            rollup = stored.get(key)
+            if rollup is None:
+                if item_count <= 0:
+                    continue
+                reference_date, customer_id, service_name = key
+                to_create.append(
+                    RevenueRollup(
+                        reference_date=reference_date,
+                        customer_id=customer_id,
+                        service_name=service_name,
+                        amount=amount,
+                        item_count=item_count,
+                    )
+                )
+            elif rollup.item_count + item_count <= 0:
+                to_delete.append(rollup.pk)
+            else:
+                rollup.amount += amount
+                rollup.item_count += item_count
+                rollup.updated_at = now
+                to_update.append(rollup)
+        RevenueRollup.objects.bulk_update(to_update, ["amount", "item_count", "updated_at"])
+        RevenueRollup.objects.bulk_create(to_create)
+        if to_delete:
+            RevenueRollup.objects.filter(pk__in=to_delete).delete()
+
+
+def rebuild_rollups(date_from=None, date_to=None, batch_size=1000):
+    """Recompute the rollups of the months between ``date_from`` and ``date_to``.
+
+    Both bounds are optional ``"YYYY-MM"`` strings and inclusive. Returns the
+    number of rollup rows written.
+    """
+    months = {}
+    if date_from:
+        months["reference_date__gte"] = date_from
+    if date_to:
+        months["reference_date__lte"] = date_to
+    item_months = {f"invoice__{lookup}": value for lookup, value in months.items()}
+
+    rows = (
+        InvoiceItem.objects.filter(**item_months)
+        .values(
+            reference_date=F("invoice__reference_date"),
+            customer_id=F("invoice__customer_id"),
+            name=F("service_name"),
+        )
+        .annotate(amount=Sum("service_amount"), item_count=Count("pk"))
+        .order_by()
+    )
+    written = 0
+    with transaction.atomic():
+        RevenueRollup.objects.filter(**months).delete()
+        batch = []
+        for row in rows.iterator(chunk_size=batch_size):
+            batch.append(
+                RevenueRollup(
+                    reference_date=row["reference_date"],
+                    customer_id=row["customer_id"],
+                    service_name=row["name"],
+                    amount=row["amount"] or ZERO,
+                    item_count=row["item_count"],
+                )
+            )
+            if len(batch) >= batch_size:
+                written += len(RevenueRollup.objects.bulk_create(batch))
+                batch = []
+        written += len(RevenueRollup.objects.bulk_create(batch))
+    return written
+
+
+def check_group_by(group_by):
+    """Raise ``ValueError`` unless ``group_by`` only names known groupings."""
+    if not group_by or set(group_by) - GROUPINGS.keys():
+        raise ValueError(f"group_by must be a combination of {', '.join(GROUPINGS)}.")
+
+
+def revenue_report(group_by=("month",), date_from=None, date_to=None, customer_id=None, service_name=None):
+    """Return revenue rows grouped by any of ``month``, ``customer`` and ``service``.
+
+    Only :class:`~core.models.RevenueRollup` is read. Every row holds the
+    grouping values together with ``amount`` and ``items``.
+    """
+    check_group_by(group_by)
+    rollups = RevenueRollup.objects.all()
+    if date_from:
+        rollups = rollups.filter(reference_date__gte=date_from)
+    if date_to:
+        rollups = rollups.filter(reference_date__lte=date_to)
+    if customer_id is not None:
+        rollups = rollups.filter(customer_id=customer_id)
+    if service_name:
+        rollups = rollups.filter(service_name=service_name)
+
+    fields = [GROUPINGS[name] for name in group_by]
+    return [
+        {
+            **{name: row[GROUPINGS[name]] for name in group_by},
+            "amount": row["total"],
+            "items": row["items"],
+        }
+        for row in rollups.values(*fields).annotate(total=Sum("amount"), items=Sum("item_count")).order_by(*fields)
+    ]
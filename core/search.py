@@ -0,0 +1,136 @@
+"""Full-text search over customers, contracts and services.
+
+On SQLite every searchable table gets an external-content FTS5 table
+(``<table>_fts``, sharing the row ids) kept in sync by triggers, so bulk
+writes are indexed like single saves. On PostgreSQL a GIN index over the
+``tsvector`` of the same columns serves the search. Other databases fall
+back to the admin's ``icontains`` search.
+
+The index is created by migration ``0013_search_index``, which carries a
+frozen copy of the DDL below. SQLite drops a table's triggers when a
+migration rebuilds the table (e.g. ``AlterField``), so a migration
+rebuilding one of the searchable tables must recreate them the same way;
+``install()`` repairs a database where that was missed. SQLite builds
+without FTS5 keep the ``icontains`` search.
+
+Search terms are split into words and every word is matched as a prefix,
+so ``"alp cor"`` finds ``"Alpha Corp"``.
+"""
+
+import re
+import sqlite3
+from functools import cache
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Contract, Customer, Service
+
+SEARCHABLE = {
+    Customer: ("name", "email"),
+    Contract: ("contract_number",),
+    Service: ("name",),
+}
+TRIGGERS = ("insert", "delete", "update")
+
+WORD = re.compile(r"\w+")
+
+
+@cache
+def sqlite_has_fts5():
+    """Return whether the SQLite library Python links against provides FTS5."""
+    probe = sqlite3.connect(":memory:")
+    try:
+        probe.execute("CREATE VIRTUAL TABLE probe USING fts5(text)")
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        probe.close()
+    return True
+
+
+def is_supported(using=connection):
+    if using.vendor == "sqlite":
+        return sqlite_has_fts5()
+    return using.vendor == "postgresql"
+
+
+def _document(columns):
+    return " || ' ' || ".join(f"coalesce({column}, '')" for column in columns)
+
+
+def _install_sqlite(cursor, table, columns):
+    fts = f"{table}_fts"
+    cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s AND name LIKE %s",
+        [table, f"{fts}_%"],
+    )
+    existing = {name for (name,) in cursor.fetchall()}
+    if existing == {f"{fts}_{trigger}" for trigger in TRIGGERS}:
+        return False
+
+    names = ", ".join(columns)
+    new = ", ".join(f"new.{column}" for column in columns)
+    old = ", ".join(f"old.{column}" for column in columns)
+    delete = f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old});"
+    insert = f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new});"
+    cursor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({names}, content='{table}', "
+        f"content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN {insert} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN {delete} END")
+    cursor.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {names} ON {table} "
+        f"BEGIN {delete} {insert} END"
+    )
+    cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    return True
+
+
+def _install_postgresql(cursor, table, columns):
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {table}_search_idx ON {table} "
+        f"USING gin (to_tsvector('simple', {_document(columns)}))"
+    )
+    return True
+
+
+def install(using=connection):
+    """Create whatever part of the search index is missing.
+
+    Returns the names of the tables whose index was (re)built.
+    """
+    if not is_supported(using):
+        return []
+    installer = _install_sqlite if using.vendor == "sqlite" else _install_postgresql
+    built = []
+    with using.cursor() as cursor:
+        for model, columns in SEARCHABLE.items():
+            if installer(cursor, model._meta.db_table, columns):
+                built.append(model._meta.db_table)
+    return built
+
+
+def _words(text):
+    return WORD.findall(text.lower())
+
+
+def matching_ids(model, text, using=connection):
+    """Return a subquery expression of the ids of ``model`` rows matching ``text``.
+
+    Returns ``None`` when ``text`` has no words.
+    """
+    words = _words(text)
+    if not words:
+        return None
+    table = model._meta.db_table
+    if using.vendor == "sqlite":
+        query = " ".join(f'"{word}"*' for word in words)
+        return RawSQL(f"SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH %s", [query])
+    query = " & ".join(f"{word}:*" for word in words)
+    document = _document(SEARCHABLE[model])
+    return RawSQL(
+        f"SELECT id FROM {table} WHERE to_tsvector('simple', {document}) @@ to_tsquery('simple', %s)",
+        [query],
+    )
@@ -0,0 +1,266 @@
+"""Signal handlers keeping derived billing data consistent with edits.
+
+Besides watermarks, totals, balances and revenue rollups, the handlers bump the
+``updated_at`` version of invoices and contracts whose API payload changes,
+drop the cached payloads and forget cached customers and contracts (see
+``core.caching``).
+
+Bulk operations (``bulk_create``, ``bulk_update``, ``QuerySet.update``) do
+not send these signals; code using them maintains the derived data itself.
+"""
+
+from decimal import Decimal
+
+from django.db.models import F, QuerySet, Sum
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import caching
+from .balances import BalanceChange, apply_balance_changes, refresh_last_reference_date
+from .rollups import add_rollup_change, apply_rollup_changes, invoice_revenue
+from .models import Contract, Customer, Invoice, InvoiceItem, Service
+
+
+def _decimal(value):
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+def _deleted_by(origin, *models):
+    """Return whether a deletion was started on an instance or queryset of ``models``."""
+    if isinstance(origin, QuerySet):
+        return issubclass(origin.model, models)
+    return isinstance(origin, models)
+
+
+@receiver(pre_save, sender=Contract)
+def reset_watermark_on_date_change(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Clear the billing watermark when the contract period changes."""
+    if raw or instance.pk is None:
+        return
+    previous = (
+        Contract.objects.filter(pk=instance.pk).values("start_date", "end_date", "contract_number").first()
+    )
+    if previous is None:
+        return
+    instance._number_changed = previous["contract_number"] != instance.contract_number
+    if previous["start_date"] != instance.start_date or previous["end_date"] != instance.end_date:
+        instance.billed_through = None
+        if update_fields is not None and "billed_through" not in update_fields:
+            Contract.objects.filter(pk=instance.pk).update(billed_through=None)
+
+
+@receiver(post_save, sender=Contract)
+@receiver(post_delete, sender=Contract)
+def invalidate_contract_payload(sender, instance, raw=False, **kwargs):
+    """Drop the cached contract and, after a renumbering, bump its invoices."""
+    if raw:
+        return
+    caching.invalidate("contracts", instance.pk)
+    caching.forget(caching.CONTRACT, instance.pk)
+    if getattr(instance, "_number_changed", False):
+        caching.touch("invoices", contract_id=instance.pk)
+        instance._number_changed = False
+
+
+def _services_changed(contract_id):
+    Contract.objects.filter(pk=contract_id).update(billed_through=None, updated_at=timezone.now())
+    caching.invalidate("contracts", contract_id)
+    caching.forget(caching.CONTRACT, contract_id)
+
+
+@receiver(pre_save, sender=Service)
+def reset_watermark_on_service_move(sender, instance, raw=False, **kwargs):
+    """Clear the watermark of the contract a service is moved away from."""
+    if raw or instance.pk is None:
+        return
+    previous = Service.objects.filter(pk=instance.pk).values_list("contract_id", flat=True).first()
+    if previous is not None and previous != instance.contract_id:
+        _services_changed(previous)
+
+
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+def reset_watermark_on_service_change(sender, instance, raw=False, **kwargs):
+    """Clear the billing watermark when a contract's services change."""
+    if raw:
+        return
+    _services_changed(instance.contract_id)
+
+
+@receiver(pre_save, sender=Customer)
+def remember_customer_name(sender, instance, raw=False, **kwargs):
+    """Note a rename, which changes the payloads of the customer's invoices and contracts."""
+    instance._renamed = False
+    if not raw and instance.pk is not None:
+        previous = Customer.objects.filter(pk=instance.pk).values_list("name", flat=True).first()
+        instance._renamed = previous is not None and previous != instance.name
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def forget_customer(sender, instance, raw=False, **kwargs):
+    """Drop the cached customer."""
+    if not raw:
+        caching.forget(caching.CUSTOMER, instance.pk)
+
+
+@receiver(post_save, sender=Customer)
+def touch_payloads_on_rename(sender, instance, raw=False, **kwargs):
+    """Bump the invoices and contracts showing a renamed customer."""
+    if raw or not instance._renamed:
+        return
+    caching.touch("invoices", customer_id=instance.pk)
+    caching.touch("contracts", customer_id=instance.pk)
+
+
+def _stored_invoice(pk):
+    return (
+        Invoice.objects.filter(pk=pk)
+        .values("customer_id", "status", "total_amount", "reference_date")
+        .first()
+    )
+
+
+@receiver(pre_save, sender=Invoice)
+@receiver(pre_delete, sender=Invoice)
+def remember_stored_invoice(sender, instance, raw=False, **kwargs):
+    """Keep the stored state of an invoice so its balance effect can be undone."""
+    instance._stored_state = None if raw or instance.pk is None else _stored_invoice(instance.pk)
+
+
+@receiver(post_save, sender=Invoice)
+def update_balance_on_invoice_save(sender, instance, raw=False, **kwargs):
+    """Move the invoice's amount between balances, and its revenue to its new month or customer."""
+    if raw:
+        return
+    caching.invalidate("invoices", instance.pk)
+    stored = instance._stored_state
+    changes = {}
+    if stored is not None:
+        changes[stored["customer_id"]] = BalanceChange()
+        changes[stored["customer_id"]].add(stored["status"], -stored["total_amount"])
+    change = changes.setdefault(instance.customer_id, BalanceChange())
+    change.add(instance.status, _decimal(instance.total_amount), instance.reference_date)
+    apply_balance_changes(changes)
+
+    if stored is not None and (
+        stored["customer_id"] != instance.customer_id
+        or stored["reference_date"] > instance.reference_date
+    ):
+        refresh_last_reference_date(stored["customer_id"])
+
+    if stored is not None and (
+        stored["customer_id"] != instance.customer_id or stored["reference_date"] != instance.reference_date
+    ):
+        revenue = {}
+        for service_name, amount, item_count in invoice_revenue(instance.pk):
+            old_key = (stored["reference_date"], stored["customer_id"], service_name)
+            add_rollup_change(revenue, old_key, -amount, -item_count)
+            new_key = (instance.reference_date, instance.customer_id, service_name)
+            add_rollup_change(revenue, new_key, amount, item_count)
+        apply_rollup_changes(revenue)
+
+
+@receiver(pre_delete, sender=Invoice)
+def remember_invoice_revenue(sender, instance, origin=None, **kwargs):
+    """Keep the revenue of an invoice's items, which are deleted before the invoice."""
+    instance._stored_revenue = [] if _deleted_by(origin, Customer) else invoice_revenue(instance.pk)
+
+
+@receiver(post_delete, sender=Invoice)
+def update_balance_on_invoice_delete(sender, instance, origin=None, **kwargs):
+    """Remove a deleted invoice from its customer's balance and revenue rollups."""
+    caching.invalidate("invoices", instance.pk)
+    if _deleted_by(origin, Customer) or instance._stored_state is None:
+        return
+    stored = instance._stored_state
+    change = BalanceChange()
+    change.add(stored["status"], -stored["total_amount"])
+    apply_balance_changes({stored["customer_id"]: change})
+    refresh_last_reference_date(stored["customer_id"])
+    revenue = {}
+    for service_name, amount, item_count in instance._stored_revenue:
+        key = (stored["reference_date"], stored["customer_id"], service_name)
+        add_rollup_change(revenue, key, -amount, -item_count)
+    apply_rollup_changes(revenue)
+
+
+def _refresh_invoice_total(invoice_id):
+    """Set an invoice total to the sum of its items and move the difference into the balance.
+
+    The invoice's version is bumped even when the total stays the same,
+    since one of its items changed.
+    """
+    invoice = Invoice.objects.filter(pk=invoice_id).values("customer_id", "status", "total_amount").first()
+    if invoice is None:
+        return
+    total = InvoiceItem.objects.filter(invoice_id=invoice_id).aggregate(total=Sum("service_amount"))["total"]
+    total = total or Decimal("0")
+    Invoice.objects.filter(pk=invoice_id).update(total_amount=total, updated_at=timezone.now())
+    caching.invalidate("invoices", invoice_id)
+    delta = total - invoice["total_amount"]
+    if delta:
+        change = BalanceChange()
+        change.add(invoice["status"], delta)
+        apply_balance_changes({invoice["customer_id"]: change})
+
+
+def _item_rollup_key(invoice_id, service_name):
+    invoice = Invoice.objects.filter(pk=invoice_id).values("reference_date", "customer_id").first()
+    return None if invoice is None else (invoice["reference_date"], invoice["customer_id"], service_name)
+
+
+@receiver(pre_save, sender=InvoiceItem)
+def remember_stored_item(sender, instance, raw=False, **kwargs):
+    """Keep the stored state of an item so its totals and revenue can be moved."""
+    instance._stored_state = None
+    if not raw and instance.pk is not None:
+        instance._stored_state = (
+            InvoiceItem.objects.filter(pk=instance.pk)
+            .values(
+                "invoice_id",
+                "service_name",
+                "service_amount",
+                reference_date=F("invoice__reference_date"),
+                customer_id=F("invoice__customer_id"),
+            )
+            .first()
+        )
+
+
+@receiver(post_save, sender=InvoiceItem)
+def update_total_on_item_save(sender, instance, raw=False, **kwargs):
+    """Recompute the totals of the invoices the item was and now is on, and move its revenue."""
+    if raw:
+        return
+    stored = instance._stored_state
+    invoice_ids = {instance.invoice_id}
+    revenue = {}
+    if stored is not None:
+        invoice_ids.add(stored["invoice_id"])
+        key = (stored["reference_date"], stored["customer_id"], stored["service_name"])
+        add_rollup_change(revenue, key, -stored["service_amount"], -1)
+    for invoice_id in invoice_ids:
+        _refresh_invoice_total(invoice_id)
+    key = _item_rollup_key(instance.invoice_id, instance.service_name)
+    if key is not None:
+        add_rollup_change(revenue, key, _decimal(instance.service_amount), 1)
+    apply_rollup_changes(revenue)
+
+
+@receiver(post_delete, sender=InvoiceItem)
+def update_total_on_item_delete(sender, instance, origin=None, **kwargs):
+    """Recompute the total of the invoice a deleted item was on and remove its revenue.
+
+    Items removed because their invoice (or customer, or contract) is being
+    deleted are skipped; the invoice handler accounts for the whole invoice.
+    """
+    if not _deleted_by(origin, InvoiceItem):
+        return
+    _refresh_invoice_total(instance.invoice_id)
+    key = _item_rollup_key(instance.invoice_id, instance.service_name)
+    if key is not None:
+        revenue = {}
+        add_rollup_change(revenue, key, -_decimal(instance.service_amount), -1)
+        apply_rollup_changes(revenue)
@@ -67,7 +67,7 @@ class ManageTests(SimpleTestCase):
 
 
 from io import StringIO
-from django.core.management import call_command
+from django.core.management import CommandError, call_command
 from core.management.commands.generate_invoices import Command
 
 
@@ -151,3 +151,2031 @@ class GenerateInvoicesCommandTests(TestCase):
     def test_next_month_helper(self):
         cmd = Command()
         self.assertEqual(cmd._next_month(date(2024, 12, 1)), date(2025, 1, 1))
+
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from core import billing
+
+
+class BillingEngineTests(TestCase):
+    def _make_contracts(self, count, prefix):
+        for i in range(count):
+            customer = Customer.objects.create(name=f"{prefix}{i}", email=f"{prefix}{i}@example.com")
+            contract = Contract.objects.create(
+                customer=customer,
+                contract_number=f"{prefix}-{i}",
+                start_date=date(2024, 1, 10),
+                end_date=date(2024, 3, 20),
+            )
+            Service.objects.create(contract=contract, name="Hosting", value=Decimal("99.99"))
+            Service.objects.create(contract=contract, name="Support", value=Decimal("10.00"))
+
+    def _count_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            billing.generate_invoices(date(2024, 6, 1), chunk_size=10_000)
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_depend_on_contract_count(self):
+        self._make_contracts(2, "small")
+        small = self._count_queries()
+        Invoice.objects.all().delete()
+        RevenueRollup.objects.all().delete()
+        Contract.objects.update(billed_through=None)
+        self._make_contracts(20, "large")
+        large = self._count_queries()
+        self.assertEqual(small, large)
+        self.assertEqual(Invoice.objects.count(), 22 * 3)
+
+    def test_prorated_amounts(self):
+        self._make_contracts(1, "p")
+        summary = billing.generate_invoices(date(2024, 6, 1), chunk_size=2)
+        self.assertEqual(summary.invoices_created, 3)
+        self.assertEqual(summary.items_created, 6)
+        amounts = {
+            inv.reference_date: [item.service_amount for item in inv.items.order_by("pk")]
+            for inv in Invoice.objects.all()
+        }
+        self.assertEqual(amounts["2024-01"], [Decimal("70.96"), Decimal("7.10")])
+        self.assertEqual(amounts["2024-02"], [Decimal("99.99"), Decimal("10.00")])
+        self.assertEqual(amounts["2024-03"], [Decimal("64.51"), Decimal("6.45")])
+        self.assertEqual(summary.total_amount, Decimal("259.01"))
+
+
+class _InlineExecutor:
+    """Stand-in for ProcessPoolExecutor that runs work in the calling process."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, fn, *args):
+        from concurrent.futures import Future
+
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+
+class ShardedBillingTests(TestCase):
+    def setUp(self):
+        for i in range(6):
+            customer = Customer.objects.create(name=f"S{i}", email=f"s{i}@example.com")
+            contract = Contract.objects.create(
+                customer=customer,
+                contract_number=f"S-{i}",
+                start_date=date(2024, 1, 1),
+                end_date=date(2024, 2, 29),
+            )
+            Service.objects.create(contract=contract, name="Hosting", value=Decimal("10"))
+
+    def test_shards_are_disjoint_and_complete(self):
+        first = billing.generate_invoices(date(2024, 6, 1), shard=(0, 2))
+        second = billing.generate_invoices(date(2024, 6, 1), shard=(1, 2))
+        self.assertEqual(first.invoices_created + second.invoices_created, 12)
+        self.assertEqual(first.invoices_created, 6)
+        self.assertEqual(billing.generate_invoices(date(2024, 6, 1)).invoices_created, 0)
+
+    def test_parse_shard(self):
+        self.assertEqual(billing.parse_shard("1/4"), (1, 4))
+        for value in ("4/4", "a/2", "1", "-1/2"):
+            with self.assertRaises(ValueError):
+                billing.parse_shard(value)
+
+    def test_command_shard_option(self):
+        out = StringIO()
+        with mock.patch("core.management.commands.generate_invoices.date") as mock_date:
+            mock_date.today.return_value = date(2024, 6, 1)
+            call_command("generate_invoices", shard="1/3", stdout=out)
+        self.assertIn("Shard 1/3 4 invoices", out.getvalue())
+
+    def test_workers_merge_summaries(self):
+        out = StringIO()
+        with mock.patch("core.billing.ProcessPoolExecutor", _InlineExecutor), \
+                mock.patch("core.management.commands.generate_invoices.date") as mock_date:
+            mock_date.today.return_value = date(2024, 6, 1)
+            call_command("generate_invoices", workers=3, stdout=out)
+        self.assertIn("Created 12 invoices (12 items, total 120.00)", out.getvalue())
+        self.assertEqual(Invoice.objects.count(), 12)
+
+    def test_failed_shard_is_reported(self):
+        original = billing.generate_invoices
+
+        def flaky(today, shard, **kwargs):
+            if shard == (1, 2):
+                raise RuntimeError("boom")
+            return original(today, shard=shard, **kwargs)
+
+        with mock.patch("core.billing.ProcessPoolExecutor", _InlineExecutor), \
+                mock.patch("core.billing.generate_invoices", side_effect=flaky):
+            with self.assertRaisesMessage(CommandError, "1/2: boom"):
+                call_command("generate_invoices", workers=2, stdout=StringIO())
+        self.assertEqual(Invoice.objects.count(), 6)
+
+
+class BillingWatermarkTests(TestCase):
+    def setUp(self):
+        customer = Customer.objects.create(name="W", email="w@example.com")
+        self.contract = Contract.objects.create(
+            customer=customer,
+            contract_number="W-1",
+            start_date=date(2023, 1, 1),
+            end_date=date(2025, 12, 31),
+        )
+        self.service = Service.objects.create(contract=self.contract, name="Hosting", value=Decimal("10"))
+
+    def _watermark(self):
+        self.contract.refresh_from_db()
+        return self.contract.billed_through
+
+    def test_run_advances_watermark_and_resumes_from_it(self):
+        summary = billing.generate_invoices(date(2024, 3, 31))
+        self.assertEqual(summary.invoices_created, 15)
+        self.assertEqual(self._watermark(), date(2024, 3, 1))
+
+        summary = billing.generate_invoices(date(2024, 5, 2))
+        self.assertEqual(summary.invoices_created, 2)
+        self.assertEqual(self._watermark(), date(2024, 5, 1))
+
+    def test_up_to_date_contracts_are_not_loaded(self):
+        billing.generate_invoices(date(2024, 3, 31))
+        with CaptureQueriesContext(connection) as ctx:
+            summary = billing.generate_invoices(date(2024, 3, 20))
+        self.assertEqual(summary.invoices_created, 0)
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_since_skips_older_months_without_advancing(self):
+        summary = billing.generate_invoices(date(2024, 3, 15), since=date(2024, 2, 1))
+        self.assertEqual(summary.invoices_created, 2)
+        self.assertIsNone(self._watermark())
+
+        summary = billing.generate_invoices(date(2024, 3, 31))
+        self.assertEqual(summary.invoices_created, 13)
+        self.assertEqual(self._watermark(), date(2024, 3, 1))
+
+    def test_date_change_resets_watermark(self):
+        billing.generate_invoices(date(2024, 3, 31))
+        self.contract.refresh_from_db()
+        self.contract.start_date = date(2022, 11, 1)
+        self.contract.save()
+        self.assertIsNone(self._watermark())
+        self.assertEqual(billing.generate_invoices(date(2024, 3, 31)).invoices_created, 2)
+
+    def test_service_changes_reset_watermark(self):
+        billing.generate_invoices(date(2024, 3, 31))
+        Service.objects.create(contract=self.contract, name="Support", value=Decimal("5"))
+        self.assertIsNone(self._watermark())
+
+        billing.generate_invoices(date(2024, 3, 31))
+        self.assertIsNotNone(self._watermark())
+        self.service.delete()
+        self.assertIsNone(self._watermark())
+
+    def test_command_since_option(self):
+        with mock.patch("core.management.commands.generate_invoices.date") as mock_date:
+            mock_date.today.return_value = date(2024, 3, 15)
+            call_command("generate_invoices", since="2024-03", stdout=StringIO())
+        self.assertEqual(list(Invoice.objects.values_list("reference_date", flat=True)), ["2024-03"])
+        with self.assertRaisesMessage(CommandError, "expected YYYY-MM"):
+            call_command("generate_invoices", since="March", stdout=StringIO())
+
+
+from unittest import skipUnless
+
+from core import catalog
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN output is SQLite specific")
+class QueryPlanTests(TestCase):
+    """Hot lookups must be served by an index, never by a full table scan."""
+
+    def assertUsesIndex(self, queryset, table):
+        plan = queryset.explain()
+        self.assertIn(f"SEARCH {table} USING", plan)
+        self.assertNotIn(f"SCAN {table}", plan)
+
+    def test_invoice_by_contract_and_reference_date(self):
+        self.assertUsesIndex(
+            Invoice.objects.filter(contract_id=1, reference_date="2024-01"), "core_invoice"
+        )
+
+    def test_invoice_by_customer_and_reference_date(self):
+        self.assertUsesIndex(
+            Invoice.objects.filter(customer_id=1, reference_date__gte="2024-01"), "core_invoice"
+        )
+
+    def test_invoice_by_status(self):
+        self.assertUsesIndex(Invoice.objects.filter(status=Invoice.WAITING), "core_invoice")
+
+    def test_active_contracts_by_end_date(self):
+        self.assertUsesIndex(Contract.objects.filter(end_date__gte=date(2024, 1, 1)), "core_contract")
+
+    def test_billing_pages_follow_the_primary_key(self):
+        # Keyset pages of pending contracts walk the primary key; no page sorts the table.
+        pending = billing.pending_contracts(date(2024, 3, 15))
+        contracts = pending.order_by("pk").values_list(*catalog.CONTRACT_FIELDS)
+        first_page, next_page = contracts[:500].explain(), contracts.filter(pk__gt=500)[:500].explain()
+        self.assertNotIn("TEMP B-TREE", first_page + next_page)
+        self.assertIn("SEARCH core_contract USING INTEGER PRIMARY KEY (rowid>?)", next_page)
+
+    def test_billing_chunk_lookups(self):
+        services = Service.objects.filter(contract_id__in=[1, 2]).order_by("contract_id", "pk")
+        self.assertUsesIndex(services.values_list("contract_id", "name", "value"), "core_service")
+        self.assertNotIn("TEMP B-TREE", services.explain())
+        issued = Invoice.objects.filter(contract_id__in=[1, 2], reference_date__gte="2024-01")
+        self.assertUsesIndex(issued.values_list("contract_id", "reference_date"), "core_invoice")
+
+    def test_duplicate_contract_month_is_rejected(self):
+        from django.db import IntegrityError
+
+        customer = Customer.objects.create(name="D", email="d@example.com")
+        contract = Contract.objects.create(
+            customer=customer, contract_number="D-1", start_date="2024-01-01", end_date="2024-12-31"
+        )
+        fields = dict(customer=customer, contract=contract, reference_date="2024-01", total_amount=1)
+        Invoice.objects.create(status=Invoice.WAITING, **fields)
+        with self.assertRaises(IntegrityError):
+            Invoice.objects.create(status=Invoice.WAITING, **fields)
+
+
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+from core.pagination import LargeTablePaginator
+
+
+class AdminChangelistQueryTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_superuser("admin", "admin@example.com", "pw")
+        self.client.force_login(user)
+        self.created = 0
+
+    def _add_rows(self, count):
+        for _ in range(count):
+            i = self.created = self.created + 1
+            customer = Customer.objects.create(name=f"C{i}", email=f"c{i}@example.com")
+            contract = Contract.objects.create(
+                customer=customer, contract_number=f"N{i}", start_date="2024-01-01", end_date="2024-12-31"
+            )
+            Service.objects.create(contract=contract, name="Hosting", value=1)
+            Service.objects.create(contract=contract, name="Support", value=2)
+            Invoice.objects.create(
+                customer=customer, contract=contract, reference_date="2024-01", total_amount=3,
+                status=Invoice.WAITING,
+            )
+
+    def _changelist_queries(self, model_name):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(f"admin:core_{model_name}_changelist"))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        for model_name in ("customer", "contract", "service", "invoice"):
+            with self.subTest(model=model_name):
+                self._add_rows(2)
+                small = self._changelist_queries(model_name)
+                self._add_rows(20)
+                self.assertEqual(self._changelist_queries(model_name), small)
+
+    def test_service_count_uses_annotation(self):
+        self._add_rows(1)
+        response = self.client.get(reverse("admin:core_contract_changelist"))
+        self.assertContains(response, '<td class="field-service_count">2</td>', html=True)
+
+    def test_paginator_estimates_unfiltered_tables(self):
+        self._add_rows(5)
+        Customer.objects.filter(name="C1").delete()
+
+        class EagerPaginator(LargeTablePaginator):
+            exact_count_threshold = 0
+
+        if connection.vendor == "sqlite":
+            self.assertEqual(EagerPaginator(Customer.objects.order_by("pk"), 10).count, 5)
+        self.assertEqual(EagerPaginator(Customer.objects.filter(name__startswith="C").order_by("pk"), 10).count, 4)
+        self.assertEqual(LargeTablePaginator(Customer.objects.order_by("pk"), 10).count, 4)
+
+
+class InvoiceItemInlinePaginationTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_superuser("admin", "admin@example.com", "pw")
+        self.client.force_login(user)
+        customer = Customer.objects.create(name="Big", email="big@example.com")
+        self.invoice = Invoice.objects.create(
+            customer=customer, reference_date="2024-01", total_amount=120, status=Invoice.WAITING
+        )
+        InvoiceItem.objects.bulk_create(
+            InvoiceItem(invoice=self.invoice, service_name=f"Item {i}", service_amount=1)
+            for i in range(120)
+        )
+        self.url = reverse("admin:core_invoice_change", args=[self.invoice.pk])
+
+    def test_only_one_page_of_items_is_rendered(self):
+        response = self.client.get(self.url, {"items_page": 3})
+        formset = response.context["inline_admin_formsets"][0].formset
+        self.assertEqual(formset.initial_form_count(), 20)
+        self.assertEqual(formset.forms[0].instance.service_name, "Item 100")
+        self.assertContains(response, "120 items, 120.00 total. Page 3 of 3.")
+        self.assertContains(response, '<a href="?items_page=2">Previous</a>', html=True)
+
+    def test_items_on_a_page_can_be_edited(self):
+        items = list(self.invoice.items.order_by("pk")[50:100])
+        data = {
+            "customer": self.invoice.customer_id,
+            "contract": "",
+            "reference_date": "2024-01",
+            "total_amount": "120",
+            "status": Invoice.WAITING,
+            "items-TOTAL_FORMS": len(items),
+            "items-INITIAL_FORMS": len(items),
+            "items-MIN_NUM_FORMS": 0,
+            "items-MAX_NUM_FORMS": 1000,
+        }
+        for i, item in enumerate(items):
+            data[f"items-{i}-id"] = item.pk
+            data[f"items-{i}-invoice"] = self.invoice.pk
+            data[f"items-{i}-service_name"] = item.service_name
+            data[f"items-{i}-service_amount"] = "1"
+        data["items-0-service_amount"] = "5"
+        data["items-1-DELETE"] = "on"
+
+        response = self.client.post(f"{self.url}?items_page=2", data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(InvoiceItem.objects.get(pk=items[0].pk).service_amount, Decimal("5"))
+        self.assertFalse(InvoiceItem.objects.filter(pk=items[1].pk).exists())
+        self.assertEqual(self.invoice.items.count(), 119)
+
+    def test_invoice_can_be_added(self):
+        data = {
+            "customer": self.invoice.customer_id,
+            "contract": "",
+            "reference_date": "2024-02",
+            "total_amount": "0",
+            "status": Invoice.WAITING,
+            "items-TOTAL_FORMS": 1,
+            "items-INITIAL_FORMS": 0,
+            "items-MIN_NUM_FORMS": 0,
+            "items-MAX_NUM_FORMS": 1000,
+            "items-0-service_name": "Setup",
+            "items-0-service_amount": "25",
+        }
+
+        response = self.client.post(reverse("admin:core_invoice_add"), data)
+        self.assertEqual(response.status_code, 302)
+        invoice = Invoice.objects.get(reference_date="2024-02")
+        self.assertEqual([item.service_name for item in invoice.items.all()], ["Setup"])
+        self.assertEqual(invoice.total_amount, Decimal("25"))
+
+    def test_added_invoice_total_ignores_posted_total(self):
+        data = {
+            "customer": self.invoice.customer_id,
+            "contract": "",
+            "reference_date": "2024-03",
+            "total_amount": "100",
+            "status": Invoice.WAITING,
+            "items-TOTAL_FORMS": 0,
+            "items-INITIAL_FORMS": 0,
+            "items-MIN_NUM_FORMS": 0,
+            "items-MAX_NUM_FORMS": 1000,
+        }
+
+        response = self.client.post(reverse("admin:core_invoice_add"), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Invoice.objects.get(reference_date="2024-03").total_amount, Decimal("0"))
+        response = self.client.get(reverse("admin:core_invoice_add"))
+        self.assertNotContains(response, 'name="total_amount"')
+
+
+from core.models import CustomerBalance
+
+
+class IncrementalBalanceTests(TestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(name="Bal", email="bal@example.com")
+        self.invoice = Invoice.objects.create(
+            customer=self.customer, reference_date="2024-02", total_amount=0, status=Invoice.WAITING
+        )
+
+    def _balance(self):
+        return CustomerBalance.objects.get(customer=self.customer)
+
+    def _total(self):
+        self.invoice.refresh_from_db()
+        return self.invoice.total_amount
+
+    def test_item_changes_update_total_and_balance(self):
+        item = InvoiceItem.objects.create(invoice=self.invoice, service_name="A", service_amount=Decimal("10.50"))
+        InvoiceItem.objects.create(invoice=self.invoice, service_name="B", service_amount=Decimal("4.50"))
+        self.assertEqual(self._total(), Decimal("15.00"))
+
+        item.service_amount = Decimal("12.00")
+        item.save()
+        self.assertEqual(self._total(), Decimal("16.50"))
+
+        item.delete()
+        self.assertEqual(self._total(), Decimal("4.50"))
+        balance = self._balance()
+        self.assertEqual((balance.open_amount, balance.paid_amount), (Decimal("4.50"), Decimal("0")))
+        self.assertEqual(balance.last_reference_date, "2024-02")
+
+    def test_total_follows_items_when_saved_with_a_total(self):
+        invoice = Invoice.objects.create(
+            customer=self.customer, reference_date="2024-03", total_amount=100, status=Invoice.WAITING
+        )
+        InvoiceItem.objects.create(invoice=invoice, service_name="A", service_amount=Decimal("100"))
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.total_amount, Decimal("100"))
+        self.assertEqual(self._balance().open_amount, Decimal("100"))
+
+        InvoiceItem.objects.create(invoice=self.invoice, service_name="B", service_amount=Decimal("5"))
+        item = InvoiceItem.objects.get(service_name="B")
+        item.invoice = invoice
+        item.save()
+        invoice.refresh_from_db()
+        self.assertEqual((self._total(), invoice.total_amount), (Decimal("0"), Decimal("105")))
+        self.assertEqual(self._balance().open_amount, Decimal("105"))
+
+    def test_status_change_moves_amount_to_paid(self):
+        InvoiceItem.objects.create(invoice=self.invoice, service_name="A", service_amount=Decimal("20"))
+        self.invoice.refresh_from_db()
+        self.invoice.status = Invoice.PAID
+        self.invoice.save()
+        balance = self._balance()
+        self.assertEqual((balance.open_amount, balance.paid_amount), (Decimal("0"), Decimal("20")))
+
+    def test_invoice_delete_removes_amount(self):
+        InvoiceItem.objects.create(invoice=self.invoice, service_name="A", service_amount=Decimal("20"))
+        older = Invoice.objects.create(
+            customer=self.customer, reference_date="2024-01", total_amount=5, status=Invoice.PAID
+        )
+        self.invoice.delete()
+        balance = self._balance()
+        self.assertEqual((balance.open_amount, balance.paid_amount), (Decimal("0"), Decimal("5")))
+        self.assertEqual(balance.last_reference_date, "2024-01")
+
+        older.delete()
+        self.customer.delete()
+        self.assertFalse(CustomerBalance.objects.exists())
+
+    def test_billing_updates_balances(self):
+        contract = Contract.objects.create(
+            customer=self.customer, contract_number="B-1", start_date="2024-01-01", end_date="2024-03-31"
+        )
+        Service.objects.create(contract=contract, name="Hosting", value=Decimal("30"))
+        billing.generate_invoices(date(2024, 6, 1))
+        balance = self._balance()
+        self.assertEqual(balance.open_amount, Decimal("90"))
+        self.assertEqual(balance.last_reference_date, "2024-03")
+
+    def test_verify_balances_repairs_drift(self):
+        InvoiceItem.objects.create(invoice=self.invoice, service_name="A", service_amount=Decimal("20"))
+        Invoice.objects.filter(pk=self.invoice.pk).update(total_amount=99)
+        CustomerBalance.objects.filter(customer=self.customer).update(paid_amount=7)
+
+        out = StringIO()
+        call_command("verify_balances", dry_run=True, stdout=out)
+        self.assertIn("Found 1 invoice totals and 1 customer balances with drift.", out.getvalue())
+        self.assertEqual(self._total(), Decimal("99"))
+
+        call_command("verify_balances", stdout=out)
+        self.assertEqual(self._total(), Decimal("20"))
+        balance = self._balance()
+        self.assertEqual((balance.open_amount, balance.paid_amount), (Decimal("20"), Decimal("0")))
+
+        out = StringIO()
+        call_command("verify_balances", stdout=out)
+        self.assertIn("Repaired 0 invoice totals and 0 customer balances", out.getvalue())
+
+    def test_command_rejects_invalid_batch_size(self):
+        with self.assertRaisesMessage(CommandError, "--batch-size must be at least 1."):
+            call_command("verify_balances", batch_size=0, stdout=StringIO())
+
+
+import csv
+import gzip
+import json
+import os
+import tempfile
+
+
+class ExportInvoicesCommandTests(TestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(name="Exp", email="exp@example.com")
+        other = Customer.objects.create(name="Other", email="other@example.com")
+        self.first = Invoice.objects.create(
+            customer=self.customer, reference_date="2024-01", total_amount=0, status=Invoice.PAID
+        )
+        InvoiceItem.objects.create(invoice=self.first, service_name="Hosting", service_amount=Decimal("10.00"))
+        InvoiceItem.objects.create(invoice=self.first, service_name="Support", service_amount=Decimal("2.50"))
+        self.second = Invoice.objects.create(
+            customer=self.customer, reference_date="2024-02", total_amount=0, status=Invoice.WAITING
+        )
+        Invoice.objects.create(customer=other, reference_date="2024-02", total_amount=0, status=Invoice.WAITING)
+
+    def test_csv_to_stdout(self):
+        out = StringIO()
+        call_command("export_invoices", customer=self.customer.pk, stdout=out)
+        rows = list(csv.reader(StringIO(out.getvalue())))
+        self.assertEqual(rows[0][:3], ["invoice_id", "customer_id", "contract_id"])
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][5:], ["12.50", str(rows[1][6]), "Hosting", "10.00"])
+        self.assertEqual(rows[3][6:], ["", "", ""])
+
+    def test_jsonl_groups_items_per_invoice(self):
+        out = StringIO()
+        call_command("export_invoices", format="jsonl", date_to="2024-01", stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        invoice = json.loads(lines[0])
+        self.assertEqual(invoice["invoice_id"], self.first.pk)
+        self.assertEqual(invoice["total_amount"], "12.50")
+        self.assertEqual([item["service_name"] for item in invoice["items"]], ["Hosting", "Support"])
+
+    def test_gzip_file_output_with_filters(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "invoices.csv.gz")
+            out = StringIO()
+            call_command(
+                "export_invoices", output=path, status=Invoice.WAITING, date_from="2024-02",
+                chunk_size=1, stdout=out,
+            )
+            self.assertIn("Exported 2 records", out.getvalue())
+            with gzip.open(path, "rt", newline="") as handle:
+                rows = list(csv.reader(handle))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual({row[3] for row in rows[1:]}, {"2024-02"})
+
+    def test_invalid_month(self):
+        with self.assertRaisesMessage(CommandError, "expected YYYY-MM"):
+            call_command("export_invoices", date_from="2024/01", stdout=StringIO())
+
+    def test_invalid_chunk_size(self):
+        with self.assertRaisesMessage(CommandError, "--chunk-size must be at least 1."):
+            call_command("export_invoices", chunk_size=0, stdout=StringIO())
+
+
+class ImportCatalogCommandTests(TestCase):
+    HEADER = "customer_email,customer_name,contract_number,start_date,end_date,service_name,service_value\n"
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def _write(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w") as handle:
+            handle.write(text)
+        return path
+
+    def test_csv_import_and_upsert(self):
+        path = self._write("catalog.csv", self.HEADER + (
+            "a@example.com,Alpha,A-1,2024-01-01,2024-12-31,Hosting,10.00\n"
+            "a@example.com,Alpha,A-1,2024-01-01,2024-12-31,Support,5\n"
+            "b@example.com,Beta,,,,,\n"
+        ))
+        out = StringIO()
+        call_command("import_catalog", path, batch_size=2, stdout=out)
+        self.assertIn("Imported 3 of 3 rows", out.getvalue())
+        self.assertIn("rows/s", out.getvalue())
+        contract = Contract.objects.get(contract_number="A-1")
+        self.assertEqual(contract.customer.email, "a@example.com")
+        self.assertEqual(sorted(contract.services.values_list("name", flat=True)), ["Hosting", "Support"])
+        self.assertTrue(Customer.objects.filter(email="b@example.com").exists())
+
+        contract.billed_through = date(2024, 3, 1)
+        contract.save()
+        path = self._write("update.csv", self.HEADER + (
+            "a@example.com,Alpha Corp,A-1,2024-02-01,2024-12-31,Hosting,12.50\n"
+        ))
+        call_command("import_catalog", path, stdout=StringIO())
+        contract.refresh_from_db()
+        self.assertEqual(Customer.objects.get(email="a@example.com").name, "Alpha Corp")
+        self.assertEqual(contract.start_date, date(2024, 2, 1))
+        self.assertIsNone(contract.billed_through)
+        self.assertEqual(contract.services.get(name="Hosting").value, Decimal("12.50"))
+        self.assertEqual(Contract.objects.count(), 1)
+        self.assertEqual(Service.objects.count(), 2)
+
+    def test_invalid_batch_size_keeps_checkpoint(self):
+        path = self._write("catalog.csv", self.HEADER + "a@example.com,Alpha,A-1,2024-01-01,,Hosting,10\n")
+        checkpoint = f"{path}.checkpoint"
+        with open(checkpoint, "w") as handle:
+            json.dump({"rows": 0}, handle)
+        with self.assertRaisesMessage(CommandError, "--batch-size must be at least 1."):
+            call_command("import_catalog", path, batch_size=0, resume=True, stdout=StringIO())
+        self.assertTrue(os.path.exists(checkpoint))
+        self.assertFalse(Customer.objects.filter(email="a@example.com").exists())
+
+    def test_rejected_rows_go_to_sidecar_file(self):
+        path = self._write("catalog.csv", self.HEADER + (
+            "not-an-email,X,,,,,\n"
+            "c@example.com,Gamma,C-1,2024-05-01,2024-01-01,,\n"
+            "unknown@example.com,,U-1,2024-01-01,2024-02-01,,\n"
+            "c@example.com,Gamma,C-2,2024-01-01,2024-02-01,Hosting,abc\n"
+            "c@example.com,Gamma,C-3,2024-01-01,2024-02-01,Hosting,1.5\n"
+        ))
+        out = StringIO()
+        call_command("import_catalog", path, stdout=out)
+        self.assertIn("Imported 1 of 5 rows", out.getvalue())
+        with open(f"{path}.errors.csv", newline="") as handle:
+            errors = list(csv.DictReader(handle))
+        self.assertEqual([row["line"] for row in errors], ["1", "2", "4", "3"])
+        self.assertIn("Unknown customer", errors[3]["error"])
+        self.assertEqual(list(Contract.objects.values_list("contract_number", flat=True)), ["C-3"])
+
+    def test_json_rows_must_be_objects_and_emails_match_any_case(self):
+        Customer.objects.create(name="Mixed", email="Mixed@Example.com")
+        rows = ["5", "[1]", '"x"', json.dumps({"customer_email": "MIXED@example.com", "customer_name": "Mixed 2"})]
+        path = self._write("catalog.jsonl", "\n".join(rows) + "\n")
+        out = StringIO()
+        call_command("import_catalog", path, stdout=out)
+        self.assertIn("Imported 1 of 4 rows", out.getvalue())
+        with open(f"{path}.errors.csv", newline="") as handle:
+            errors = list(csv.DictReader(handle))
+        self.assertEqual([row["error"] for row in errors], ["A row must be a JSON object."] * 3)
+        self.assertEqual(list(Customer.objects.values_list("email", "name")), [("mixed@example.com", "Mixed 2")])
+
+    def test_resume_from_checkpoint(self):
+        lines = "".join(
+            json.dumps({"customer_email": f"r{i}@example.com", "customer_name": f"R{i}"}) + "\n"
+            for i in range(5)
+        )
+        path = self._write("catalog.jsonl", lines)
+        with open(f"{path}.checkpoint", "w") as handle:
+            json.dump({"rows": 3}, handle)
+        out = StringIO()
+        call_command("import_catalog", path, resume=True, stdout=out)
+        self.assertIn("Imported 2 of 2 rows", out.getvalue())
+        self.assertEqual(
+            sorted(Customer.objects.values_list("email", flat=True)), ["r3@example.com", "r4@example.com"]
+        )
+        self.assertFalse(os.path.exists(f"{path}.checkpoint"))
+
+
+class ScalableFakeDataTests(TestCase):
+    def _snapshot(self):
+        return (
+            list(Customer.objects.order_by("email").values_list("email", "name")),
+            list(
+                Service.objects.order_by("contract__contract_number", "name")
+                .values_list("contract__contract_number", "contract__start_date", "name", "value")
+            ),
+        )
+
+    def test_seeded_runs_are_reproducible(self):
+        options = dict(customers=7, seed=42, today=date(2024, 6, 30), batch_size=3, stdout=StringIO())
+        call_command("generate_fake_data", **options)
+        first = self._snapshot()
+        Customer.objects.all().delete()
+        call_command("generate_fake_data", **options)
+        self.assertEqual(self._snapshot(), first)
+
+    def test_sizes_and_history(self):
+        out = StringIO()
+        call_command(
+            "generate_fake_data", customers=4, contracts_per_customer="2", services_per_contract="10",
+            months_of_history=6, seed=1, today=date(2024, 6, 30), stdout=out,
+        )
+        self.assertIn("Created 4 customers, 8 contracts and 80 services.", out.getvalue())
+        self.assertTrue(Invoice.objects.exists())
+        self.assertFalse(Contract.objects.filter(start_date__lt=date(2023, 12, 1)).exists())
+        for contract in Contract.objects.all():
+            names = list(contract.services.values_list("name", flat=True))
+            self.assertEqual(len(names), len(set(names)))
+
+    def test_invalid_range(self):
+        with self.assertRaisesMessage(CommandError, "expected N or MIN-MAX"):
+            call_command("generate_fake_data", contracts_per_customer="many", stdout=StringIO())
+
+    def test_invalid_batch_size(self):
+        for batch_size in (0, -5):
+            with self.assertRaisesMessage(CommandError, "--batch-size must be at least 1."):
+                call_command("generate_fake_data", batch_size=batch_size, stdout=StringIO())
+
+
+from benchmarks import cases as benchmark_cases, runner as benchmark_runner
+
+
+class BenchmarkRunnerTests(TestCase):
+    def test_suite_runs_on_a_small_dataset(self):
+        reported = []
+        results = benchmark_runner.run_cases(
+            benchmark_cases.build_cases(customers=3, seed=1),
+            report=lambda name, measurement: reported.append(name),
+        )
+        self.assertEqual(list(results), reported)
+        self.assertIn("generate_invoices", results)
+        for measurement in results.values():
+            self.assertEqual(
+                set(measurement), {"wall_time", "queries", "peak_memory_kb", "rows", "rows_per_second"}
+            )
+        self.assertGreater(results["generate_fake_data"]["rows"], 3)
+        self.assertEqual(results["admin_changelist_customer"]["rows"], 3)
+
+    def test_only_records_selected_cases(self):
+        results = benchmark_runner.run_cases(
+            benchmark_cases.build_cases(customers=2, seed=1), only=["generate_invoices"]
+        )
+        self.assertEqual(list(results), ["generate_invoices"])
+
+    def test_compare_flags_regressions(self):
+        baseline = {
+            "a": {"wall_time": 1.0, "queries": 10, "peak_memory_kb": 100.0},
+            "b": {"wall_time": 0.001, "queries": 1, "peak_memory_kb": 10.0},
+        }
+        results = {
+            "a": {"wall_time": 1.3, "queries": 11, "peak_memory_kb": 130.0},
+            "b": {"wall_time": 0.004, "queries": 1, "peak_memory_kb": 11.0},
+            "new": {"wall_time": 5.0, "queries": 100, "peak_memory_kb": 1.0},
+        }
+        regressions = benchmark_runner.compare(results, baseline, threshold=0.2)
+        self.assertEqual(len(regressions), 3)
+        self.assertTrue(all(line.startswith("a: ") for line in regressions))
+        self.assertEqual(benchmark_runner.compare(results, baseline, threshold=0.5), ["a: 11 queries > 10"])
+
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+import threading
+
+from core import instrumentation
+
+INSTRUMENTED = {"ENABLED": True, "TOP_DUPLICATES": 3}
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        instrumentation.reset_stats()
+        self.addCleanup(instrumentation.reset_stats)
+
+    def test_normalize_sql_groups_shapes(self):
+        self.assertEqual(
+            instrumentation.normalize_sql("SELECT * FROM t WHERE id IN (%s, %s, %s) AND x = 'a' LIMIT 21"),
+            "SELECT * FROM t WHERE id IN (...) AND x = ? LIMIT ?",
+        )
+        self.assertEqual(
+            instrumentation.normalize_sql("INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)"),
+            "INSERT INTO t (a, b) VALUES (...), ...",
+        )
+
+    @override_settings(INSTRUMENTATION=INSTRUMENTED)
+    def test_record_detects_repeated_queries(self):
+        customer = Customer.objects.create(name="N", email="n@example.com")
+        with self.assertLogs("core.instrumentation", "INFO") as logs:
+            with instrumentation.record("block", "n_plus_one"):
+                for _ in range(4):
+                    Customer.objects.filter(pk=customer.pk).first()
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry["queries"], 4)
+        self.assertEqual(entry["duplicates"][0]["count"], 4)
+        self.assertIn("core_customer", entry["duplicates"][0]["sql"])
+
+    def test_middleware_removes_itself_when_disabled(self):
+        from django.core.exceptions import MiddlewareNotUsed
+
+        with override_settings(INSTRUMENTATION={"ENABLED": False}):
+            with self.assertRaises(MiddlewareNotUsed):
+                instrumentation.InstrumentationMiddleware(lambda request: None)
+
+    @override_settings(INSTRUMENTATION=INSTRUMENTED)
+    def test_requests_are_recorded_per_view(self):
+        user = get_user_model().objects.create_superuser("admin", "admin@example.com", "pw")
+        client = self.client_class()
+        client.force_login(user)
+        with self.assertLogs("core.instrumentation", "INFO"):
+            client.get(reverse("admin:core_customer_changelist"))
+            response = client.get(reverse("core:instrumentation-report"))
+        names = [row["name"] for row in response.json()["views"]]
+        self.assertIn("request:admin:core_customer_changelist", names)
+
+    @override_settings(INSTRUMENTATION=INSTRUMENTED)
+    def test_commands_are_recorded(self):
+        with mock.patch.object(BaseCommand, "execute", BaseCommand.execute):
+            instrumentation.instrument_commands(BaseCommand)
+            with self.assertLogs("core.instrumentation", "INFO") as logs:
+                call_command("verify_balances", stdout=StringIO())
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual((entry["kind"], entry["label"]), ("command", "verify_balances"))
+        self.assertGreater(entry["queries"], 0)
+
+    @override_settings(INSTRUMENTATION=INSTRUMENTED)
+    def test_worker_records_each_job_instead_of_the_run(self):
+        from core import jobs
+        from core.models import Job
+
+        jobs.enqueue(Job.BILLING, today="2024-01-31")
+        with mock.patch.object(BaseCommand, "execute", BaseCommand.execute):
+            instrumentation.instrument_commands(BaseCommand)
+            with self.assertLogs("core.instrumentation", "INFO") as logs:
+                call_command("run_worker", "--burst", stdout=StringIO())
+        entries = [json.loads(record.getMessage()) for record in logs.records]
+        self.assertEqual([(entry["kind"], entry["label"]) for entry in entries], [("job", "billing")])
+        self.assertGreater(entries[0]["queries"], 0)
+
+    def test_recorder_caps_distinct_statements_and_joins_other_threads(self):
+        recorder = instrumentation.QueryRecorder(max_shapes=2)
+        execute = lambda sql, params, many, context: None  # noqa: E731
+        for sql in ("SELECT 1", "SELECT 2", "SELECT 3", "SELECT 1"):
+            recorder(execute, sql, None, False, None)
+        self.assertEqual((recorder.queries, dict(recorder.shapes)), (4, {"SELECT 1": 2, "SELECT 2": 1}))
+
+        with instrumentation.record("block", "threads") as entry:
+            recorder = instrumentation.current_recorder()
+
+            def query():
+                try:
+                    with instrumentation.recording_into(recorder), connection.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                finally:
+                    connection.close()
+
+            thread = threading.Thread(target=query)
+            thread.start()
+            thread.join()
+        self.assertEqual(entry["queries"], 1)
+        self.assertIsNone(instrumentation.current_recorder())
+
+    def test_report_requires_staff(self):
+        response = self.client.get(reverse("core:instrumentation-report"))
+        self.assertEqual(response.status_code, 403)
+
+
+from core import rollups
+from core.models import RevenueRollup
+
+
+class RevenueRollupTests(TestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(name="R", email="r@example.com")
+        contract = Contract.objects.create(
+            customer=self.customer,
+            contract_number="R-1",
+            start_date=date(2024, 1, 1),
+            end_date=date(2024, 12, 31),
+        )
+        Service.objects.create(contract=contract, name="Hosting", value=Decimal("100.00"))
+        Service.objects.create(contract=contract, name="Support", value=Decimal("20.50"))
+
+    def _rollups(self):
+        return {
+            (row.reference_date, row.service_name): (row.amount, row.item_count)
+            for row in RevenueRollup.objects.filter(customer=self.customer)
+        }
+
+    def test_billing_refreshes_rollups_incrementally(self):
+        billing.generate_invoices(date(2024, 2, 29), chunk_size=1)
+        billing.generate_invoices(date(2024, 3, 31))
+        self.assertEqual(
+            self._rollups(),
+            {
+                (month, name): (amount, 1)
+                for month in ("2024-01", "2024-02", "2024-03")
+                for name, amount in (("Hosting", Decimal("100.00")), ("Support", Decimal("20.50")))
+            },
+        )
+
+    def test_rebuild_matches_invoice_items(self):
+        billing.generate_invoices(date(2024, 3, 31))
+        expected = self._rollups()
+        invoice = Invoice.objects.create(
+            customer=self.customer, reference_date="2023-12", total_amount=Decimal("5.00")
+        )
+        # Bulk writes send no signals, so the rollups miss this item until rebuilt.
+        InvoiceItem.objects.bulk_create(
+            [InvoiceItem(invoice=invoice, service_name="Hosting", service_amount=Decimal("5.00"))]
+        )
+        RevenueRollup.objects.filter(reference_date="2024-02").update(amount=0)
+
+        out = StringIO()
+        call_command("rebuild_rollups", "--from", "2024-02", "--to", "2024-02", stdout=out)
+        self.assertIn("Rebuilt 2 revenue rollups", out.getvalue())
+        self.assertEqual(self._rollups(), expected)
+
+        call_command("rebuild_rollups", stdout=StringIO())
+        expected[("2023-12", "Hosting")] = (Decimal("5.00"), 1)
+        self.assertEqual(self._rollups(), expected)
+
+    def test_invoice_and_item_edits_update_rollups(self):
+        billing.generate_invoices(date(2024, 2, 29))
+        expected = self._rollups()
+        invoice = Invoice.objects.get(reference_date="2024-02")
+        hosting = invoice.items.get(service_name="Hosting")
+
+        hosting.service_amount = Decimal("90.00")
+        hosting.save()
+        InvoiceItem.objects.create(invoice=invoice, service_name="Setup", service_amount=Decimal("5.00"))
+        invoice.items.get(service_name="Support").delete()
+        expected[("2024-02", "Hosting")] = (Decimal("90.00"), 1)
+        expected[("2024-02", "Setup")] = (Decimal("5.00"), 1)
+        del expected[("2024-02", "Support")]
+        self.assertEqual(self._rollups(), expected)
+
+        invoice.refresh_from_db()
+        invoice.reference_date = "2024-03"
+        invoice.save()
+        for name in ("Hosting", "Setup"):
+            expected[("2024-03", name)] = expected.pop(("2024-02", name))
+        self.assertEqual(self._rollups(), expected)
+
+        invoice.delete()
+        del expected[("2024-03", "Hosting")], expected[("2024-03", "Setup")]
+        self.assertEqual(self._rollups(), expected)
+        call_command("rebuild_rollups", stdout=StringIO())
+        self.assertEqual(self._rollups(), expected)
+
+    def test_rebuild_rejects_invalid_month(self):
+        with self.assertRaises(CommandError):
+            call_command("rebuild_rollups", "--from", "2024-13", stdout=StringIO())
+
+    def test_rebuild_rejects_invalid_batch_size(self):
+        with self.assertRaisesMessage(CommandError, "--batch-size must be at least 1."):
+            call_command("rebuild_rollups", "--batch-size", "0", stdout=StringIO())
+
+    def test_apply_rollup_changes(self):
+        changes = rollups.collect_rollup_changes(
+            [
+                ("2024-01", self.customer.pk, "Hosting", Decimal("10.00")),
+                ("2024-01", self.customer.pk, "Hosting", Decimal("5.00")),
+                ("2024-01", self.customer.pk, "Support", Decimal("2.00")),
+            ]
+        )
+        self.assertEqual(changes[("2024-01", self.customer.pk, "Hosting")], [Decimal("15.00"), 2])
+        rollups.apply_rollup_changes(changes)
+        self.assertEqual(
+            self._rollups(),
+            {("2024-01", "Hosting"): (Decimal("15.00"), 2), ("2024-01", "Support"): (Decimal("2.00"), 1)},
+        )
+
+        changes = {}
+        rollups.add_rollup_change(changes, ("2024-01", self.customer.pk, "Hosting"), Decimal("-5.00"), -1)
+        rollups.add_rollup_change(changes, ("2024-01", self.customer.pk, "Support"), Decimal("-2.00"), -1)
+        rollups.add_rollup_change(changes, ("2024-02", self.customer.pk, "Hosting"), Decimal("-1.00"), -1)
+        rollups.apply_rollup_changes(changes)
+        self.assertEqual(self._rollups(), {("2024-01", "Hosting"): (Decimal("10.00"), 1)})
+
+    def test_rebuild_rollups_and_report(self):
+        billing.generate_invoices(date(2024, 3, 31))
+        RevenueRollup.objects.all().delete()
+        self.assertEqual(rollups.rebuild_rollups("2024-02", None, batch_size=1), 4)
+        self.assertEqual({month for month, _ in self._rollups()}, {"2024-02", "2024-03"})
+
+        self.assertEqual(
+            rollups.revenue_report(("service",), date_to="2024-02", service_name="Support"),
+            [{"service": "Support", "amount": Decimal("20.50"), "items": 1}],
+        )
+        self.assertEqual(
+            rollups.revenue_report(("month", "customer"), customer_id=self.customer.pk),
+            [
+                {"month": month, "customer": self.customer.pk, "amount": Decimal("120.50"), "items": 2}
+                for month in ("2024-02", "2024-03")
+            ],
+        )
+        with self.assertRaises(ValueError):
+            rollups.check_group_by(("month", "year"))
+
+    def test_report_reads_only_rollups(self):
+        billing.generate_invoices(date(2024, 3, 31))
+        user = get_user_model().objects.create_user("finance", password="pw", is_staff=True)
+        self.client.force_login(user)
+        url = reverse("core:revenue-report")
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, {"from": "2024-02", "to": "2024-03", "group_by": "month,service"})
+        report_queries = [q["sql"] for q in ctx.captured_queries if "core_" in q["sql"]]
+        self.assertTrue(report_queries)
+        self.assertTrue(all("core_revenuerollup" in sql and "core_invoice" not in sql for sql in report_queries))
+        data = response.json()
+        self.assertEqual(data["total"], "241.00")
+        self.assertEqual(
+            data["results"][0],
+            {"month": "2024-02", "service": "Hosting", "amount": "100.00", "items": 1},
+        )
+
+        response = self.client.get(url, {"group_by": "customer"})
+        self.assertEqual(
+            response.json()["results"], [{"customer": self.customer.pk, "amount": "361.50", "items": 6}]
+        )
+
+    def test_report_validates_parameters(self):
+        user = get_user_model().objects.create_user("finance", password="pw", is_staff=True)
+        self.client.force_login(user)
+        url = reverse("core:revenue-report")
+        self.assertEqual(self.client.get(url, {"group_by": "year"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"from": "2024"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"customer": "x"}).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class ReadApiTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user("integration", password="pw", is_staff=True)
+        self.client.force_login(user)
+        for i in range(5):
+            customer = Customer.objects.create(name=f"A{i}", email=f"a{i}@example.com")
+            contract = Contract.objects.create(
+                customer=customer,
+                contract_number=f"A-{i}",
+                start_date=date(2024, 1, 1),
+                end_date=date(2024, 2, 29),
+            )
+            Service.objects.create(contract=contract, name="Hosting", value=Decimal("10.00"))
+            Service.objects.create(contract=contract, name="Support", value=Decimal("5.00"))
+        billing.generate_invoices(date(2024, 2, 29))
+
+    def _walk(self, name, **params):
+        url, pages, rows = reverse(f"core:api-{name}-list"), 0, []
+        params = {"limit": 3, **params}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            rows += data["results"]
+            url, params, pages = data["next"], {}, pages + 1
+        return rows, pages
+
+    def test_keyset_pages_cover_every_row_once(self):
+        rows, pages = self._walk("invoices")
+        expected = list(Invoice.objects.order_by("pk").values_list("pk", flat=True))
+        self.assertEqual([row["id"] for row in rows], expected)
+        self.assertEqual(pages, 4)
+        self.assertEqual(rows[0]["total_amount"], "15.00")
+        self.assertEqual(rows[0]["contract_number"], "A-0")
+
+    def test_filters_are_kept_across_pages(self):
+        customer = Customer.objects.get(email="a1@example.com")
+        invoice = Invoice.objects.filter(customer=customer).order_by("pk").first()
+        rows, _ = self._walk("invoice-items", limit=1, invoice=invoice.pk)
+        self.assertEqual([row["service_name"] for row in rows], ["Hosting", "Support"])
+        rows, _ = self._walk("invoices", customer=customer.pk, **{"from": "2024-02"})
+        self.assertEqual([row["reference_date"] for row in rows], ["2024-02"])
+
+    def test_page_queries_do_not_depend_on_depth_or_size(self):
+        url = reverse("core:api-contracts-list")
+        last = Contract.objects.order_by("-pk").values_list("pk", flat=True)[1]
+        for params in ({"limit": 1}, {"limit": 4}, {"after": last, "limit": 4}):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url, params)
+            core_queries = [q for q in ctx.captured_queries if "core_" in q["sql"]]
+            self.assertEqual(len(core_queries), 2, params)
+            self.assertNotIn("OFFSET", core_queries[0]["sql"])
+        self.assertEqual(response.json()["results"][0]["services"][0]["value"], "10.00")
+        self.assertIsNone(response.json()["next"])
+
+    def test_detail_nests_items(self):
+        invoice = Invoice.objects.order_by("pk").first()
+        data = self.client.get(reverse("core:api-invoices-detail", args=[invoice.pk])).json()
+        self.assertEqual([item["service_amount"] for item in data["items"]], ["10.00", "5.00"])
+        customer = self.client.get(reverse("core:api-customers-detail", args=[invoice.customer_id])).json()
+        self.assertEqual(customer["open_amount"], "30.00")
+        response = self.client.get(reverse("core:api-invoices-detail", args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_parameters_and_permissions(self):
+        url = reverse("core:api-invoices-list")
+        for params in ({"limit": 0}, {"limit": 5000}, {"after": "x"}, {"status": "lost"}, {"to": "2024-13"}):
+            self.assertEqual(self.client.get(url, params).status_code, 400, params)
+        self.assertEqual(self.client.post(url).status_code, 405)
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from core import importers
+
+
+class HttpCachingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        user = get_user_model().objects.create_user("integration", password="pw", is_staff=True)
+        self.client.force_login(user)
+        self.customer = Customer.objects.create(name="E", email="e@example.com")
+        self.contract = Contract.objects.create(
+            customer=self.customer,
+            contract_number="E-1",
+            start_date=date(2024, 1, 1),
+            end_date=date(2024, 1, 31),
+        )
+        self.service = Service.objects.create(contract=self.contract, name="Hosting", value=Decimal("10.00"))
+        billing.generate_invoices(date(2024, 1, 31))
+        self.invoice = Invoice.objects.get()
+        self.url = reverse("core:api-invoices-detail", args=[self.invoice.pk])
+
+    def _revalidate(self, url, response):
+        return self.client.get(url, headers={"if-none-match": response["ETag"]})
+
+    def test_conditional_get_returns_304_without_rebuilding(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn("Last-Modified", first)
+        with CaptureQueriesContext(connection) as ctx:
+            second = self._revalidate(self.url, first)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second["ETag"], first["ETag"])
+        self.assertEqual(len([q for q in ctx.captured_queries if "core_" in q["sql"]]), 1)
+
+        modified_since = self.client.get(self.url, headers={"if-modified-since": first["Last-Modified"]})
+        self.assertEqual(modified_since.status_code, 304)
+
+    def test_item_and_contract_changes_invalidate_invoice(self):
+        first = self.client.get(self.url)
+        item = self.invoice.items.get()
+        item.service_name = "Hosting plus"
+        item.save()
+        second = self._revalidate(self.url, first)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()["items"][0]["service_name"], "Hosting plus")
+
+        self.contract.contract_number = "E-2"
+        self.contract.save()
+        third = self._revalidate(self.url, second)
+        self.assertEqual(third.json()["contract_number"], "E-2")
+
+        self.customer.name = "Renamed"
+        self.customer.save()
+        self.assertEqual(self._revalidate(self.url, third).json()["customer_name"], "Renamed")
+
+    def test_writes_bypassing_signals_are_detected(self):
+        first = self.client.get(self.url)
+        Invoice.objects.filter(pk=self.invoice.pk).update(status=Invoice.PAID, updated_at=timezone.now())
+        second = self._revalidate(self.url, first)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()["status"], Invoice.PAID)
+
+    def test_contract_payload_follows_services_and_imports(self):
+        url = reverse("core:api-contracts-detail", args=[self.contract.pk])
+        first = self.client.get(url)
+        self.service.value = Decimal("12.00")
+        self.service.save()
+        second = self._revalidate(url, first)
+        self.assertEqual(second.json()["services"][0]["value"], "12.00")
+
+        importer = importers.CatalogImporter()
+        importer.import_batch(
+            [(1, {
+                "customer_email": "e@example.com",
+                "contract_number": "E-1",
+                "start_date": "2024-01-01",
+                "end_date": "2024-06-30",
+            })],
+            lambda *args: self.fail(args),
+        )
+        third = self._revalidate(url, second)
+        self.assertEqual(third.json()["end_date"], "2024-06-30")
+
+    def test_imported_rename_invalidates_payloads(self):
+        invoice = self.client.get(self.url)
+        contract_url = reverse("core:api-contracts-detail", args=[self.contract.pk])
+        contract = self.client.get(contract_url)
+        importers.CatalogImporter().import_batch(
+            [(1, {"customer_email": "e@example.com", "customer_name": "Imported"})],
+            lambda *args: self.fail(args),
+        )
+        for url, response in ((self.url, invoice), (contract_url, contract)):
+            revalidated = self._revalidate(url, response)
+            self.assertEqual(revalidated.status_code, 200)
+            self.assertEqual(revalidated.json()["customer_name"], "Imported")
+
+    def test_revenue_report_is_cached_until_rollups_change(self):
+        url = reverse("core:revenue-report")
+        first = self.client.get(url, {"group_by": "month"})
+        self.assertEqual(self._revalidate(url + "?group_by=month", first).status_code, 304)
+        other = self.client.get(url, {"group_by": "service"})
+        self.assertNotEqual(other["ETag"], first["ETag"])
+
+        Contract.objects.filter(pk=self.contract.pk).update(end_date=date(2024, 2, 29), billed_through=None)
+        billing.generate_invoices(date(2024, 2, 29))
+        second = self._revalidate(url + "?group_by=month", first)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(len(second.json()["results"]), 2)
+
+
+from django.test import AsyncClient
+
+
+class AsyncApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = get_user_model().objects.create_user("integration", password="pw", is_staff=True)
+        self.customer = Customer.objects.create(name="S", email="s@example.com")
+        contract = Contract.objects.create(
+            customer=self.customer,
+            contract_number="S-1",
+            start_date=date(2024, 1, 1),
+            end_date=date(2024, 3, 31),
+        )
+        Service.objects.create(contract=contract, name="Hosting", value=Decimal("10.00"))
+        billing.generate_invoices(date(2024, 3, 31))
+
+    async def test_customer_page_includes_header_and_count(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        response = await client.get(
+            reverse("core:api-invoices-list"), {"customer": self.customer.pk, "limit": 2}
+        )
+        data = response.json()
+        self.assertEqual(data["customer"], {"id": self.customer.pk, "name": "S", "email": "s@example.com"})
+        self.assertEqual(data["count"], 3)
+        self.assertEqual(len(data["results"]), 2)
+        self.assertIsNotNone(data["next"])
+
+        invoice_id = data["results"][0]["id"]
+        detail = await client.get(reverse("core:api-invoices-detail", args=[invoice_id]))
+        self.assertEqual(detail.json()["items"][0]["service_amount"], "10.00")
+
+    async def test_async_views_check_staff(self):
+        response = await AsyncClient().get(reverse("core:api-customers-list"))
+        self.assertEqual(response.status_code, 403)
+
+
+import shutil
+
+from core import payments
+
+
+class PaymentReconciliationTests(TestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(name="P", email="p@example.com")
+        self.invoices = [
+            Invoice.objects.create(
+                customer=self.customer, reference_date=ref, total_amount=amount, status=Invoice.WAITING
+            )
+            for ref, amount in (
+                ("2024-01", Decimal("100.00")),
+                ("2024-02", Decimal("100.00")),
+                ("2024-02", Decimal("100.00")),
+                ("2024-03", Decimal("50.00")),
+                ("2024-04", Decimal("75.00")),
+            )
+        ]
+        self.invoices[4].status = Invoice.PAID
+        self.invoices[4].save()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def _write(self, name, text):
+        path = os.path.join(self.tmp, name)
+        with open(path, "w") as handle:
+            handle.write(text)
+        return path
+
+    def _report(self, path):
+        with open(f"{path}.report.csv") as handle:
+            return {row["payment_id"]: row for row in csv.DictReader(handle)}
+
+    def test_csv_file_is_matched_and_reported(self):
+        first, february, _, march, april = self.invoices
+        path = self._write(
+            "bank.csv",
+            "payment_id,invoice_id,customer_email,reference_date,amount\n"
+            f"T1,{first.pk},,,100.00\n"
+            f"T2,{first.pk},,,100.00\n"
+            "T3,,P@example.com,2024-02,100.00\n"
+            "T4,,p@example.com,2024-03,50\n"
+            f"T5,{april.pk},,,75.00\n"
+            "T6,,p@example.com,2024-05,10.00\n"
+            f"T7,{february.pk},,,99.00\n"
+            "T8,,,,abc\n",
+        )
+        out = StringIO()
+        with CaptureQueriesContext(connection) as ctx:
+            call_command("reconcile_payments", path, stdout=out)
+        self.assertLessEqual(len(ctx.captured_queries), 10)
+        self.assertIn("Marked 2 of 8 payments as paid", out.getvalue())
+
+        report = self._report(path)
+        outcomes = {payment_id: row["outcome"] for payment_id, row in report.items()}
+        self.assertEqual(outcomes, {
+            "T1": payments.MATCHED,
+            "T2": payments.DUPLICATE,
+            "T3": payments.AMBIGUOUS,
+            "T4": payments.MATCHED,
+            "T5": payments.ALREADY_PAID,
+            "T6": payments.UNMATCHED,
+            "T7": payments.AMOUNT_MISMATCH,
+            "T8": payments.INVALID,
+        })
+        paid = set(Invoice.objects.filter(status=Invoice.PAID).values_list("pk", flat=True))
+        self.assertEqual(paid, {first.pk, march.pk, april.pk})
+        balance = CustomerBalance.objects.get(customer=self.customer)
+        self.assertEqual((balance.open_amount, balance.paid_amount), (Decimal("200.00"), Decimal("225.00")))
+
+    def test_ofx_file_and_dry_run(self):
+        first = self.invoices[0]
+        path = self._write(
+            "bank.ofx",
+            "<OFX><BANKTRANLIST>\n"
+            f"<STMTTRN>\n<TRNTYPE>CREDIT\n<TRNAMT>100.00\n<FITID>A1\n<MEMO>Payment INV-{first.pk}\n</STMTTRN>\n"
+            "<STMTTRN>\n<TRNTYPE>CREDIT\n<TRNAMT>50.00\n<FITID>A2\n<MEMO>p@example.com 2024-03\n</STMTTRN>\n"
+            "</BANKTRANLIST></OFX>\n",
+        )
+        out = StringIO()
+        call_command("reconcile_payments", path, "--dry-run", "--batch-size", "1", stdout=out)
+        self.assertIn("Would mark 2 of 2 payments", out.getvalue())
+        self.assertFalse(Invoice.objects.filter(pk=first.pk, status=Invoice.PAID).exists())
+
+        call_command("reconcile_payments", path, stdout=StringIO())
+        self.assertEqual(Invoice.objects.filter(status=Invoice.PAID).count(), 3)
+
+    def test_command_rejects_invalid_batch_size(self):
+        with self.assertRaisesMessage(CommandError, "--batch-size must be at least 1."):
+            call_command("reconcile_payments", "missing.csv", "--batch-size", "-1", stdout=StringIO())
+
+    def test_admin_action_marks_waiting_invoices(self):
+        user = get_user_model().objects.create_superuser("admin", "admin@example.com", "pw")
+        self.client.force_login(user)
+        response = self.client.post(
+            reverse("admin:core_invoice_changelist"),
+            {"action": "mark_as_paid", "_selected_action": [invoice.pk for invoice in self.invoices]},
+            follow=True,
+        )
+        self.assertContains(response, "4 invoices marked as paid.")
+        self.assertFalse(Invoice.objects.filter(status=Invoice.WAITING).exists())
+        balance = CustomerBalance.objects.get(customer=self.customer)
+        self.assertEqual((balance.open_amount, balance.paid_amount), (Decimal("0.00"), Decimal("425.00")))
+
+
+from core import preview
+
+
+class BillingPreviewTests(TestCase):
+    def setUp(self):
+        for i in range(3):
+            customer = Customer.objects.create(name=f"V{i}", email=f"v{i}@example.com")
+            contract = Contract.objects.create(
+                customer=customer,
+                contract_number=f"V-{i}",
+                start_date=date(2024, 1, 16),
+                end_date=date(2024, 3, 31),
+            )
+            Service.objects.create(contract=contract, name="Hosting", value=Decimal("31.00"))
+        Invoice.objects.create(
+            customer=customer, contract=contract, reference_date="2024-01", total_amount=Decimal("16.00")
+        )
+
+    def test_preview_matches_a_real_run_and_only_reads(self):
+        with CaptureQueriesContext(connection) as ctx:
+            planned = [
+                (invoice.contract_id, invoice.reference_date, invoice.total_amount)
+                for invoice, _ in billing.preview_invoices(date(2024, 3, 31))
+            ]
+        self.assertTrue(all(q["sql"].startswith("SELECT") for q in ctx.captured_queries))
+        self.assertFalse(Invoice.objects.exclude(reference_date="2024-01", customer__name="V2").exists())
+
+        billing.generate_invoices(date(2024, 3, 31))
+        created = list(
+            Invoice.objects.exclude(reference_date="2024-01", customer__name="V2")
+            .order_by("contract_id", "reference_date")
+            .values_list("contract_id", "reference_date", "total_amount")
+        )
+        self.assertEqual(planned, created)
+        self.assertEqual(len(planned), 8)
+
+    def test_dry_run_prints_customer_totals(self):
+        out = StringIO()
+        with CaptureQueriesContext(connection) as ctx:
+            with mock.patch("core.management.commands.generate_invoices.date") as mock_date:
+                mock_date.today.return_value = date(2024, 3, 31)
+                call_command("generate_invoices", "--dry-run", stdout=out)
+        self.assertTrue(all(q["sql"].startswith("SELECT") for q in ctx.captured_queries))
+        first = Customer.objects.get(name="V0")
+        output = out.getvalue()
+        self.assertIn(f"Customer {first.pk}: 3 invoices, 3 items, total 78.00", output)
+        self.assertIn("Would create 8 invoices (8 items, total 218.00)", output)
+        self.assertEqual(Invoice.objects.count(), 1)
+
+    def test_preview_jsonl_stream(self):
+        out, err = StringIO(), StringIO()
+        with mock.patch("core.management.commands.generate_invoices.date") as mock_date:
+            mock_date.today.return_value = date(2024, 3, 31)
+            call_command("generate_invoices", "--preview", "--preview-format", "jsonl", stdout=out, stderr=err)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([r["type"] for r in records].count("invoice"), 8)
+        self.assertEqual([r["type"] for r in records].count("customer"), 3)
+        self.assertEqual(records[0]["items"], [{"service_name": "Hosting", "service_amount": "16.00"}])
+        self.assertIn("Would create 8 invoices", err.getvalue())
+
+    def test_write_preview_formats(self):
+        customers = list(Customer.objects.order_by("pk").values_list("pk", flat=True))
+        out = StringIO()
+        result = preview.write_preview(out, date(2024, 3, 31))
+        self.assertEqual(
+            out.getvalue().splitlines(),
+            [
+                f"Customer {customers[0]}: 3 invoices, 3 items, total 78.00",
+                f"Customer {customers[1]}: 3 invoices, 3 items, total 78.00",
+                f"Customer {customers[2]}: 2 invoices, 2 items, total 62.00",
+            ],
+        )
+        summary = result.summary
+        self.assertEqual(
+            (summary.invoices_created, summary.items_created, summary.total_amount), (8, 8, Decimal("218.00"))
+        )
+        self.assertEqual(result.customers[customers[2]], preview.CustomerTotal(2, 2, Decimal("62.00")))
+
+        out = StringIO()
+        preview.write_preview(out, date(2024, 3, 31), fmt="jsonl", chunk_size=1)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(
+            records[0],
+            {
+                "type": "invoice",
+                "customer_id": customers[0],
+                "contract_id": Contract.objects.get(contract_number="V-0").pk,
+                "reference_date": "2024-01",
+                "total_amount": "16.00",
+                "items": [{"service_name": "Hosting", "service_amount": "16.00"}],
+            },
+        )
+        self.assertEqual(
+            records[-1],
+            {"type": "customer", "customer_id": customers[2], "invoices": 2, "items": 2, "total_amount": "62.00"},
+        )
+        self.assertEqual(Invoice.objects.count(), 1)
+
+    def test_dry_run_rejects_workers(self):
+        with self.assertRaises(CommandError):
+            call_command("generate_invoices", "--dry-run", "--workers", "2", stdout=StringIO())
+
+
+import random
+from calendar import monthrange
+from datetime import timedelta
+from decimal import ROUND_HALF_UP
+
+from core import proration
+
+
+class ProrationEngineTests(SimpleTestCase):
+    def _random_charges(self, rng, count):
+        for _ in range(count):
+            month = date(rng.randint(1990, 2100), rng.randint(1, 12), 1)
+            month_end = month.replace(day=monthrange(month.year, month.month)[1])
+            first = month + timedelta(days=rng.randint(0, month_end.day - 1))
+            last = first + timedelta(days=rng.randint(0, (month_end - first).days))
+            if rng.random() < 0.2:
+                first, last = month, month_end
+            cents = rng.choice([rng.randint(0, 100), rng.randint(0, 10**6), rng.randint(0, 10**10)])
+            yield Decimal(cents).scaleb(-2), first, last, month, month_end
+
+    def test_matches_the_decimal_path_on_random_charges(self):
+        # A seeded randomized property check: hypothesis is not a dependency.
+        rng = random.Random(20240101)
+        charges = list(self._random_charges(rng, 20_000))
+        batch = proration.ProrationBatch()
+        for value, first, last, month, _ in charges:
+            batch.add(proration.to_cents(value), first, last, month)
+        amounts = batch.amounts()
+        for (value, first, last, month, month_end), cents in zip(charges, amounts):
+            expected = billing.prorate(value, first, last, month, month_end)
+            self.assertEqual(proration.from_cents(cents), expected, (value, first, last))
+
+    def test_ties_round_half_even_or_half_up(self):
+        # 0.01 * 15 / 30 and 0.03 * 15 / 30 are exactly half a cent away.
+        starts = [date(2024, 4, 1).toordinal()] * 2
+        ends = [date(2024, 4, 15).toordinal()] * 2
+        months = [date(2024, 4, 1).toordinal()] * 2
+        self.assertEqual(list(proration.prorate_cents([1, 3], starts, ends, months)), [0, 2])
+        self.assertEqual(list(proration.prorate_cents([1, 3], starts, ends, months, ROUND_HALF_UP)), [1, 2])
+        self.assertEqual(list(proration.prorate_cents([-1, -3], starts, ends, months)), [0, -2])
+
+    def test_cents_conversion(self):
+        self.assertEqual(proration.to_cents(Decimal("99.99")), 9999)
+        self.assertEqual(str(proration.from_cents(5)), "0.05")
+        with self.assertRaises(ValueError):
+            proration.to_cents(Decimal("1.005"))
+
+
+from django.conf import settings
+
+
+@skipUnless(connection.vendor == "sqlite", "SQLite profile")
+class SqliteProfileTests(TestCase):
+    def test_pragmas_are_applied_on_connect(self):
+        if not settings.SQLITE_PROFILE:
+            self.skipTest("ERP_SQLITE_PROFILE=0")
+        with connection.cursor() as cursor:
+            values = {}
+            for pragma in ("synchronous", "busy_timeout", "cache_size", "temp_store"):
+                cursor.execute(f"PRAGMA {pragma}")
+                values[pragma] = cursor.fetchone()[0]
+        self.assertEqual(values, {"synchronous": 1, "busy_timeout": 5000, "cache_size": -64000, "temp_store": 2})
+        self.assertEqual(connection.transaction_mode, "IMMEDIATE")
+
+
+from core import search
+
+
+@skipUnless(connection.vendor == "sqlite", "SQLite FTS5 index")
+class FullTextSearchTests(TestCase):
+    def setUp(self):
+        self.alpha = Customer.objects.create(name="Alpha Corporação", email="billing@alpha.example")
+        self.beta = Customer.objects.create(name="Beta Ltd", email="ops@beta.example")
+        self.contract = Contract.objects.create(
+            customer=self.beta, contract_number="BX-2040", start_date="2025-01-01", end_date="2025-12-31"
+        )
+        Service.objects.create(contract=self.contract, name="Managed Hosting", value=10)
+        Invoice.objects.create(customer=self.alpha, reference_date="2025-01", total_amount=0)
+        Invoice.objects.create(customer=self.beta, contract=self.contract, reference_date="2025-01", total_amount=0)
+        user = get_user_model().objects.create_superuser("admin", "admin@example.com", "pw")
+        self.client.force_login(user)
+
+    def search(self, model, text):
+        return set(model.objects.filter(pk__in=search.matching_ids(model, text)).values_list("pk", flat=True))
+
+    def test_prefix_and_accent_insensitive_matches(self):
+        self.assertEqual(self.search(Customer, "alp corpora"), {self.alpha.pk})
+        self.assertEqual(self.search(Customer, "beta.example"), {self.beta.pk})
+        self.assertEqual(self.search(Contract, "bx 2040"), {self.contract.pk})
+        self.assertEqual(self.search(Service, "host"), set(self.contract.services.values_list("pk", flat=True)))
+        self.assertEqual(self.search(Customer, "gamma"), set())
+        self.assertIsNone(search.matching_ids(Customer, '"*-'))
+
+    def test_index_follows_bulk_writes(self):
+        Customer.objects.bulk_create([Customer(name=f"Gamma {i}", email=f"g{i}@example.com") for i in range(3)])
+        self.assertEqual(len(self.search(Customer, "gamma")), 3)
+        Customer.objects.filter(name__startswith="Gamma").update(name="Delta")
+        self.assertEqual(self.search(Customer, "gamma"), set())
+        self.assertEqual(len(self.search(Customer, "delta")), 3)
+        Customer.objects.filter(name="Delta").delete()
+        self.assertEqual(self.search(Customer, "delta"), set())
+
+    def test_install_is_idempotent_and_repairs_triggers(self):
+        self.assertEqual(search.install(), [])
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER core_customer_fts_update")
+        self.assertEqual(search.install(), ["core_customer"])
+        self.assertEqual(self.search(Customer, "alpha"), {self.alpha.pk})
+
+    def test_admin_changelists_search_the_index(self):
+        cases = [
+            ("admin:core_customer_changelist", "alph", "Alpha Corporação"),
+            ("admin:core_contract_changelist", "beta", "BX-2040"),
+            ("admin:core_service_changelist", "bx-2040", "Managed Hosting"),
+            ("admin:core_invoice_changelist", "bx", "Beta Ltd"),
+        ]
+        for name, term, expected in cases:
+            with self.subTest(name), CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(name), {"q": term})
+            self.assertContains(response, expected)
+            self.assertFalse(any(" LIKE " in query["sql"] for query in queries.captured_queries))
+        response = self.client.get(reverse("admin:core_invoice_changelist"), {"q": "bx"})
+        self.assertNotContains(response, "Alpha Corporação")
+
+    def test_sqlite_without_fts5_falls_back_to_icontains(self):
+        with mock.patch.object(search, "sqlite_has_fts5", return_value=False):
+            self.assertFalse(search.is_supported())
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse("admin:core_customer_changelist"), {"q": "alph"})
+        self.assertContains(response, "Alpha Corporação")
+        self.assertTrue(any(" LIKE " in query["sql"] for query in queries.captured_queries))
+
+
+from datetime import datetime, timezone as dt_timezone
+
+from core import jobs
+from core.models import Job
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.contracts = []
+        for i in range(3):
+            customer = Customer.objects.create(name=f"J{i}", email=f"j{i}@example.com")
+            contract = Contract.objects.create(
+                customer=customer,
+                contract_number=f"J-{i}",
+                start_date=date(2024, 1, 1),
+                end_date=date(2024, 3, 31),
+            )
+            Service.objects.create(contract=contract, name="Hosting", value=Decimal("30.00"))
+            self.contracts.append(contract)
+        user = get_user_model().objects.create_superuser("admin", "admin@example.com", "pw")
+        self.client.force_login(user)
+
+    def run_worker(self):
+        out = StringIO()
+        call_command("run_worker", "--burst", stdout=out)
+        return out.getvalue()
+
+    def test_admin_queues_billing_and_worker_reports_progress(self):
+        response = self.client.post(
+            reverse("admin:core_contract_changelist"),
+            {"action": "queue_billing", "_selected_action": [c.pk for c in self.contracts[:2]]},
+            follow=True,
+        )
+        self.assertContains(response, "Queued Billing run #")
+        self.assertFalse(Invoice.objects.exists())
+        job = Job.objects.get()
+        job.arguments["today"] = "2024-03-31"
+        job.save()
+
+        self.assertIn("Ran 1 jobs", self.run_worker())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.progress, {"contracts": 2, "invoices": 6, "items": 6})
+        self.assertEqual((job.result["invoices"], job.result["total_amount"]), (6, "180.00"))
+        billed = set(Invoice.objects.values_list("contract_id", flat=True))
+        self.assertEqual(billed, {contract.pk for contract in self.contracts[:2]})
+        response = self.client.get(reverse("admin:core_job_changelist"))
+        self.assertContains(response, "contracts 2, invoices 6, items 6")
+
+    def test_large_selections_are_split_into_several_jobs(self):
+        with mock.patch.object(ContractAdmin, "billing_job_size", 2):
+            response = self.client.post(
+                reverse("admin:core_contract_changelist"),
+                {"action": "queue_billing", "_selected_action": [c.pk for c in self.contracts]},
+                follow=True,
+            )
+        self.assertContains(response, "Queued 2 billing jobs")
+        chunks = [job.arguments["contract_ids"] for job in Job.objects.order_by("pk")]
+        self.assertEqual(chunks, [[c.pk for c in self.contracts[:2]], [self.contracts[2].pk]])
+
+    def test_heartbeat_survives_write_errors(self):
+        from django.db import OperationalError
+
+        job = jobs.enqueue(Job.BILLING)
+        heartbeat = jobs.Heartbeat(job, "w", jobs.Progress())
+        beats = [OperationalError("database is locked"), True, False]
+        with (
+            mock.patch.object(jobs, "REPORT_INTERVAL", 0),
+            mock.patch.object(heartbeat, "beat", side_effect=beats) as beat,
+            mock.patch.object(jobs.connections, "close_all"),
+            self.assertLogs("core.jobs", "ERROR") as logs,
+        ):
+            heartbeat.run()
+        self.assertEqual(beat.call_count, 3)
+        self.assertIn("retrying", logs.output[0])
+
+    def test_export_job_writes_the_file(self):
+        billing.generate_invoices(date(2024, 3, 31))
+        invoices = list(Invoice.objects.order_by("pk")[:4])
+        self.client.post(
+            reverse("admin:core_invoice_changelist"),
+            {"action": "queue_export_csv", "_selected_action": [invoice.pk for invoice in invoices]},
+        )
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(JOBS={**settings.JOBS, "EXPORT_ROOT": directory}):
+            self.run_worker()
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.result["records"], 4)
+        with open(job.result["path"], newline="") as stream:
+            rows = list(csv.DictReader(stream))
+        self.assertEqual([int(row["invoice_id"]) for row in rows], [invoice.pk for invoice in invoices])
+        self.assertEqual(os.listdir(directory), [os.path.basename(job.result["path"])])
+
+    def test_failures_are_retried_with_backoff_then_failed(self):
+        job = jobs.enqueue(Job.EXPORT, format="xml")
+        with self.assertLogs("core.jobs", "ERROR"):
+            self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertEqual(job.error, "ValueError: Unknown export format 'xml'.")
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn("Ran 0 jobs", self.run_worker())
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now(), max_attempts=2)
+        with self.assertLogs("core.jobs", "ERROR"):
+            self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_claims_are_exclusive_and_expired_leases_requeued(self):
+        job = jobs.enqueue(Job.BILLING)
+        now = datetime(2030, 1, 1, tzinfo=dt_timezone.utc)
+        self.assertEqual(jobs.claim("a", now).pk, job.pk)
+        self.assertIsNone(jobs.claim("b", now))
+        self.assertEqual(jobs.requeue_expired(now), 0)
+
+        later = now + 2 * jobs.lease_duration()
+        self.assertEqual(jobs.requeue_expired(later), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        progress = jobs.Progress()
+        self.assertFalse(jobs.Heartbeat(job, "a", progress).beat(later))
+        with self.assertRaises(jobs.LeaseLost):
+            progress.report(contracts=1)
+
+        Job.objects.filter(pk=job.pk).update(max_attempts=2)
+        self.assertEqual(jobs.claim("b", later).worker, "b")
+        progress = jobs.Progress()
+        progress.report(contracts=5)
+        heartbeat = jobs.Heartbeat(job, "b", progress)
+        self.assertTrue(heartbeat.beat(later + jobs.lease_duration()))
+        job.refresh_from_db()
+        self.assertEqual(job.progress, {"contracts": 5})
+        self.assertEqual(job.lease_expires_at, later + 2 * jobs.lease_duration())
+        self.assertEqual(jobs.requeue_expired(later + 3 * jobs.lease_duration()), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+    def test_unknown_kind_is_rejected(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue("reindex")
+
+
+import gc
+import tracemalloc
+
+
+class StreamingBillingTests(TestCase):
+    today = date(2024, 1, 31)
+
+    def _make_contracts(self, count, prefix):
+        customers = Customer.objects.bulk_create(
+            [Customer(name=f"{prefix}{i}", email=f"{prefix}{i}@example.com") for i in range(count)]
+        )
+        contracts = Contract.objects.bulk_create(
+            [
+                Contract(
+                    customer=customer,
+                    contract_number=f"{prefix}-{i}",
+                    start_date=date(2024, 1, 1),
+                    end_date=date(2024, 12, 31),
+                )
+                for i, customer in enumerate(customers)
+            ]
+        )
+        Service.objects.bulk_create(
+            [Service(contract=contract, name=name, value=Decimal("10.00")) for contract in contracts for name in "AB"]
+        )
+
+    def _peak(self, chunk_size):
+        # Collect the garbage cycles of earlier queries so that only this run is measured.
+        gc.collect()
+        tracemalloc.start()
+        try:
+            summary = billing.generate_invoices(self.today, chunk_size=chunk_size)
+            return summary, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_peak_memory_does_not_grow_with_the_contract_table(self):
+        # Warm up import-time and per-process caches outside the measurements.
+        self._make_contracts(5, "warm")
+        self._peak(chunk_size=25)
+        self._make_contracts(50, "small")
+        small_summary, small = self._peak(chunk_size=25)
+        self._make_contracts(400, "large")
+        large_summary, large = self._peak(chunk_size=25)
+        self.assertEqual((small_summary.invoices_created, large_summary.invoices_created), (50, 400))
+        # Eight times the contracts; what is left is garbage awaiting collection.
+        self.assertLess(large, small * 2)
+
+        # A single chunk holding the whole table is what the limit guards against.
+        Invoice.objects.all().delete()
+        Contract.objects.update(billed_through=None)
+        _, unchunked = self._peak(chunk_size=10_000)
+        self.assertGreater(unchunked, large * 3)
+
+    def test_chunks_are_keyset_pages(self):
+        self._make_contracts(25, "k")
+        with CaptureQueriesContext(connection) as ctx:
+            list(billing.plan_invoices(self.today, chunk_size=10))
+        pages = [query["sql"] for query in ctx.captured_queries if 'FROM "core_contract"' in query["sql"]]
+        self.assertEqual(len(pages), 3)
+        self.assertTrue(all("LIMIT 10" in sql and "OFFSET" not in sql for sql in pages))
+        self.assertTrue(all('"core_contract"."id" >' in sql for sql in pages[1:]))
+        self.assertNotIn('"contract_number"', pages[0])
+
+    def test_command_chunk_size(self):
+        self._make_contracts(5, "c")
+        out = StringIO()
+        with mock.patch("core.management.commands.generate_invoices.date") as mock_date:
+            mock_date.today.return_value = self.today
+            call_command("generate_invoices", "--chunk-size", "2", stdout=out)
+        self.assertIn("Created 5 invoices", out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command("generate_invoices", "--chunk-size", "0")
+
+
+class CatalogTests(TestCase):
+    def setUp(self):
+        customer = Customer.objects.create(name="Cat", email="cat@example.com")
+        self.contracts = [
+            Contract.objects.create(
+                customer=customer,
+                contract_number=f"CAT-{i}",
+                start_date=date(2024, 1, 15),
+                end_date=date(2024, 12, 31),
+            )
+            for i in range(5)
+        ]
+        # Services created out of contract order; contract 2 has none.
+        for contract in reversed(self.contracts):
+            if contract is not self.contracts[2]:
+                Service.objects.create(contract=contract, name="Hosting", value=Decimal("10.50"))
+        Service.objects.create(contract=self.contracts[0], name="Support", value=Decimal("2.00"))
+        Contract.objects.filter(pk=self.contracts[1].pk).update(billed_through=date(2024, 3, 1))
+
+    def test_chunks_hold_columns_and_yield_records(self):
+        with CaptureQueriesContext(connection) as ctx:
+            chunks = list(catalog.contract_chunks(Contract.objects.all(), 2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual(len(ctx.captured_queries), 6)
+        records = [record for chunk in chunks for record in chunk]
+        self.assertEqual([record.pk for record in records], [contract.pk for contract in self.contracts])
+        first, second, third = records[:3]
+        self.assertEqual(
+            first.services, (catalog.ServiceRecord("Hosting", 1050), catalog.ServiceRecord("Support", 200))
+        )
+        self.assertEqual(third.services, ())
+        self.assertEqual(
+            (first.start_date, first.end_date, first.billed_through),
+            (date(2024, 1, 15), date(2024, 12, 31), None),
+        )
+        self.assertEqual(second.billed_through, date(2024, 3, 1))
+        self.assertIs(chunks[0].service_names[0], chunks[0].service_names[2])
+
+    def test_invoice_records_build_models_at_write_time(self):
+        record = catalog.InvoiceRecord(1, 2, "2024-01", ("Hosting", "Support"), (1050, 199))
+        self.assertEqual(record.total_amount, Decimal("12.49"))
+        self.assertEqual(
+            [(item.service_name, item.service_amount) for item in record.items],
+            [("Hosting", Decimal("10.50")), ("Support", Decimal("1.99"))],
+        )
+        invoice = record.to_invoice()
+        self.assertEqual(
+            (invoice.customer_id, invoice.contract_id, invoice.total_amount, invoice.status),
+            (1, 2, Decimal("12.49"), Invoice.WAITING),
+        )
+        self.assertEqual(
+            [item.service_amount for item in record.to_items(invoice)], [Decimal("10.50"), Decimal("1.99")]
+        )
+
+    def test_chunk_is_several_times_smaller_than_model_instances(self):
+        customer = Customer.objects.get()
+        contracts = Contract.objects.bulk_create(
+            [
+                Contract(
+                    customer=customer,
+                    contract_number=f"M-{i}",
+                    start_date=date(2024, 1, 1),
+                    end_date=date(2025, 1, 1),
+                )
+                for i in range(300)
+            ]
+        )
+        Service.objects.bulk_create(
+            [
+                Service(contract=contract, name=name, value=Decimal("9.99"))
+                for contract in contracts
+                for name in ("A", "B")
+            ]
+        )
+        queryset = Contract.objects.filter(contract_number__startswith="M-")
+
+        def held(load):
+            gc.collect()
+            tracemalloc.start()
+            try:
+                loaded = load()
+                return tracemalloc.get_traced_memory()[0], loaded
+            finally:
+                tracemalloc.stop()
+
+        models, _ = held(lambda: list(queryset.only(*catalog.CONTRACT_FIELDS).prefetch_related("services")))
+        columns, _ = held(lambda: list(catalog.contract_chunks(queryset, 1000)))
+        self.assertGreater(models, columns * 5)
+
+
+from core import caching
+
+
+class ObjectCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caching.clear_objects()
+        self.addCleanup(cache.clear)
+        self.addCleanup(caching.clear_objects)
+        self.customer = Customer.objects.create(name="Obj", email="obj@example.com")
+        user = get_user_model().objects.create_user("cached", password="pw", is_staff=True)
+        self.client.force_login(user)
+
+    def test_local_cache_evicts_least_recently_used_and_expires(self):
+        now = [0.0]
+        local = caching.LocalCache(max_entries=2, ttl=10, clock=lambda: now[0])
+        local.set_many({"a": 1, "b": 2})
+        self.assertEqual(local.get("a"), 1)
+        local.set_many({"c": 3})
+        self.assertIsNone(local.get("b"))
+        now[0] = 10
+        self.assertIsNone(local.get("a"))
+        self.assertEqual(
+            local.stats(),
+            {"hits": 1, "misses": 2, "evictions": 1, "expirations": 1, "shared_hits": 0, "loads": 0,
+             "entries": 1, "max_entries": 2},
+        )
+        generation = local.generation
+        local.delete_many(["c"])
+        self.assertFalse(local.set_many({"c": 4}, generation))
+        self.assertIsNone(local.get("c"))
+
+    def test_reads_go_through_local_then_shared_cache(self):
+        with self.assertNumQueries(1):
+            customer = caching.get_customer(self.customer.pk)
+        with self.assertNumQueries(0):
+            again = caching.get_customer(self.customer.pk)
+        self.assertEqual(again.name, "Obj")
+        self.assertIsNot(again, customer)
+
+        caching.clear_objects()
+        with self.assertNumQueries(0):
+            caching.get_customer(self.customer.pk)
+            caching.get_customer(self.customer.pk)
+        stats = caching.object_cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["shared_hits"], stats["loads"]), (1, 1, 1, 0))
+
+    def test_get_many_loads_only_missing_rows(self):
+        other = Customer.objects.create(name="Other", email="other@example.com")
+        caching.get_customer(self.customer.pk)
+        with self.assertNumQueries(1):
+            customers = caching.get_many_customers([self.customer.pk, other.pk, 999_999, other.pk])
+        self.assertEqual(
+            {pk: customer.name for pk, customer in customers.items()},
+            {self.customer.pk: "Obj", other.pk: "Other"},
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(caching.get_many_customers([]), {})
+
+    def test_saves_deletes_and_imports_forget_cached_customers(self):
+        caching.get_customer(self.customer.pk)
+        self.customer.name = "Renamed"
+        self.customer.save()
+        self.assertEqual(caching.get_customer(self.customer.pk).name, "Renamed")
+
+        importers.CatalogImporter().import_batch(
+            [(1, {"customer_email": "obj@example.com", "customer_name": "Imported"})],
+            lambda *args: self.fail(args),
+        )
+        self.assertEqual(caching.get_customer(self.customer.pk).name, "Imported")
+
+        self.customer.delete()
+        self.assertIsNone(caching.get_customer(self.customer.pk))
+
+    def test_contracts_are_cached_with_their_services(self):
+        contract = Contract.objects.create(
+            customer=self.customer,
+            contract_number="OC-1",
+            start_date=date(2024, 1, 1),
+            end_date=date(2024, 12, 31),
+        )
+        service = Service.objects.create(contract=contract, name="Hosting", value=Decimal("10"))
+        with self.assertNumQueries(2):
+            cached = caching.get_contract_with_services(contract.pk)
+        with self.assertNumQueries(0):
+            cached = caching.get_contract_with_services(contract.pk)
+            self.assertEqual([s.name for s in cached.services.all()], ["Hosting"])
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                list(caching.get_many_contracts_with_services([contract.pk, 999_999])), [contract.pk]
+            )
+
+        service.value = Decimal("12")
+        service.save()
+        cached = caching.get_contract_with_services(contract.pk)
+        self.assertEqual([s.value for s in cached.services.all()], [Decimal("12")])
+
+        Service.objects.get(pk=service.pk).delete()
+        self.assertEqual(list(caching.get_contract_with_services(contract.pk).services.all()), [])
+
+        contract.contract_number = "OC-2"
+        contract.save()
+        self.assertEqual(caching.get_contract_with_services(contract.pk).contract_number, "OC-2")
+        contract.delete()
+        self.assertIsNone(caching.get_contract_with_services(contract.pk))
+
+    def test_api_pages_of_a_customer_read_it_once(self):
+        for month in ("2024-01", "2024-02"):
+            Invoice.objects.create(
+                customer=self.customer, reference_date=month, total_amount=1, status=Invoice.WAITING
+            )
+        url = reverse("core:api-invoices-list")
+        first = self.client.get(url, {"customer": self.customer.pk, "limit": 1}).json()
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.client.get(
+                url, {"customer": self.customer.pk, "limit": 1, "after": first["results"][0]["id"]}
+            )
+        self.assertEqual(
+            second.json()["customer"], {"id": self.customer.pk, "name": "Obj", "email": "obj@example.com"}
+        )
+        self.assertFalse([q for q in ctx.captured_queries if 'FROM "core_customer"' in q["sql"]])
+
+        report = self.client.get(reverse("core:instrumentation-report")).json()["object_cache"]
+        self.assertEqual((report["hits"], report["loads"]), (1, 1))
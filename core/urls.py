@@ -0,0 +1,18 @@
+from django.urls import path
+
+from . import api, views
+
+app_name = "core"
+
+urlpatterns = [
+    *(
+        path(f"api/{resource}/", views.api_list, {"resource": resource}, name=f"api-{resource}-list")
+        for resource in api.RESOURCES
+    ),
+    *(
+        path(f"api/{resource}/<int:pk>/", views.api_detail, {"resource": resource}, name=f"api-{resource}-detail")
+        for resource in api.RESOURCES
+    ),
+    path("reports/revenue/", views.revenue_report, name="revenue-report"),
+    path("metrics/instrumentation/", views.instrumentation_report, name="instrumentation-report"),
+]
@@ -1,3 +1,161 @@
-from django.shortcuts import render
+import json
+from decimal import Decimal
+from functools import wraps
 
-# Create your views here.
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.http import require_GET
+
+from . import api, billing, caching, instrumentation, rollups
+
+
+def _forbidden(user):
+    if user.is_active and user.is_staff:
+        return None
+    return JsonResponse({"detail": "Staff access required."}, status=403)
+
+
+def staff_required(view):
+    """Return 403 JSON responses to anyone but active staff users.
+
+    Works for sync and async views; the latter load the user with
+    ``request.auser()``.
+    """
+    if iscoroutinefunction(view):
+
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            return _forbidden(await request.auser()) or await view(request, *args, **kwargs)
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        return _forbidden(request.user) or view(request, *args, **kwargs)
+
+    return wrapper
+
+
+@staff_required
+def instrumentation_report(request):
+    """Per-view and per-command query and latency totals, and object cache counters, of this process."""
+    return JsonResponse(
+        {
+            "enabled": instrumentation.is_enabled(),
+            "views": instrumentation.get_stats(),
+            "object_cache": caching.object_cache_stats(),
+        }
+    )
+
+
+def _render(data):
+    return json.dumps(data, cls=DjangoJSONEncoder)
+
+
+async def _cached_json(request, key, version, last_modified, build):
+    """Answer with the cached payload of ``key`` or 304 when the client has it.
+
+    ``build`` is a coroutine function rendering the payload when the cached
+    one is missing or older than ``version``.
+    """
+    tag = caching.etag(key, version)
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=tag, last_modified=timestamp)
+    if response is None:
+        payload = await caching.acached_payload(key, version, build)
+        response = HttpResponse(payload, content_type="application/json")
+    response["ETag"] = tag
+    if timestamp is not None:
+        response["Last-Modified"] = http_date(timestamp)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@staff_required
+async def revenue_report(request):
+    """Invoiced revenue from the monthly rollups.
+
+    Query parameters: ``group_by`` (comma separated ``month``, ``customer``
+    and ``service``, default ``month``), ``from`` and ``to`` (``YYYY-MM``),
+    ``customer`` and ``service``. Responses are cached until the rollups
+    change.
+    """
+    params = request.GET
+    try:
+        for name in ("from", "to"):
+            if params.get(name):
+                billing.parse_month(params[name])
+        customer_id = None
+        if params.get("customer"):
+            if not params["customer"].isdigit():
+                raise ValueError("customer must be a customer id.")
+            customer_id = int(params["customer"])
+        group_by = [name for name in params.get("group_by", "month").split(",") if name]
+        rollups.check_group_by(group_by)
+    except ValueError as exc:
+        return JsonResponse({"detail": str(exc)}, status=400)
+
+    async def build():
+        rows = await sync_to_async(rollups.revenue_report)(
+            group_by,
+            date_from=params.get("from"),
+            date_to=params.get("to"),
+            customer_id=customer_id,
+            service_name=params.get("service"),
+        )
+        total = Decimal("0.00")
+        for row in rows:
+            total += row["amount"]
+            row["amount"] = str(row["amount"].quantize(Decimal("0.01")))
+        return _render({
+            "group_by": group_by,
+            "total": str(total.quantize(Decimal("0.01"))),
+            "results": rows,
+        })
+
+    last_change, rows = await caching.arollup_version()
+    key = f"core:report:revenue:{caching.etag(sorted(params.lists()))}"
+    return await _cached_json(request, key, f"{last_change}/{rows}", last_change, build)
+
+
+@require_GET
+@staff_required
+async def api_list(request, resource):
+    """One keyset-paginated page of an API resource."""
+    try:
+        page = await api.list_page(resource, request.GET)
+    except ValueError as exc:
+        return JsonResponse({"detail": str(exc)}, status=400)
+    next_after = page.pop("next_after")
+    page["next"] = None
+    if next_after is not None:
+        params = request.GET.copy()
+        params["after"] = next_after
+        page["next"] = f"{request.path}?{params.urlencode()}"
+    return JsonResponse(page)
+
+
+@require_GET
+@staff_required
+async def api_detail(request, resource, pk):
+    """A single API object with its nested rows.
+
+    Invoices and contracts carry ETag and Last-Modified validators and are
+    served from the cache while their ``updated_at`` is unchanged.
+    """
+    if resource in caching.VERSIONED:
+        version = await caching.aobject_version(resource, pk)
+        if version is None:
+            return JsonResponse({"detail": "Not found."}, status=404)
+
+        async def build():
+            return _render(await api.detail(resource, pk))
+
+        return await _cached_json(request, caching.payload_key(resource, pk), version.isoformat(), version, build)
+    row = await api.detail(resource, pk)
+    if row is None:
+        return JsonResponse({"detail": "Not found."}, status=404)
+    return JsonResponse(row)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,6 +49,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.instrumentation.InstrumentationMiddleware',
 ]
 
 ROOT_URLCONF = 'erp_project.urls'
@@ -73,13 +75,41 @@ WSGI_APPLICATION = 'erp_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite profile for small deployments, on unless ERP_SQLITE_PROFILE=0.
+# WAL lets readers run while a billing run writes, and IMMEDIATE
+# transactions take the write lock up front so concurrent writers wait up
+# to busy_timeout instead of failing with "database is locked".
+# Connections persist for ERP_CONN_MAX_AGE seconds. wsgi.py defaults it to
+# 600; it stays 0 elsewhere, as Django advises against persistent
+# connections under ASGI, where every request thread keeps its own.
+
+SQLITE_PROFILE = os.environ.get('ERP_SQLITE_PROFILE', '1') == '1'
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('ERP_SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
+if SQLITE_PROFILE:
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.environ.get('ERP_CONN_MAX_AGE', '0')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+            'transaction_mode': 'IMMEDIATE',
+        },
+    })
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -117,6 +147,73 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Holds rendered API and report payloads. Entries are checked against the
+# stored updated_at versions, so a per-process cache never serves stale data.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'erp',
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 10_000},
+    }
+}
+
+# Customers and contracts read through core.caching: an in-process LRU in
+# front of the cache above. Entries live TTL_SECONDS at most, which bounds how
+# long writes from other processes go unseen. Size MAX_ENTRIES from the
+# object_cache counters of the instrumentation report.
+
+OBJECT_CACHE = {
+    'MAX_ENTRIES': 5_000,
+    'TTL_SECONDS': 60,
+}
+
+# Query-count and latency instrumentation
+# Off unless ERP_INSTRUMENTATION=1; the middleware removes itself when off.
+
+INSTRUMENTATION = {
+    'ENABLED': os.environ.get('ERP_INSTRUMENTATION') == '1',
+    'LOG_FILE': BASE_DIR / 'logs' / 'instrumentation.log',
+    'TOP_DUPLICATES': 5,
+}
+
+if INSTRUMENTATION['ENABLED']:
+    INSTRUMENTATION['LOG_FILE'].parent.mkdir(exist_ok=True)
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'handlers': {
+            'instrumentation': {
+                'class': 'logging.handlers.RotatingFileHandler',
+                'filename': INSTRUMENTATION['LOG_FILE'],
+                'maxBytes': 10 * 1024 * 1024,
+                'backupCount': 5,
+            },
+        },
+        'loggers': {
+            'core.instrumentation': {
+                'handlers': ['instrumentation'],
+                'level': 'INFO',
+                'propagate': False,
+            },
+        },
+    }
+
+# Background jobs (core.jobs, run by the run_worker command)
+# Leases are renewed every third of LEASE_SECONDS; failed jobs are retried
+# after RETRY_DELAY_SECONDS, doubling on each attempt.
+
+JOBS = {
+    'EXPORT_ROOT': BASE_DIR / 'exports',
+    'LEASE_SECONDS': 60,
+    'MAX_ATTEMPTS': 3,
+    'RETRY_DELAY_SECONDS': 30,
+}
+
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
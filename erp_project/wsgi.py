@@ -12,5 +12,7 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'erp_project.settings')
+# Reuse database connections across requests; see the SQLite profile in settings.
+os.environ.setdefault('ERP_CONN_MAX_AGE', '600')
 
 application = get_wsgi_application()